@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""
+Time loading a directory of generated LZMA compressed UnityFS bundles,
+as unity_asset_stats.py does for bundle-level stats: loading them fully,
+only reading their headers (header_only), and reading the headers then
+the start of each node, which decompresses the blocks it is in.
+"""
+import lzma
+import os
+import struct
+import sys
+import tempfile
+from timeit import default_timer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import unitypack
+from unitypack.environment import UnityEnvironment
+
+BLOCK_SIZE = 128 * 1024
+LZMA_FILTERS = [{"id": lzma.FILTER_LZMA1, "dict_size": 1 << 20, "lc": 3, "lp": 0, "pb": 2}]
+
+
+def lzma_block(data):
+	# Unity's LZMA blocks are raw LZMA1 streams after 5 bytes of properties
+	props = (LZMA_FILTERS[0]["pb"] * 5 + LZMA_FILTERS[0]["lp"]) * 9 + LZMA_FILTERS[0]["lc"]
+	ret = struct.pack("<BI", props, LZMA_FILTERS[0]["dict_size"])
+	return ret + lzma.compress(data, format=lzma.FORMAT_RAW, filters=LZMA_FILTERS)
+
+
+def make_blocks(size):
+	# about 2:1 compressible data, shared by all the bundles
+	payload = os.urandom(size).translate(bytes(range(16)) * 16)
+	return [
+		(len(payload[i:i + BLOCK_SIZE]), lzma_block(payload[i:i + BLOCK_SIZE]))
+		for i in range(0, len(payload), BLOCK_SIZE)
+	]
+
+
+def make_bundle(name, node_sizes, blocks):
+	block_info = bytes(16) + struct.pack(">i", len(blocks))
+	for uncompressed_size, block in blocks:
+		block_info += struct.pack(">IIh", uncompressed_size, len(block), 1)
+	block_info += struct.pack(">i", len(node_sizes))
+	offset = 0
+	for i, size in enumerate(node_sizes):
+		node_name = "CAB-%s%s" % (name, ".resS" if i else "")
+		block_info += struct.pack(">qqi", offset, size, 4) + node_name.encode() + b"\0"
+		offset += size
+
+	header = b"UnityFS\0" + struct.pack(">i", 6) + b"5.x.x\0" + b"5.6.0f3\0"
+	size = len(header) + 20 + len(block_info) + sum(len(block) for _, block in blocks)
+	header += struct.pack(">qIII", size, len(block_info), len(block_info), 0x40)
+	return header + block_info + b"".join(block for _, block in blocks)
+
+
+def load_all(paths, header_only=False, read_nodes=False):
+	env = UnityEnvironment()
+	start = default_timer()
+	for path in paths:
+		with open(path, "rb") as f:
+			bundle = unitypack.load(f, env, header_only=header_only)
+			if read_nodes:
+				storage = bundle.block_storage
+				for ofs, size, status, name in bundle.nodes:
+					storage.seek(ofs)
+					storage.read(16)
+	return default_timer() - start
+
+
+def main():
+	num_bundles = 200
+	with tempfile.TemporaryDirectory() as dirname:
+		node_sizes = (300 * 1024, 500 * 1024)
+		blocks = make_blocks(sum(node_sizes))
+		paths = []
+		for i in range(num_bundles):
+			paths.append(os.path.join(dirname, "bundle%i" % (i)))
+			with open(paths[-1], "wb") as f:
+				f.write(make_bundle("%032x" % (i), node_sizes, blocks))
+
+		print("%i bundles, load:        %8.1f ms" % (num_bundles, load_all(paths) * 1000))
+		print("%i bundles, header only: %8.1f ms" % (num_bundles, load_all(paths, header_only=True) * 1000))
+		print("%i bundles, read nodes:  %8.1f ms" % (num_bundles, load_all(paths, read_nodes=True) * 1000))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""
+Time resolving references across bundles with UnityEnvironment, in a
+directory of small generated UnityFS bundles named after their CAB names,
+as in Unity builds: discovering and loading every bundle from the first
+one, looking up assets of loaded bundles, and looking up missing ones.
+Discovered bundles are read through the bounded file pool of the
+environment.
+"""
+import os
+import struct
+import sys
+import tempfile
+from timeit import default_timer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from unitypack.environment import UnityEnvironment
+
+
+def make_bundle(name):
+	# an uncompressed UnityFS bundle with one node, which is never parsed
+	data = bytes(16)
+	cab = ("CAB-" + name).encode()
+	block_info = bytes(16) + struct.pack(">iIIhi", 1, len(data), len(data), 0, 1)
+	block_info += struct.pack(">qqi", 0, len(data), 4) + cab + b"\0"
+	header = b"UnityFS\0" + struct.pack(">i", 6) + b"5.x.x\0" + b"5.6.0f3\0"
+	size = len(header) + 20 + len(block_info) + len(data)
+	header += struct.pack(">qIII", size, len(block_info), len(block_info), 0x40)
+	return header + block_info + data
+
+
+def timed(f):
+	start = default_timer()
+	f()
+	return default_timer() - start
+
+
+def main():
+	num_bundles = 2000
+	with tempfile.TemporaryDirectory() as dirname:
+		names = ["%032x" % (i * 2654435761) for i in range(num_bundles)]
+		for name in names:
+			with open(os.path.join(dirname, name), "wb") as f:
+				f.write(make_bundle(name))
+
+		env = UnityEnvironment(base_path=dirname)
+		with open(os.path.join(dirname, names[0]), "rb") as f:
+			env.load(f)
+			urls = ["archive:/CAB-%s/CAB-%s" % (name, name) for name in names]
+
+			def resolve():
+				for url in urls:
+					env.get_asset(url)
+
+			def miss():
+				for url in urls:
+					try:
+						env.get_asset(url + "-missing")
+					except KeyError:
+						pass
+					try:
+						env.get_asset("archive:/CAB-missing/CAB-missing")
+					except NotImplementedError:
+						pass
+
+			print("discover %i bundles: %8.1f ms" % (num_bundles, timed(resolve) * 1000))
+			print("resolve loaded:        %8.1f ms" % (timed(resolve) * 1000))
+			print("missing assets:        %8.1f ms" % (timed(miss) * 1000))
+			print("open files:            %8i (max %i)" % (len(env.file_pool), env.file_pool.max_files))
+			env.file_pool.close()
+
+
+if __name__ == "__main__":
+	main()
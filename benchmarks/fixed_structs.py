@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""
+Compare reading and skipping fixed-size structs (vectors, quaternions,
+bounds) using their precomputed layouts against walking them field by
+field, on a Transform-like object with a vertex array.
+"""
+import os
+import struct
+import sys
+from timeit import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from unitypack.type import TypeTree
+from unitypack.typereader import compile_skipper, compile_type_tree
+
+
+def vector_nodes(type, name, fields, depth):
+	return [(1, depth, False, type, name, 4 * len(fields), 0, 0)] + [
+		(1, depth + 1, False, "float", field, 4, 0, 0) for field in fields
+	]
+
+
+def make_tree(fixed):
+	nodes = [(1, 0, False, "Transform", "Base", -1, 0, 0)]
+	nodes += vector_nodes("Quaternionf", "m_LocalRotation", "xyzw", 1)
+	nodes += vector_nodes("Vector3f", "m_LocalPosition", "xyz", 1)
+	nodes += vector_nodes("Vector3f", "m_LocalScale", "xyz", 1)
+	nodes += [(1, 1, False, "AABB", "m_Bounds", 24, 0, 0)]
+	nodes += vector_nodes("Vector3f", "m_Center", "xyz", 2)
+	nodes += vector_nodes("Vector3f", "m_Extent", "xyz", 2)
+	nodes += [
+		(1, 1, False, "vector", "m_Vertices", -1, 0, 0),
+		(1, 2, True, "Array", "Array", -1, 0, 0),
+		(1, 3, False, "int", "size", 4, 0, 0),
+	]
+	nodes += vector_nodes("Vector3f", "data", "xyz", 3)
+
+	tree = TypeTree(17)
+	tree.load_nodes(nodes)
+	if not fixed:
+		disable_layouts(tree)
+	return tree
+
+
+def disable_layouts(tree):
+	# force the field by field readers
+	tree._layout = None
+	for child in tree.children:
+		disable_layouts(child)
+
+
+def make_data(num_vertices):
+	data = struct.pack("<4f", 0, 0, 0, 1)
+	data += struct.pack("<3f", 1, 2, 3) + struct.pack("<3f", 1, 1, 1)
+	data += struct.pack("<6f", 0, 0, 0, 1, 1, 1)
+	data += struct.pack("<i", num_vertices)
+	data += b"".join(struct.pack("<3f", i, i, i) for i in range(num_vertices))
+	return data
+
+
+def main():
+	number = 2000
+	for num_vertices in (0, 100, 10000):
+		data = make_data(num_vertices)
+		field_by_field = compile_type_tree(make_tree(fixed=False))
+		fixed = compile_type_tree(make_tree(fixed=True))
+		# the Transform engine class wraps the decoded fields
+		assert field_by_field(None, data, 0)[0]._obj == fixed(None, data, 0)[0]._obj
+
+		n = max(number // (num_vertices // 100 + 1), 10)
+		t1 = timeit(lambda: field_by_field(None, data, 0), number=n)
+		t2 = timeit(lambda: fixed(None, data, 0), number=n)
+		print("%6i vertices, read: field by field %9.1f us, layout %9.1f us (%.1fx)" % (
+			num_vertices, t1 * 1e6 / n, t2 * 1e6 / n, t1 / t2
+		))
+
+		skip_field_by_field = compile_skipper(make_tree(fixed=False))
+		skip_fixed = compile_skipper(make_tree(fixed=True))
+		assert skip_field_by_field(None, data, 0) == skip_fixed(None, data, 0) == len(data)
+		t1 = timeit(lambda: skip_field_by_field(None, data, 0), number=n)
+		t2 = timeit(lambda: skip_fixed(None, data, 0), number=n)
+		print("%6i vertices, skip: field by field %9.1f us, layout %9.1f us (%.1fx)" % (
+			num_vertices, t1 * 1e6 / n, t2 * 1e6 / n, t1 / t2
+		))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+"""
+Measure the per-instance memory footprint of the slotted core classes
+against equivalent classes with a per-instance __dict__ (what they used
+to be), and the footprint of the default type trees from structs.dat.
+"""
+import os
+import sys
+import tracemalloc
+from io import BytesIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from unitypack.asset import AssetRef
+from unitypack.asset_dependencies import AssetDependencyObject, AssetDependencyPPtr
+from unitypack.object import ObjectInfo, ObjectPointer
+from unitypack.resources import get_resource
+from unitypack.type import TypeMetadata, TypeTree
+from unitypack.utils import BinaryReader
+
+
+def with_dict(cls):
+	# A subclass without __slots__ gets a __dict__, like the classes used to
+	return type(cls.__name__, (cls, ), {})
+
+
+def measure(factory, count):
+	tracemalloc.start()
+	before = tracemalloc.take_snapshot()
+	instances = [factory() for i in range(count)]
+	after = tracemalloc.take_snapshot()
+	tracemalloc.stop()
+	size = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+	# don't count the list holding the instances
+	size -= sys.getsizeof(instances)
+	return size / count
+
+
+def make_type_tree(cls):
+	def factory():
+		ret = cls(17)
+		ret.type = "Vector3f"
+		ret.name = "m_LocalPosition"
+		ret.size = 12
+		ret.flags = 0x4000
+		return ret
+	return factory
+
+
+def make_object_info(cls):
+	def factory():
+		ret = cls(None)
+		ret.path_id = 1 << 40
+		ret.data_offset = 1 << 20
+		ret.size = 128
+		ret.type_id = 4
+		ret.class_id = 4
+		return ret
+	return factory
+
+
+def make_object_pointer(cls):
+	def factory():
+		ret = cls(None, None)
+		ret.file_id = 1
+		ret.path_id = 1 << 40
+		return ret
+	return factory
+
+
+def make_asset_ref(cls):
+	def factory():
+		ret = cls(None)
+		ret.asset_path = ""
+		ret.guid = None
+		ret.type = 0
+		ret.file_path = "archive:/CAB-0123456789abcdef/CAB-0123456789abcdef"
+		ret.asset = None
+		return ret
+	return factory
+
+
+def make_dependency_object(cls):
+	def factory():
+		ret = cls()
+		ret.path_id = 1 << 40
+		return ret
+	return factory
+
+
+def make_dependency_pptr(cls):
+	return lambda: cls(None)
+
+
+def count_nodes(tree):
+	return 1 + sum(count_nodes(child) for child in tree.children)
+
+
+def main():
+	count = 20000
+	classes = (
+		(TypeTree, make_type_tree),
+		(ObjectInfo, make_object_info),
+		(ObjectPointer, make_object_pointer),
+		(AssetRef, make_asset_ref),
+		(AssetDependencyObject, make_dependency_object),
+		(AssetDependencyPPtr, make_dependency_pptr),
+	)
+
+	print("%-24s %10s %10s" % ("bytes per instance", "__dict__", "__slots__"))
+	per_node = {}
+	for cls, factory in classes:
+		old = measure(factory(with_dict(cls)), count)
+		new = measure(factory(cls), count)
+		per_node[cls] = (old, new)
+		print("%-24s %10.0f %10.0f" % (cls.__name__, old, new))
+
+	with open(get_resource("structs.dat"), "rb") as f:
+		data = f.read()
+	tracemalloc.start()
+	metadata = TypeMetadata(None)
+	metadata.load(BinaryReader(BytesIO(data)), format=15)
+	size, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	nodes = sum(count_nodes(tree) for tree in metadata.type_trees.values())
+	old, new = per_node[TypeTree]
+	print()
+	print("structs.dat: %i type trees, %i nodes" % (len(metadata.type_trees), nodes))
+	print("  loaded size:           %8.1f KB" % (size / 1024))
+	print("  with __dict__ nodes:  ~%8.1f KB" % ((size + nodes * (old - new)) / 1024))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""
+Time extracting the indices and vertex attributes of a mesh (MeshData)
+and writing it to an OBJ file, on Unity 5 style meshes with positions,
+normals, colors, UVs and tangents in one vertex stream. Also report
+the peak memory of the export, written to a file or returned as a string.
+"""
+import os
+import random
+import struct
+import sys
+import tracemalloc
+from timeit import default_timer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from unitypack.engine.mesh import Mesh, SubMesh, VertexData
+from unitypack.export import MeshData, OBJMesh
+
+# (format, dimension) of the 8 channels: vertex, normal, color, uv1-4, tangent
+CHANNELS = ((0, 3), (0, 3), (2, 4), (0, 2), (0, 0), (0, 0), (0, 0), (0, 4))
+
+
+def make_mesh(num_vertices, num_triangles):
+	channels = []
+	offset = 0
+	for format, dimension in CHANNELS:
+		channels.append({"stream": 0, "offset": offset, "format": format, "dimension": dimension})
+		offset += dimension * (4 if format == 0 else 1)
+
+	r = random.Random(0)
+	vertex = struct.pack("<6f4B6f", *[r.random() for i in range(6)] + [255] * 4 + [r.random() for i in range(6)])
+	vertex_data = VertexData({
+		"m_Channels": channels,
+		"m_DataSize": vertex * num_vertices,
+		"m_VertexCount": num_vertices,
+	})
+	indices = [r.randrange(num_vertices) for i in range(3 * num_triangles)]
+	index_format = 1 if num_vertices > 0xffff else 0
+	index_buffer = struct.pack("<%i%s" % (len(indices), "I" if index_format else "H"), *indices)
+	return Mesh({
+		"m_Name": "mesh",
+		"m_SubMeshes": [SubMesh({"firstByte": 0, "indexCount": len(indices), "topology": 0})],
+		"m_IndexBuffer": index_buffer,
+		"m_IndexFormat": index_format,
+		"m_MeshCompression": 0,
+		"m_VertexData": vertex_data,
+	})
+
+
+def timed(f):
+	start = default_timer()
+	ret = f()
+	return ret, default_timer() - start
+
+
+def peak_memory(f):
+	tracemalloc.start()
+	try:
+		f()
+		return tracemalloc.get_traced_memory()[1]
+	finally:
+		tracemalloc.stop()
+
+
+def write_devnull(mesh):
+	with open(os.devnull, "w") as f:
+		return mesh.write(f)
+
+
+def main():
+	# imports numpy
+	MeshData(make_mesh(3, 1))
+	for num_vertices in (1000, 50000, 500000):
+		mesh = make_mesh(num_vertices, num_vertices * 2)
+		mesh_data, t = timed(lambda: MeshData(mesh))
+		assert len(mesh_data.vertices) == num_vertices
+		print("%6i vertices, extract: %8.2f ms" % (num_vertices, t * 1000))
+		obj_mesh = OBJMesh(mesh)
+		written, t = timed(lambda: write_devnull(obj_mesh))
+		print("%6i vertices, write:   %8.2f ms (%.1f MB)" % (num_vertices, t * 1000, written / 1e6))
+		print("%6i vertices, peak memory: write %.1f MB, export %.1f MB" % (
+			num_vertices, peak_memory(lambda: write_devnull(obj_mesh)) / 1e6,
+			peak_memory(obj_mesh.export) / 1e6
+		))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""
+Compare reading arrays of numbers and of fixed-size structs (vertices,
+bind poses, bone hashes) as lists of Python objects against reading
+them as NumPy arrays, on a Mesh-like object. Requires numpy.
+"""
+import os
+import struct
+import sys
+from timeit import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from unitypack.type import TypeTree
+from unitypack.typereader import compile_type_tree
+
+
+def vector_nodes(name, elem_nodes, depth):
+	return [
+		(1, depth, False, "vector", name, -1, 0, 0),
+		(1, depth + 1, True, "Array", "Array", -1, 0, 0),
+		(1, depth + 2, False, "int", "size", 4, 0, 0),
+	] + elem_nodes(depth + 2)
+
+
+def vector3f(depth):
+	return [(1, depth, False, "Vector3f", "data", 12, 0, 0)] + [
+		(1, depth + 1, False, "float", field, 4, 0, 0) for field in "xyz"
+	]
+
+
+def matrix4x4f(depth):
+	return [(1, depth, False, "Matrix4x4f", "data", 64, 0, 0)] + [
+		(1, depth + 1, False, "float", "e%i%i" % (row, col), 4, 0, 0)
+		for col in range(4) for row in range(4)
+	]
+
+
+def make_tree():
+	nodes = [(1, 0, False, "Mesh", "Base", -1, 0, 0)]
+	nodes += vector_nodes("m_Vertices", vector3f, 1)
+	nodes += vector_nodes("m_BindPose", matrix4x4f, 1)
+	nodes += vector_nodes("m_BoneNameHashes", lambda depth: [(1, depth, False, "unsigned int", "data", 4, 0, 0)], 1)
+	nodes += vector_nodes("m_Weights", lambda depth: [(1, depth, False, "float", "data", 4, 0, 0)], 1)
+	tree = TypeTree(17)
+	tree.load_nodes(nodes)
+	return tree
+
+
+def make_data(num_vertices, num_bones):
+	data = struct.pack("<i", num_vertices)
+	data += b"".join(struct.pack("<3f", i, i, i) for i in range(num_vertices))
+	data += struct.pack("<i", num_bones) + struct.pack("<16f", *range(16)) * num_bones
+	data += struct.pack("<i", num_bones) + b"".join(struct.pack("<I", i) for i in range(num_bones))
+	data += struct.pack("<i", num_vertices) + struct.pack("<f", 0.5) * num_vertices
+	return data
+
+
+def main():
+	number = 2000
+	for num_vertices, num_bones in ((10, 1), (1000, 20), (100000, 100)):
+		data = make_data(num_vertices, num_bones)
+		read_lists = compile_type_tree(make_tree())
+		read_numpy = compile_type_tree(make_tree(), numpy_arrays=True)
+		# the Mesh engine class wraps the decoded fields
+		lists = read_lists(None, data, 0)[0]._obj
+		arrays = read_numpy(None, data, 0)[0]._obj
+		assert [dict(v) for v in lists["m_Vertices"]] == [
+			dict(zip("xyz", v)) for v in arrays["m_Vertices"].tolist()
+		]
+		assert lists["m_BoneNameHashes"] == arrays["m_BoneNameHashes"].tolist()
+
+		n = max(number // (num_vertices // 100 + 1), 10)
+		t1 = timeit(lambda: read_lists(None, data, 0), number=n)
+		t2 = timeit(lambda: read_numpy(None, data, 0), number=n)
+		print("%6i vertices, %3i bones: lists %10.1f us, numpy %7.1f us (%.0fx)" % (
+			num_vertices, num_bones, t1 * 1e6 / n, t2 * 1e6 / n, t1 / t2
+		))
+
+
+if __name__ == "__main__":
+	main()
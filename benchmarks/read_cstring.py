@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""
+Compare BinaryReader.read_cstring against the previous byte-at-a-time
+implementation, on a buffer laid out like an old-style type tree
+(type and field names followed by integer fields).
+"""
+import os
+import sys
+from io import BytesIO
+from timeit import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from unitypack.utils import BinaryReader, MemoryReader
+
+
+def read_cstring_bytewise(buf):
+	ret = []
+	c = b""
+	while c != b"\0":
+		ret.append(c)
+		c = buf.read(1)
+		if not c:
+			raise ValueError("Unterminated string: %r" % (ret))
+	return b"".join(ret)
+
+
+def make_buffer(count):
+	names = [b"m_Name", b"PPtr<GameObject>", b"m_LocalPosition", b"vector", b"Array", b"archive:/CAB-0123456789abcdef/CAB-0123456789abcdef"]
+	data = bytearray()
+	for i in range(count):
+		data += names[i % len(names)] + b"\0" + b"\1\0\0\0" * 6
+	return bytes(data)
+
+
+def read_all(reader, count, read_cstring):
+	for i in range(count):
+		read_cstring()
+		reader.read_struct("6i")
+
+
+def main():
+	count = 20000
+	data = make_buffer(count)
+
+	def bytewise():
+		reader = BinaryReader(BytesIO(data))
+		read_all(reader, count, lambda: read_cstring_bytewise(reader))
+
+	def chunked():
+		reader = BinaryReader(BytesIO(data))
+		read_all(reader, count, reader.read_cstring)
+
+	def memory():
+		reader = MemoryReader(data)
+		read_all(reader, count, reader.read_cstring)
+
+	number = 5
+	baseline = timeit(bytewise, number=number)
+	print("%-24s %8.1f ms" % ("byte at a time", baseline * 1000 / number))
+	for name, func in (("chunked (file-like)", chunked), ("find (memory)", memory)):
+		t = timeit(func, number=number)
+		print("%-24s %8.1f ms  (%.1fx)" % (name, t * 1000 / number, baseline / t))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""
+Time the startup cost of unitypack in fresh interpreters: the import
+itself, and the first lookup of a type tree in the default structs.dat
+database, which is what reading an asset without embedded type trees
+pays for first. Then break down where the import time of
+unitypack.asset goes, using -X importtime.
+"""
+import os
+import subprocess
+import sys
+from timeit import default_timer
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+SNIPPETS = (
+	("python", "pass"),
+	("import unitypack", "import unitypack"),
+	("import unitypack.asset", "import unitypack.asset"),
+	("first default type tree", """
+import unitypack.asset
+from unitypack.type import TypeMetadata
+TypeMetadata.default(None).type_trees[4].pretty()
+"""),
+	("all default type trees", """
+import unitypack.asset
+from unitypack.type import TypeMetadata
+from unitypack.resources import get_resource
+from unitypack.utils import BinaryReader
+with open(get_resource("structs.dat"), "rb") as f:
+	TypeMetadata(None).load(BinaryReader(f), format=15)
+"""),
+)
+
+
+def run(code, number):
+	best = None
+	for i in range(number):
+		start = default_timer()
+		subprocess.check_call([sys.executable, "-c", code], cwd=ROOT)
+		t = default_timer() - start
+		if best is None or t < best:
+			best = t
+	return best
+
+
+def import_times(module):
+	"""
+	Return (cumulative microseconds, module name) for the modules imported
+	by module, slowest first.
+	"""
+	output = subprocess.run(
+		[sys.executable, "-X", "importtime", "-c", "import " + module],
+		cwd=ROOT, stderr=subprocess.PIPE, universal_newlines=True, check=True
+	).stderr
+	ret = []
+	for line in output.splitlines():
+		if not line.startswith("import time:") or "cumulative" in line:
+			continue
+		self_us, cumulative_us, name = line[len("import time:"):].split("|")
+		ret.append((int(cumulative_us), name.strip()))
+	return sorted(ret, reverse=True)
+
+
+def main():
+	number = 10
+	for name, code in SNIPPETS:
+		print("%-28s %8.1f ms" % (name, run(code, number) * 1000))
+
+	print()
+	print("slowest imports of unitypack.asset (cumulative):")
+	for cumulative_us, name in import_times("unitypack.asset")[:10]:
+		print("  %-26s %8.1f ms" % (name, cumulative_us / 1000))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,340 @@
+"""
+Builders for serialized files and bundles, random object payloads, and
+the reference interpreter the compiled type tree readers are checked
+against.
+"""
+import hashlib
+import lzma
+import struct
+from binascii import hexlify
+from collections import OrderedDict
+from uuid import UUID
+from unitypack.object import ObjectPointer, load_object
+from unitypack.type import PRIMITIVE_FORMATS, TypeTree, TypeTreeHint
+
+
+ALIGN = 0x4000
+UNITY_VERSION = "5.6.0f3"
+
+
+def node(type, name, size=-1, flags=0, is_array=False, children=()):
+	return (type, name, size, flags, is_array, list(children))
+
+
+def string(name, flags=0):
+	return node("string", name, children=[
+		node("Array", "Array", flags=ALIGN, is_array=True, children=[node("int", "size", 4), node("char", "data", 1)]),
+	])
+
+
+def vector(name, element, flags=0):
+	return node("vector", name, flags=flags, children=[
+		node("Array", "Array", flags=flags, is_array=True, children=[node("int", "size", 4), element]),
+	])
+
+
+def pptr(name):
+	return node("PPtr<GameObject>", name, 12, children=[node("int", "m_FileID", 4), node("SInt64", "m_PathID", 8)])
+
+
+VECTOR3 = node("Vector3f", "data", 12, children=[node("float", "x", 4), node("float", "y", 4), node("float", "z", 4)])
+
+
+def packed(name):
+	# a fixed-size struct with alignment inside it; as in Unity's type
+	# trees, its size does not count the pad bytes
+	return node("Packed", name, 8, children=[
+		node("UInt8", "a", 1), node("float", "b", 4), node("SInt16", "c", 2), node("bool", "d", 1, ALIGN),
+	])
+
+
+SPEC = node("Texture2D", "Base", children=[
+	string("m_Name"),
+	node("int", "m_Width", 4),
+	node("UInt16", "m_Short", 2),
+	node("float", "m_Float", 4),
+	node("bool", "m_Bool", 1, ALIGN),
+	packed("m_Packed"),
+	node("SInt8", "m_Byte", 1),
+	node("float", "m_AlignedFloat", 4),
+	node("SInt8", "m_Byte2", 1),
+	node("UInt64", "m_Long", 8),
+	pptr("m_GameObject"),
+	node("GUID", "m_GUID", 16, children=[node("unsigned int", "data[%i]" % (i), 4) for i in range(4)]),
+	vector("m_Vertices", VECTOR3),
+	vector("m_Packs", packed("data")),
+	vector("image data", node("UInt8", "data", 1), ALIGN),
+	vector("m_Shorts", node("SInt16", "data", 2), ALIGN),
+	vector("m_Pointers", pptr("data")),
+	vector("m_Names", string("data")),
+	node("map", "m_Container", children=[
+		node("Array", "Array", is_array=True, children=[
+			node("int", "size", 4),
+			node("pair", "data", children=[string("first"), node("int", "second", 4)]),
+		]),
+	]),
+	node("StreamedData", "m_StreamData", children=[
+		node("unsigned int", "offset", 4), node("unsigned int", "size", 4), string("path"),
+	]),
+	node("SInt64", "m_Last", 8),
+])
+
+
+def build_tree(spec, format=17):
+	tree = TypeTree(format)
+	tree.type, tree.name, tree.size, tree.flags, tree.is_array, children = spec
+	tree.type_hint = tree.get_type_hint_index(tree.type)
+	for child in children:
+		tree.children.append(build_tree(child, format))
+	return tree
+
+
+def _align(out):
+	out += bytes(-len(out) & 3)
+
+
+def _random_primitive(fmt, rng):
+	if fmt == "?":
+		return rng.random() < 0.5
+	elif fmt == "f":
+		return rng.choice((0.0, -1.5, 2.25, 1e10))
+	size = struct.calcsize(fmt)
+	if fmt.islower():
+		return rng.randrange(-1 << (size * 8 - 1), 1 << (size * 8 - 1))
+	return rng.randrange(1 << (size * 8))
+
+
+def write_random(tree, rng, out):
+	"""
+	Append a random value of the type tree to out, aligned relative to
+	the start of out.
+	"""
+	th = tree.type_hint
+	if th in PRIMITIVE_FORMATS:
+		if th == TypeTreeHint.Float:
+			_align(out)
+		fmt = PRIMITIVE_FORMATS[th]
+		out += struct.pack("<" + fmt, _random_primitive(fmt, rng))
+	elif th == TypeTreeHint.String:
+		text = "".join(rng.choice("ab/é") for i in range(rng.randrange(8))).encode("utf-8")
+		out += struct.pack("<I", len(text)) + text
+		if tree.children[0].post_align:
+			_align(out)
+	elif th == TypeTreeHint.GUID:
+		out += bytes(rng.randrange(256) for i in range(16))
+	elif tree.type.startswith("PPtr<"):
+		out += struct.pack("<iq", rng.randrange(2), rng.choice((0, rng.randrange(1, 1000))))
+	elif tree.is_array or (tree.children and tree.children[0].is_array):
+		array = tree if tree.is_array else tree.children[0]
+		element = array.children[1]
+		count = rng.randrange(6)
+		out += struct.pack("<i", count)
+		if element.type_hint in (TypeTreeHint.Char, TypeTreeHint.UInt8):
+			out += bytes(rng.randrange(256) for i in range(count))
+		else:
+			for i in range(count):
+				write_random(element, rng, out)
+		if array.post_align:
+			_align(out)
+	else:
+		for child in tree.children:
+			write_random(child, rng, out)
+	if tree.post_align:
+		_align(out)
+	return out
+
+
+def random_payload(tree, rng):
+	return bytes(write_random(tree, rng, bytearray()))
+
+
+_PRIMITIVE_READERS = {
+	TypeTreeHint.Bool: "read_boolean",
+	TypeTreeHint.SInt8: "read_byte",
+	TypeTreeHint.UInt8: "read_ubyte",
+	TypeTreeHint.SInt16: "read_int16",
+	TypeTreeHint.UInt16: "read_uint16",
+	TypeTreeHint.SInt32: "read_int",
+	TypeTreeHint.UInt32: "read_uint",
+	TypeTreeHint.SInt64: "read_int64",
+	TypeTreeHint.UInt64: "read_uint64",
+	TypeTreeHint.TypePtr: "read_uint",
+}
+
+
+def reference_read(obj, tree, buf):
+	"""
+	Read a value of the type tree from a BinaryReader the way the type
+	tree interpreter did before readers were compiled.
+	"""
+	align = False
+	pos = buf.tell()
+	th = tree.type_hint
+	if th in _PRIMITIVE_READERS:
+		result = getattr(buf, _PRIMITIVE_READERS[th])()
+	elif th == TypeTreeHint.Float:
+		buf.align()
+		result = buf.read_float()
+	elif th == TypeTreeHint.String:
+		result = buf.read_string(buf.read_uint())
+		align = tree.children[0].post_align
+	elif th == TypeTreeHint.GUID:
+		result = str(UUID(hexlify(buf.read(16)).decode("utf-8")))
+	elif tree.type.startswith("PPtr<"):
+		result = ObjectPointer(tree, obj.asset)
+		result.load(buf)
+		if not result:
+			result = None
+	elif tree.is_array or (tree.children and tree.children[0].is_array):
+		array = tree if tree.is_array else tree.children[0]
+		align = array.post_align
+		size = buf.read_int()
+		element = array.children[1]
+		if element.type_hint in (TypeTreeHint.Char, TypeTreeHint.UInt8):
+			result = buf.read(size)
+		else:
+			result = [reference_read(obj, element, buf) for i in range(size)]
+	elif tree.type == "pair":
+		result = (reference_read(obj, tree.children[0], buf), reference_read(obj, tree.children[1], buf))
+	else:
+		result = OrderedDict()
+		for child in tree.children:
+			result[child.name] = reference_read(obj, child, buf)
+		result = load_object(tree, result)
+	if tree.size > 0 and buf.tell() - pos < tree.size:
+		raise ValueError("Expected to read %r bytes of %r, but only read %r bytes" % (tree.size, tree, buf.tell() - pos))
+	if align or tree.post_align:
+		buf.align()
+	return result
+
+
+def plain(value):
+	"""
+	Convert a read value to plain Python types, for comparisons.
+	"""
+	if hasattr(value, "_obj"):
+		return (type(value).__name__, plain(value._obj))
+	elif isinstance(value, dict):
+		return {k: plain(v) for k, v in value.items()}
+	elif isinstance(value, (list, tuple)):
+		return [plain(v) for v in value]
+	elif isinstance(value, ObjectPointer):
+		return ("PPtr", value.file_id, value.path_id)
+	elif isinstance(value, (bytearray, memoryview)):
+		return bytes(value)
+	elif hasattr(value, "dtype") and value.dtype.names:
+		# records of a NumPy structured array
+		return [plain(dict(zip(value.dtype.names, row))) for row in value.tolist()]
+	elif hasattr(value, "tolist"):
+		return plain(value.tolist())
+	return value
+
+
+def _tree_blob(spec):
+	nodes = []
+	strings = bytearray()
+	offsets = {}
+
+	def string_offset(s):
+		if s not in offsets:
+			offsets[s] = len(strings)
+			strings.extend(s.encode("utf-8") + b"\0")
+		return offsets[s]
+
+	def walk(n, depth):
+		type, name, size, flags, is_array, children = n
+		nodes.append(struct.pack(
+			"<hBbIIiIi", 1, depth, int(is_array), string_offset(type), string_offset(name), size, len(nodes), flags
+		))
+		for child in children:
+			walk(child, depth + 1)
+
+	walk(spec, 0)
+	return struct.pack("<II", len(nodes), len(strings)) + b"".join(nodes) + bytes(strings)
+
+
+def serialized_file(objects, spec=SPEC, class_id=28):
+	"""
+	A format 17 serialized file holding objects, a list of
+	(path_id, payload) of the type described by spec.
+	"""
+	meta = bytearray(UNITY_VERSION.encode("utf-8") + b"\0")
+	meta += struct.pack("<i?i", 5, True, 1)
+	# trees are shared by hash, so each spec needs its own
+	blob = _tree_blob(spec)
+	meta += struct.pack("<ibh", class_id, 0, -1) + hashlib.md5(blob).digest() + blob
+	meta += struct.pack("<I", len(objects))
+	entries = []
+	for path_id, payload in objects:
+		meta += bytes(-(20 + len(meta)) & 3)
+		entries.append(len(meta))
+		meta += struct.pack("<qIIi", path_id, 0, len(payload), 0)
+	meta += struct.pack("<I", 0)  # adds
+	meta += struct.pack("<I", 0)  # external refs
+	meta += b"\0"
+	data_offset = (20 + len(meta) + 15) & -16
+	data = bytearray()
+	for (path_id, payload), entry in zip(objects, entries):
+		data += bytes(-len(data) & 7)
+		struct.pack_into("<I", meta, entry + 8, len(data))
+		data += payload
+	header = struct.pack(">IIIII", len(meta), data_offset + len(data), 17, data_offset, 0)
+	ret = header + bytes(meta)
+	return ret + bytes(data_offset - len(ret)) + bytes(data)
+
+
+def random_objects(count, rng, spec=SPEC):
+	tree = build_tree(spec)
+	return [(path_id, random_payload(tree, rng)) for path_id in range(1, count + 1)]
+
+
+def lzma_block(data):
+	"""
+	An LZMA block of a UnityFS bundle: properties, then a raw LZMA1 stream.
+	"""
+	filters = [{"id": lzma.FILTER_LZMA1, "dict_size": 1 << 20, "lc": 3, "lp": 0, "pb": 2}]
+	props = (2 * 5 + 0) * 9 + 3
+	return struct.pack("<BI", props, 1 << 20) + lzma.compress(data, format=lzma.FORMAT_RAW, filters=filters)
+
+
+def unityfs(nodes, block_size=1 << 17, compressed=False, guid=b"\x11" * 16):
+	"""
+	A UnityFS bundle of nodes, a list of (name, data), split in blocks of
+	block_size bytes, LZMA compressed if compressed.
+	"""
+	payload = b"".join(data for name, data in nodes)
+	blocks = []
+	for i in range(0, max(len(payload), 1), block_size):
+		raw = payload[i:i + block_size]
+		if compressed:
+			blocks.append((len(raw), lzma_block(raw), 1))
+		else:
+			blocks.append((len(raw), raw, 0))
+	info = bytearray(guid)
+	info += struct.pack(">i", len(blocks))
+	for uncompressed_size, data, flags in blocks:
+		info += struct.pack(">IIh", uncompressed_size, len(data), flags)
+	info += struct.pack(">i", len(nodes))
+	offset = 0
+	for name, data in nodes:
+		info += struct.pack(">qqi", offset, len(data), 4) + name.encode("utf-8") + b"\0"
+		offset += len(data)
+	header = b"UnityFS\0" + struct.pack(">i", 6) + b"5.x.x\0" + UNITY_VERSION.encode("utf-8") + b"\0"
+	block_data = b"".join(data for size, data, flags in blocks)
+	header += struct.pack(">qIII", len(header) + 20 + len(info) + len(block_data), len(info), len(info), 0x40)
+	return header + bytes(info) + block_data
+
+
+def unityweb(asset, asset_header_size=64):
+	"""
+	A UnityWeb bundle: one LZMA stream holding an asset header and asset.
+	"""
+	payload = bytes(asset_header_size) + asset
+	data = lzma.compress(payload, format=lzma.FORMAT_ALONE)
+	header_size = 128
+	header = b"UnityWeb\0" + struct.pack(">i", 3) + b"3.x.x\0" + b"3.5.7f6\0"
+	header += struct.pack(">Iiii", 0, header_size, 1, 1)
+	header += struct.pack(">II", len(data), len(payload))
+	header += struct.pack(">II", len(data) + header_size, asset_header_size)
+	header += struct.pack(">ib", 0, 0) + b"CAB-web\0"
+	return header + bytes(header_size - len(header)) + data
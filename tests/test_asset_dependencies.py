@@ -0,0 +1,71 @@
+import os
+import random
+import pytest
+from unitypack.asset_dependencies import AssetDependencyDatabase, setup_file_tables
+from unitypack.metadatacache import MetadataCache
+from .fixtures import random_objects, serialized_file, unityfs
+
+
+@pytest.fixture(scope="module")
+def files(tmp_path_factory):
+	"""
+	Bundles and a serialized file, with a variant of the first bundle
+	holding a CAB of the same name.
+	"""
+	objects = random_objects(10, random.Random(10))
+	path = tmp_path_factory.mktemp("files")
+	nodes = {
+		"a.unity3d": [("CAB-a", serialized_file(objects))],
+		"a.variant.unity3d": [("CAB-a", serialized_file(objects[:3]))],
+		"b.unity3d": [("CAB-b", serialized_file(objects[:5])), ("CAB-c", serialized_file(objects[5:]))],
+	}
+	ret = []
+	for name in sorted(nodes):
+		(path / name).write_bytes(unityfs(nodes[name], 4096, True))
+		ret.append(str(path / name))
+	(path / "d.assets").write_bytes(serialized_file(objects[2:]))
+	ret.append(str(path / "d.assets"))
+	return ret
+
+
+def get_tables(db):
+	return db.external_ref_name_to_table_index, [
+		(table.name, table.source_file, table.table_index, [
+			(obj.path_id, obj.unity_type, obj.size, obj.name) for obj in table.objects.values()
+		]) for table in db.dependency_table
+	]
+
+
+def test_setup_file_tables(files):
+	tables = setup_file_tables(files[2])
+	assert [(table.name, table.source_file) for table in tables] == [("CAB-b", files[2]), ("CAB-c", files[2])]
+	assert [len(table.objects) for table in tables] == [5, 5]
+	assert [table.name for table in setup_file_tables(files[3])] == [files[3]]
+
+
+@pytest.mark.parametrize("max_workers", [2, None])
+def test_build_from_files(files, max_workers):
+	expected = AssetDependencyDatabase()
+	expected.build_from_files(files, max_workers=1)
+	names, tables = get_tables(expected)
+	assert names == {"cab-a": 0, "cab-b": 1, "cab-c": 2, files[3].lower(): 3}
+	# the first variant is kept
+	assert [(name, source_file) for name, source_file, index, objects in tables][0] == ("CAB-a", files[0])
+	assert len(tables[0][3]) == 10
+
+	db = AssetDependencyDatabase()
+	db.build_from_files(files, max_workers=max_workers)
+	assert get_tables(db) == get_tables(expected)
+
+
+def test_build_from_files_metadata_cache(tmp_path, files):
+	expected = AssetDependencyDatabase()
+	expected.build_from_files(files, max_workers=1)
+
+	cache = MetadataCache(str(tmp_path / "cache"))
+	for i in range(2):
+		db = AssetDependencyDatabase()
+		db.build_from_files(files, max_workers=2, metadata_cache=cache)
+		assert get_tables(db) == get_tables(expected)
+		# the workers write their entries
+		assert len(os.listdir(cache.directory)) == len(files)
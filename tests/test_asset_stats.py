@@ -0,0 +1,72 @@
+import json
+import os
+import random
+import subprocess
+import sys
+import pytest
+from .fixtures import random_objects, serialized_file, unityfs
+
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "unity_asset_stats.py")
+
+
+@pytest.fixture(scope="module")
+def files():
+	objects = random_objects(10, random.Random(9))
+	ret = {"d.assets": serialized_file(objects)}
+	for name in ("a", "b", "c"):
+		ret[name + ".unity3d"] = unityfs([("CAB-" + name, serialized_file(objects[:8]))], 4096, True)
+	return ret
+
+
+def art_dump(path, names):
+	texture = {"Size": 100, "ImageSize": 4096, "Height": 32, "Width": 32, "Format": 4, "Dimension": 2}
+	objects = [dict(texture, Name=name) for name in names]
+	art_data = {"Texture2D": {"Objects": objects, "TotalRealSize": 100 * len(objects)}}
+	for key in ("Mesh", "AnimationClip", "Shader"):
+		art_data[key] = {"Objects": [], "TotalRealSize": 0}
+	return json.dumps({"Path": path, "ArtDump": {"CAB-" + path: art_data}})
+
+
+def run_stats(dirname, files, args):
+	"""
+	Run unity_asset_stats.py on \a files, written to \a dirname, and
+	return its output and the json files it wrote, with \a dirname removed.
+	"""
+	os.makedirs(dirname)
+	for name, data in files.items():
+		with open(os.path.join(dirname, name), "wb") as f:
+			f.write(data)
+	proc = subprocess.run(
+		[sys.executable, SCRIPT] + args + sorted(files), cwd=dirname,
+		stdout=subprocess.PIPE, stderr=subprocess.STDOUT, check=True,
+	)
+	output = {"stdout": proc.stdout.decode("utf-8")}
+	for name in sorted(os.listdir(dirname)):
+		if name.endswith(".json") and name not in files:
+			with open(os.path.join(dirname, name), "r") as f:
+				output[name] = f.read()
+	return {name: data.replace(dirname, "") for name, data in output.items()}
+
+
+@pytest.mark.parametrize("args", [[], ["--dep_summary"]])
+def test_jobs(tmp_path, files, args):
+	expected = run_stats(str(tmp_path / "sequential"), files, args)
+	assert len(expected) == (2 if args else 5)
+	assert run_stats(str(tmp_path / "jobs"), files, args + ["--jobs", "2"]) == expected
+
+
+def test_jobs_art_dump_summary(tmp_path):
+	files = {
+		"a.json": art_dump("a.unity3d", ["shared", "a"]),
+		"b.json": art_dump("b.unity3d", ["shared", "b"]),
+		"c.json": art_dump("c.unity3d", ["shared", "a"]),
+	}
+	files = {name: data.encode("utf-8") for name, data in files.items()}
+	expected = run_stats(str(tmp_path / "sequential"), files, ["--art_dump_summary"])
+	summary = json.loads(expected["art_dump_summary.json"])
+	assert summary["SizeOfTexture2D"] == 600
+	assert [(t["Name"], t["Instances"]) for t in summary["Texture2D"]] == [
+		("shared", ["a.unity3d", "b.unity3d", "c.unity3d"]), ("a", ["a.unity3d", "c.unity3d"]), ("b", ["b.unity3d"]),
+	]
+	assert run_stats(str(tmp_path / "jobs"), files, ["--art_dump_summary", "--jobs", "2"]) == expected
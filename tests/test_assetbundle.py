@@ -0,0 +1,139 @@
+import lzma
+import os
+import random
+from io import BytesIO
+import pytest
+import unitypack
+from unitypack.asset import Asset
+from unitypack.environment import UnityEnvironment
+from unitypack.utils import LZMAStream
+from .fixtures import plain, random_objects, serialized_file, unityfs, unityweb
+
+
+@pytest.fixture(scope="module")
+def objects():
+	return random_objects(60, random.Random(2))
+
+
+def read_objects(asset):
+	return {path_id: plain(obj.read()) for path_id, obj in asset.objects.items()}
+
+
+@pytest.fixture(scope="module")
+def expected(objects, tmp_path_factory):
+	# the objects, as read from a standalone serialized file
+	path = tmp_path_factory.mktemp("expected") / "test.assets"
+	path.write_bytes(serialized_file(objects))
+	with open(str(path), "rb") as f:
+		return read_objects(Asset.from_file(f))
+
+
+@pytest.mark.parametrize("compressed", [False, True], ids=["none", "lzma"])
+@pytest.mark.parametrize("block_size", [4096, 1 << 17])
+@pytest.mark.parametrize("preload", [False, True])
+def test_unityfs_round_trip(tmp_path, objects, expected, compressed, block_size, preload):
+	asset_data = serialized_file(objects)
+	resource = os.urandom(5000)
+	path = tmp_path / "test.unity3d"
+	path.write_bytes(unityfs([("CAB-test", asset_data), ("CAB-test.resS", resource)], block_size, compressed))
+
+	with open(str(path), "rb") as f:
+		bundle = unitypack.load(f, preload_blocks=preload)
+		assert bundle.is_unityfs
+		assert bundle.name == "CAB-test"
+		assert [name for ofs, size, status, name in bundle.nodes] == ["CAB-test", "CAB-test.resS"]
+		storage = bundle.block_storage
+		storage.seek(0)
+		assert storage.read() == asset_data + resource
+		storage.seek(len(asset_data) - 10)
+		assert storage.read(20) == (asset_data + resource)[len(asset_data) - 10:len(asset_data) + 10]
+		assert read_objects(bundle.assets[0]) == expected
+
+
+@pytest.mark.parametrize("cache_size", [8192, 1 << 20])
+def test_unityfs_block_cache(tmp_path, objects, expected, cache_size):
+	asset_data = serialized_file(objects)
+	path = tmp_path / "test.unity3d"
+	path.write_bytes(unityfs([("CAB-test", asset_data)], 4096, True))
+	with open(str(path), "rb") as f:
+		bundle = unitypack.load(f, UnityEnvironment(block_cache_size=cache_size))
+		assert read_objects(bundle.assets[0]) == expected
+		assert read_objects(bundle.assets[0]) == expected
+		cache = bundle.block_cache
+		assert cache.size == sum(len(data) for data in cache.blocks.values()) <= cache_size
+		assert all(type(data) is bytes for data in cache.blocks.values())
+		if cache_size < len(asset_data):
+			assert cache.evictions
+		else:
+			assert cache.hits and not cache.evictions
+
+		# a hit is served from the cached data without decompressing again
+		storage = bundle.block_storage
+		index = next(iter(cache.blocks))
+		misses = cache.misses
+		stream = storage.read_block(index, storage.compressed_starts[index])
+		assert stream.read() == asset_data[storage.block_starts[index]:storage.block_ends[index]]
+		assert cache.misses == misses
+
+
+def test_unityfs_preload_max_size(tmp_path, objects, expected):
+	path = tmp_path / "test.unity3d"
+	path.write_bytes(unityfs([("CAB-test", serialized_file(objects))], 4096, True))
+	with open(str(path), "rb") as f:
+		bundle = unitypack.load(f, UnityEnvironment(preload_max_size=4096))
+		assert bundle.decompress_blocks() is False
+		assert bundle.block_storage.preloaded is None
+		assert bundle.decompress_blocks(0, 1) is True
+		assert read_objects(bundle.assets[0]) == expected
+
+
+def test_unityfs_header_only(tmp_path, objects):
+	path = tmp_path / "test.unity3d"
+	path.write_bytes(unityfs([("CAB-test", serialized_file(objects))], 4096, True))
+	with open(str(path), "rb") as f:
+		bundle = unitypack.load(f, header_only=True)
+		assert bundle.name == "CAB-test"
+		assert not bundle.assets
+
+
+def test_unityweb_round_trip(tmp_path, objects, expected):
+	path = tmp_path / "test.unity3d"
+	path.write_bytes(unityweb(serialized_file(objects)))
+	with open(str(path), "rb") as f:
+		bundle = unitypack.load(f)
+		assert bundle.compressed
+		assert read_objects(bundle.assets[0]) == expected
+
+
+@pytest.mark.parametrize("seek_back", [None, 1024])
+def test_lzma_stream_random_access(seek_back):
+	data = os.urandom(200000).translate(bytes(range(16)) * 16)
+	compressed = b"head" + lzma.compress(data, format=lzma.FORMAT_ALONE)
+	rng = random.Random(3)
+	for offset in (0, 1000):
+		decompressors = []
+
+		def make_decompressor():
+			decompressors.append(lzma.LZMADecompressor())
+			return decompressors[-1]
+
+		source = BytesIO(compressed)
+		source.seek(4)
+		stream = LZMAStream(source, make_decompressor, offset=offset, chunk_size=4096, seek_back=seek_back)
+		expected = data[offset:]
+		assert len(stream) == len(expected)
+		for i in range(500):
+			pos = rng.randrange(len(expected) + 10)
+			size = rng.randrange(3000)
+			stream.seek(pos)
+			value = stream.read(size)
+			assert value == expected[pos:pos + size]
+			assert stream.tell() == pos + len(value)
+			if seek_back is not None:
+				# only a window of the output is kept
+				assert len(stream.data) <= seek_back + size + 4096
+		assert stream.getvalue() == expected
+		if seek_back is None:
+			# the output is kept, so seeking back never restarts
+			assert len(decompressors) == 1
+			assert len(stream.data) == len(expected)
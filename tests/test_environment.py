@@ -0,0 +1,122 @@
+import os
+import random
+import pytest
+from unitypack.environment import UnityEnvironment
+from unitypack.utils import FilePool
+from .fixtures import plain, random_objects, serialized_file, unityfs
+
+
+@pytest.fixture(scope="module")
+def objects():
+	return random_objects(10, random.Random(8))
+
+
+@pytest.fixture
+def bundles(tmp_path, objects):
+	"""
+	A directory of bundles, each holding a CAB named after its file.
+	"""
+	paths = {}
+	for name in ("main", "dep", "other"):
+		path = tmp_path / (name + ".unity3d")
+		path.write_bytes(unityfs([("CAB-" + name, serialized_file(objects))], 4096, True))
+		paths[name] = str(path)
+	(tmp_path / "dep.unity3d.manifest").write_text("ManifestFileVersion: 0\n")
+	return paths
+
+
+@pytest.fixture
+def listdir_calls(monkeypatch):
+	calls = []
+	listdir = os.listdir
+
+	def counted_listdir(path):
+		calls.append(path)
+		return listdir(path)
+
+	monkeypatch.setattr(os, "listdir", counted_listdir)
+	return calls
+
+
+def test_discover(bundles, listdir_calls):
+	env = UnityEnvironment()
+	env.load(env.open(bundles["main"]))
+	assert list(env.bundles) == ["cab-main"]
+
+	asset = env.get_asset("archive:/CAB-dep/CAB-dep")
+	assert asset.name == "CAB-dep"
+	assert env.bundles["cab-dep"].path == bundles["dep"]
+	assert env.get_asset("archive:/cab-dep/cab-dep") is asset
+	assert env.get_asset_by_filename("cab-dep") is asset
+	assert len(listdir_calls) == 1
+
+
+def test_discover_misses(bundles, listdir_calls):
+	env = UnityEnvironment()
+	env.load(env.open(bundles["main"]))
+	lookups = []
+	get_directory_index = env.get_directory_index
+
+	def counted_get_directory_index(dirname):
+		lookups.append(dirname)
+		return get_directory_index(dirname)
+
+	env.get_directory_index = counted_get_directory_index
+	for i in range(3):
+		with pytest.raises(NotImplementedError):
+			env.get_asset("archive:/CAB-missing/CAB-missing")
+	# not found once, so not looked up again
+	assert len(lookups) == 1
+
+	# until another bundle is loaded
+	env.load(env.open(bundles["other"]))
+	with pytest.raises(KeyError):
+		env.get_asset_by_filename("cab-missing")
+	assert len(lookups) == 2
+	assert len(listdir_calls) == 1
+
+
+def test_load_twice(bundles):
+	env = UnityEnvironment()
+	bundle = env.load(env.open(bundles["main"]))
+	assert env.load(env.open(bundles["main"])) is bundle
+
+
+def test_file_pool(tmp_path):
+	data = {}
+	for i in range(4):
+		path = tmp_path / ("%i.bin" % (i))
+		data[str(path)] = os.urandom(1000)
+		path.write_bytes(data[str(path)])
+	pool = FilePool(2)
+	files = [pool.open(path) for path in data]
+	assert len(pool) == 2
+	for pos in (0, 100, 500, 990):
+		for f in files:
+			f.seek(pos)
+			assert f.read(20) == data[f.name][pos:pos + 20]
+			assert f.tell() == min(pos + 20, 1000)
+			assert len(pool) <= 2
+	files[0].seek(-10, 2)
+	assert files[0].read() == data[files[0].name][-10:]
+	files[0].close()
+	with pytest.raises(ValueError):
+		files[0].read()
+	pool.close()
+	assert len(pool) == 0
+	with pytest.raises(ValueError):
+		FilePool(0)
+
+
+def test_environment_max_open_files(bundles, objects):
+	env = UnityEnvironment(max_open_files=1)
+	main = env.load(env.open(bundles["main"]))
+	dep = env.get_asset("archive:/CAB-dep/CAB-dep")
+	# both files are read alternately through one open file
+	for path_id, payload in objects:
+		for asset in (main.assets[0], dep):
+			assert plain(asset.objects[path_id].read())
+			assert len(env.file_pool) == 1
+	assert [plain(obj.read()) for obj in main.assets[0].objects.values()] == [
+		plain(obj.read()) for obj in dep.objects.values()
+	]
@@ -0,0 +1,93 @@
+import struct
+import pytest
+from unitypack.engine.mesh import Mesh, SubMesh, VertexData
+from io import StringIO
+from unitypack.export import VERTEX_FORMATS, MeshData, OBJMesh, get_vertex_formats
+
+
+np = pytest.importorskip("numpy")
+
+
+def channel(offset, format, dimension, stream=0):
+	return {"stream": stream, "offset": offset, "format": format, "dimension": dimension}
+
+
+def build_mesh(channels, data, vertex_count, indices, name="Quad"):
+	return Mesh({
+		"m_Name": name,
+		"m_MeshCompression": 0,
+		"m_SubMeshes": [SubMesh({"firstByte": 0, "indexCount": len(indices), "topology": 0})],
+		"m_IndexBuffer": struct.pack("<%iH" % (len(indices)), *indices),
+		"m_VertexData": VertexData({"m_Channels": channels, "m_DataSize": data, "m_VertexCount": vertex_count}),
+	})
+
+
+def test_vertex_formats_by_version():
+	assert get_vertex_formats(None) == VERTEX_FORMATS
+	assert get_vertex_formats("5.6.0f3")[4] == "<u4"
+	# VertexFormat: unorm8 at 3, then shifted down when color was dropped
+	assert get_vertex_formats("2017.4.0f1")[3] == "u1"
+	assert get_vertex_formats("2018.4.2f1")[4] == "i1"
+	assert get_vertex_formats("2019.4.1f1")[4] == "<u2"
+	assert get_vertex_formats("2020.3.0f1")[11] == "<i4"
+	assert 12 not in get_vertex_formats("2019.4.1f1")
+
+
+def test_vertex_channels_by_version():
+	# 2018+ channels: position as floats, uv1 as format 4
+	positions = [(1.0, 2.0, 3.0), (4.0, 5.0, 6.0), (7.0, 8.0, 9.0)]
+
+	def channels():
+		ret = [channel(0, 0, 3), channel(0, 0, 0), channel(0, 0, 0), channel(0, 0, 0), channel(12, 4, 2)]
+		return ret + [channel(0, 0, 0)] * 9
+
+	# as unorm16 in 2019: a 16 byte stride
+	data = b"".join(struct.pack("<3f2H", *p, i, 1000 + i) for i, p in enumerate(positions))
+	mesh_data = MeshData(build_mesh(channels(), data, 3, [0, 1, 2]), "2019.4.1f1")
+	assert mesh_data.vertices.tolist() == [list(p) for p in positions]
+	assert mesh_data.uv1.dtype == np.uint16
+	assert mesh_data.uv1.tolist() == [[0, 1000], [1, 1001], [2, 1002]]
+
+	# as snorm8 in 2017 and 2018: a 14 byte stride
+	data = b"".join(struct.pack("<3f2b", *p, i, -i) for i, p in enumerate(positions))
+	mesh_data = MeshData(build_mesh(channels(), data, 3, [0, 1, 2]), "2018.4.2f1")
+	assert mesh_data.vertices.tolist() == [list(p) for p in positions]
+	assert mesh_data.uv1.dtype == np.int8
+	assert mesh_data.uv1.tolist() == [[0, 0], [1, -1], [2, -2]]
+
+	# format 4 is not known without the Unity version
+	with pytest.raises(NotImplementedError):
+		MeshData(build_mesh(channels(), data, 3, [0, 1, 2]))
+
+
+def test_obj_write():
+	# a quad with positions, normals and uv1, as floats
+	channels = [channel(0, 0, 3), channel(12, 0, 3), channel(0, 0, 0), channel(0, 0, 0), channel(24, 0, 2)]
+	channels += [channel(0, 0, 0)] * 9
+	vertices = [
+		(0.0, 0.0, 0.0, 0, 0, 1, 0.0, 0.0),
+		(1.5, 0.0, 0.0, 0, 0, 1, 1.0, 0.0),
+		(1.5, 2.0, 0.0, 0, 0, 1, 1.0, 1.0),
+		(0.0, 2.0, 0.1, 0, 0, 1, 0.0, 0.25),
+	]
+	data = b"".join(struct.pack("<8f", *v) for v in vertices)
+	mesh = OBJMesh(build_mesh(channels, data, 4, [0, 1, 2, 0, 2, 3]), "2019.4.1f1")
+	expected = (
+		"v -0 0 0\nv -1.5 0 0\nv -1.5 2 0\nv -0 2 0.100000001\n"
+		"vn -0 0 1\nvn -0 0 1\nvn -0 0 1\nvn -0 0 1\n"
+		"vt 0 1\nvt 1 1\nvt 1 0\nvt 0 0.75\n"
+		"\ng Quad\ns 1\nusemtl Quad\n"
+		"f 3/3/3 2/2/2 1/1/1 \nf 4/4/4 3/3/3 1/1/1 \n\n"
+	)
+	for chunk_size in (1, 3, 16384):
+		out = StringIO()
+		assert mesh.write(out, chunk_size) == len(expected)
+		assert out.getvalue() == expected
+	assert mesh.export() == expected
+
+
+def test_obj_face_format():
+	assert OBJMesh.face_format(True, True) == ("f %d/%d/%d %d/%d/%d %d/%d/%d \n", 3)
+	assert OBJMesh.face_format(True, False) == ("f %d/%d %d/%d %d/%d \n", 2)
+	assert OBJMesh.face_format(False, True) == ("f %d//%d %d//%d %d//%d \n", 2)
+	assert OBJMesh.face_format(False, False) == ("f %d %d %d \n", 1)
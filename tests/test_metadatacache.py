@@ -0,0 +1,124 @@
+import os
+import random
+import pytest
+import unitypack
+from unitypack.asset import Asset
+from unitypack.environment import UnityEnvironment
+from unitypack.metadatacache import MetadataCache
+from .fixtures import plain, random_objects, serialized_file, unityfs
+
+
+@pytest.fixture
+def cache(tmp_path):
+	cache = MetadataCache(str(tmp_path / "cache"))
+	writes = []
+	write = cache.write
+
+	def counted_write(key, data):
+		writes.append(key)
+		write(key, data)
+
+	cache.write = counted_write
+	cache.writes = writes
+	return cache
+
+
+@pytest.fixture(scope="module")
+def objects():
+	return random_objects(30, random.Random(4))
+
+
+def load_bundle(path, cache):
+	with open(str(path), "rb") as f:
+		bundle = unitypack.load(f, UnityEnvironment(metadata_cache=cache))
+		assets = [asset for asset in bundle.assets if not asset.name.endswith(".resS")]
+		objects = [{path_id: plain(obj.read()) for path_id, obj in asset.objects.items()} for asset in assets]
+		return bundle.guid, bundle.nodes, [asset.format for asset in assets], objects
+
+
+def test_bundle_round_trip(tmp_path, cache, objects):
+	path = tmp_path / "test.unity3d"
+	nodes = [("CAB-a", serialized_file(objects)), ("CAB-a.resS", os.urandom(100)), ("CAB-b", serialized_file(objects[:5]))]
+	path.write_bytes(unityfs(nodes, 4096, True))
+
+	with cache:
+		expected = load_bundle(path, cache)
+		# changes are only written on flush
+		assert cache.writes == []
+	assert len(cache.writes) == 1
+	assert (cache.hits, cache.misses) == (0, 1)
+
+	with cache:
+		assert load_bundle(path, cache) == expected
+	assert len(cache.writes) == 1
+	assert (cache.hits, cache.misses) == (1, 1)
+
+	# a changed file is parsed again
+	nodes[2] = ("CAB-b", serialized_file(objects[:6]))
+	path.write_bytes(unityfs(nodes, 4096, True))
+	with cache:
+		changed = load_bundle(path, cache)
+	assert len(changed[3][1]) == 6
+	assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_asset_round_trip(tmp_path, cache, objects):
+	path = tmp_path / "test.assets"
+	path.write_bytes(serialized_file(objects))
+
+	def load():
+		with open(str(path), "rb") as f:
+			asset = Asset.from_file(f, environment=UnityEnvironment(metadata_cache=cache))
+			return asset.adds, [(r.guid, r.asset_path) for r in asset.asset_refs[1:]], {
+				path_id: plain(obj.read()) for path_id, obj in asset.objects.items()
+			}
+
+	expected = load()
+	cache.flush()
+	assert len(cache.writes) == 1
+	assert load() == expected
+	cache.flush()
+	assert len(cache.writes) == 1
+	assert cache.hits == 1
+
+
+def test_corrupt_entry(tmp_path, cache, objects):
+	path = tmp_path / "test.assets"
+	path.write_bytes(serialized_file(objects))
+	entry = cache.open(str(path))
+	entry.set_asset(0, "metadata")
+	with entry:
+		pass
+	assert cache.open(str(path)).get_asset(0) == "metadata"
+	entry_path = cache.get_entry_path(entry.key)
+	with open(entry_path, "rb") as f:
+		data = f.read()
+	assert data.startswith(cache.get_header())
+
+	for corrupt in (b"not an entry", data[:len(data) // 2], b"XXXXXX" + data[6:], data[:6] + b"\xff" + data[7:]):
+		with open(entry_path, "wb") as f:
+			f.write(corrupt)
+		assert cache.open(str(path)).get_asset(0) is None
+
+
+def test_bundle_guid_in_key(tmp_path, cache, objects):
+	path = tmp_path / "test.unity3d"
+	nodes = [("CAB-a", serialized_file(objects))]
+	path.write_bytes(unityfs(nodes, 4096, True, guid=b"\x01" * 16))
+	with cache:
+		expected = load_bundle(path, cache)
+	assert (cache.hits, cache.misses) == (0, 1)
+
+	# another bundle, with the same path, size and mtime
+	st = os.stat(str(path))
+	path.write_bytes(unityfs(nodes, 4096, True, guid=b"\x02" * 16))
+	os.utime(str(path), ns=(st.st_atime_ns, st.st_mtime_ns))
+	with cache:
+		assert load_bundle(path, cache)[0] == b"\x02" * 16
+	assert (cache.hits, cache.misses) == (0, 2)
+
+	path.write_bytes(unityfs(nodes, 4096, True, guid=b"\x01" * 16))
+	os.utime(str(path), ns=(st.st_atime_ns, st.st_mtime_ns))
+	with cache:
+		assert load_bundle(path, cache) == expected
+	assert (cache.hits, cache.misses) == (1, 2)
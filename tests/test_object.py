@@ -0,0 +1,108 @@
+import random
+import struct
+import pytest
+from unitypack.asset import Asset
+from unitypack.object import ObjectTable
+from .fixtures import node, random_objects, serialized_file, string
+
+
+@pytest.fixture(scope="module")
+def objects():
+	return random_objects(20, random.Random(6))
+
+
+@pytest.fixture
+def asset(tmp_path, objects):
+	path = tmp_path / "test.assets"
+	path.write_bytes(serialized_file(objects))
+	with open(str(path), "rb") as f:
+		yield Asset.from_file(f)
+
+
+def test_peek_name(asset, objects):
+	buf = asset._buf
+	reads = []
+	read = buf.read
+
+	def counted_read(size=-1):
+		reads.append(size)
+		return read(size)
+
+	for path_id, payload in objects:
+		obj = asset.objects[path_id]
+		name = obj.read().name
+		buf.read = counted_read
+		del reads[:]
+		assert obj.peek_name() == name
+		assert obj.read_name_only() == {"m_Name": name}
+		# only the length and the string are read
+		assert max(reads) <= max(len(name.encode("utf-8")), 4)
+		del buf.read
+
+	assert [(obj.path_id, name) for obj, name in asset.iter_names()] == [
+		(path_id, asset.objects[path_id].read().name) for path_id, payload in objects
+	]
+
+
+def test_peek_name_without_name(tmp_path):
+	path = tmp_path / "test.assets"
+	spec = node("Holder", "Base", children=[node("int", "m_Value", 4), string("m_Name")])
+	path.write_bytes(serialized_file([(1, struct.pack("<ii", 5, 0))], spec=spec))
+	with open(str(path), "rb") as f:
+		obj = Asset.from_file(f).objects[1]
+		assert obj.peek_name() is None
+		assert obj.read_name_only() is None
+		assert dict(obj.read()) == {"m_Value": 5, "m_Name": ""}
+
+
+def test_peek_name_out_of_payload(tmp_path):
+	# a length past the end of the object is not a name
+	path = tmp_path / "test.assets"
+	path.write_bytes(serialized_file([(1, struct.pack("<I", 100) + b"name")]))
+	with open(str(path), "rb") as f:
+		assert Asset.from_file(f).objects[1].peek_name() is None
+
+
+@pytest.mark.parametrize("order", ["sorted", "shuffled"])
+def test_object_table(tmp_path, objects, order):
+	objects = list(objects)
+	if order == "shuffled":
+		random.Random(7).shuffle(objects)
+	path = tmp_path / "test.assets"
+	path.write_bytes(serialized_file(objects))
+	with open(str(path), "rb") as f:
+		asset = Asset.from_file(f)
+		table = asset.objects
+		path_ids = [path_id for path_id, payload in objects]
+		assert len(table) == len(objects)
+		assert list(table) == path_ids
+		assert 0 not in table and path_ids[3] in table
+		obj = table[path_ids[3]]
+		assert (obj.path_id, obj.size, obj.class_id) == (path_ids[3], len(objects[3][1]), 28)
+		with pytest.raises(KeyError):
+			table[0]
+
+		values = table.values()
+		assert len(values) == len(objects)
+		assert [obj.path_id for obj in values] == path_ids
+		assert table[path_ids[0]] in values
+		# the same object of another asset
+		f.seek(0)
+		assert Asset.from_file(f).objects[path_ids[0]] not in values
+		items = table.items()
+		assert (path_ids[1], table[path_ids[1]]) in items
+		assert (path_ids[0], table[path_ids[1]]) not in items
+		assert [(path_id, obj.path_id) for path_id, obj in items] == [(path_id, path_id) for path_id in path_ids]
+
+		assert [obj.path_id for obj in table.of_class(28)] == path_ids
+		assert list(table.of_class(1)) == []
+
+		copy = ObjectTable(asset)
+		copy.set_state(table.get_state())
+		assert [(obj.path_id, obj.data_offset, obj.size) for obj in copy.values()] == [
+			(obj.path_id, obj.data_offset, obj.size) for obj in values
+		]
+		with pytest.raises(ValueError):
+			copy.append(path_ids[0], 0, 0, 0, 28)
+		copy.append(len(objects) + 1, 0, 0, 0, 1)
+		assert [obj.path_id for obj in copy.of_class(1)] == [len(objects) + 1]
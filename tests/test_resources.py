@@ -0,0 +1,39 @@
+import subprocess
+import sys
+from unitypack import resources
+from unitypack.type import TypeMetadata
+from unitypack.utils import MemoryReader
+
+
+def test_resources_are_read_lazily():
+	code = (
+		"import unitypack, unitypack.resources as r\n"
+		"assert r.get_strings_dat.cache_info().currsize == 0\n"
+		"assert r.get_unity_classes.cache_info().currsize == 0\n"
+		"from unitypack.resources import UNITY_CLASSES\n"
+		"assert UNITY_CLASSES['28'] == 'Texture2D'\n"
+		"assert r.get_strings_dat.cache_info().currsize == 0\n"
+	)
+	subprocess.check_call([sys.executable, "-c", code])
+
+
+def test_resource_attributes():
+	with open(resources.get_resource("strings.dat"), "rb") as f:
+		assert resources.STRINGS_DAT == f.read()
+	assert resources.UNITY_CLASSES is resources.get_unity_classes()
+	assert resources.UnityClass(1) == "GameObject"
+
+
+def test_default_type_trees_are_parsed_lazily():
+	with open(resources.get_resource("structs.dat"), "rb") as f:
+		data = f.read()
+	eager = TypeMetadata(None)
+	eager.load(MemoryReader(data), format=15)
+	lazy = TypeMetadata(None)
+	lazy.load(MemoryReader(data), format=15, lazy=True)
+
+	assert lazy.class_ids == eager.class_ids
+	assert sorted(lazy.type_trees) == sorted(eager.type_trees)
+	assert not lazy.type_trees.trees
+	assert lazy.type_trees[28].pretty() == eager.type_trees[28].pretty()
+	assert list(lazy.type_trees.trees) == [28]
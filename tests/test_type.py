@@ -0,0 +1,59 @@
+import gc
+import random
+import pytest
+from unitypack.asset import Asset
+from unitypack.type import TypeMetadata, TypeTree, TypeTreeRegistry
+from .fixtures import random_objects, serialized_file
+
+
+@pytest.fixture(scope="module")
+def asset_data():
+	return serialized_file(random_objects(5, random.Random(5)))
+
+
+def load_asset(tmp_path, data, name):
+	path = tmp_path / name
+	path.write_bytes(data)
+	with open(str(path), "rb") as f:
+		asset = Asset.from_file(f)
+		len(asset.objects)
+	return asset
+
+
+@pytest.mark.parametrize("weak", [False, True])
+def test_registry_shares_trees(tmp_path, monkeypatch, asset_data, weak):
+	registry = TypeTreeRegistry(weak=weak)
+	monkeypatch.setattr(TypeMetadata, "registry", registry)
+	first = load_asset(tmp_path, asset_data, "a.assets")
+	second = load_asset(tmp_path, asset_data, "b.assets")
+	assert second.tree.type_trees[28] is first.tree.type_trees[28]
+	assert (registry.hits, registry.misses, len(registry)) == (1, 1, 1)
+
+	del first, second
+	gc.collect()
+	assert len(registry) == (0 if weak else 1)
+
+
+def test_registry_disabled(tmp_path, monkeypatch, asset_data):
+	monkeypatch.setattr(TypeMetadata, "registry", None)
+	first = load_asset(tmp_path, asset_data, "a.assets")
+	second = load_asset(tmp_path, asset_data, "b.assets")
+	assert second.tree.type_trees[28] is not first.tree.type_trees[28]
+	assert second.tree.type_trees[28].pretty() == first.tree.type_trees[28].pretty()
+
+
+def test_registry_max_size():
+	registry = TypeTreeRegistry(max_size=2)
+	trees = [TypeTree(17) for i in range(3)]
+	registry.add(1, trees[0])
+	registry.add(2, trees[1])
+	# a hit makes the tree the most recently used
+	assert registry.get(1) is trees[0]
+	registry.add(3, trees[2])
+	assert len(registry) == 2 and registry.evictions == 1
+	assert registry.get(2) is None
+	assert registry.get(1) is trees[0] and registry.get(3) is trees[2]
+
+	registry.clear()
+	assert len(registry) == 0
+	assert (registry.hits, registry.misses, registry.evictions) == (0, 0, 0)
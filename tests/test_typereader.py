@@ -0,0 +1,110 @@
+import random
+import struct
+from io import BytesIO
+import pytest
+from unitypack.asset import Asset
+from unitypack.environment import UnityEnvironment
+from unitypack.typereader import get_reader, get_skipper, read_object
+from unitypack.utils import BinaryReader
+from .fixtures import SPEC, build_tree, node, plain, random_objects, reference_read, serialized_file, vector
+
+
+@pytest.fixture(scope="module")
+def objects():
+	return random_objects(100, random.Random(0))
+
+
+@pytest.fixture(scope="module", params=[False, True], ids=["file", "mmap"])
+def asset(request, tmp_path_factory, objects):
+	path = tmp_path_factory.mktemp("assets") / "test.assets"
+	path.write_bytes(serialized_file(objects))
+	with open(str(path), "rb") as f:
+		env = UnityEnvironment(use_mmap=request.param)
+		yield Asset.from_file(f, environment=env)
+
+
+def reference(obj, payload):
+	return plain(reference_read(obj, obj.type_tree, BinaryReader(BytesIO(payload))))
+
+
+def test_reader_matches_reference(asset, objects):
+	assert len(asset.objects) == len(objects)
+	for path_id, payload in objects:
+		obj = asset.objects[path_id]
+		assert plain(obj.read()) == reference(obj, payload)
+
+
+def test_numpy_reader_matches_reference(asset, objects):
+	pytest.importorskip("numpy")
+	for path_id, payload in objects:
+		obj = asset.objects[path_id]
+		assert plain(obj.read(numpy_arrays=True)) == reference(obj, payload)
+
+
+def test_projected_reader_matches_reference(asset, objects):
+	names = [child.name for child in build_tree(SPEC).children]
+	rng = random.Random(1)
+	for path_id, payload in objects[:20]:
+		obj = asset.objects[path_id]
+		expected = reference(obj, payload)
+		for fields in [[name] for name in names] + [rng.sample(names, 3) for i in range(10)]:
+			value = obj.read(fields=fields)
+			assert type(value) is type(obj.read())
+			assert plain(value) == (expected[0], {k: v for k, v in expected[1].items() if k in fields})
+
+
+def test_skipper_matches_reader(asset, objects):
+	for path_id, payload in objects:
+		obj = asset.objects[path_id]
+		tree = obj.type_tree
+		assert get_skipper(tree)(obj, payload, 0) == len(payload)
+		pos = 0
+		for child in tree.children:
+			value, end = get_reader(child)(obj, payload, pos)
+			assert get_skipper(child)(obj, payload, pos) == end
+			pos = end
+		assert pos == len(payload)
+
+
+def test_read_value_matches_reference(asset, objects):
+	for path_id, payload in objects[:20]:
+		obj = asset.objects[path_id]
+		buf = asset._buf
+		buf.seek(asset._buf_ofs + obj.data_offset)
+		ref_buf = BinaryReader(BytesIO(payload))
+		# from the position of each field, aligned or not
+		for child in obj.type_tree.children:
+			assert plain(obj.read_value(child, buf)) == plain(reference_read(obj, child, ref_buf))
+			assert buf.tell() - asset._buf_ofs - obj.data_offset == ref_buf.tell()
+
+
+def test_short_payload(asset, objects):
+	path_id, payload = objects[0]
+	obj = asset.objects[path_id]
+	with pytest.raises(IOError):
+		get_reader(obj.type_tree)(obj, payload[:len(payload) - 1], 0)
+	# the skipped fields run past the end
+	with pytest.raises(IOError):
+		read_object(obj, obj.type_tree, payload[:len(payload) - 1], fields=["m_Name"])
+
+
+def test_unknown_leaf_in_fixed_array(tmp_path):
+	# double has no type hint, so it reads as an empty struct that falls
+	# short of its size, and the fixed-size fast paths must not skip over it
+	item = node("Item", "data", 12, children=[node("double", "d", 8), node("int", "i", 4)])
+	spec = node("Holder", "Base", children=[vector("m_Items", item), node("int", "m_After", 4)])
+	payload = struct.pack("<idii", 1, 1.5, 7, 99)
+	path = tmp_path / "test.assets"
+	path.write_bytes(serialized_file([(1, payload)], spec=spec))
+	with open(str(path), "rb") as f:
+		obj = Asset.from_file(f).objects[1]
+		tree = obj.type_tree
+		assert tree.layout is None and tree.children[0].children[0].children[1].layout is None
+		with pytest.raises(ValueError):
+			reference(obj, payload)
+		with pytest.raises(ValueError):
+			obj.read()
+		with pytest.raises(ValueError):
+			obj.read(fields=["m_After"])
+		with pytest.raises(ValueError):
+			get_skipper(tree)(obj, payload, 0)
@@ -4,11 +4,15 @@ import pickle
 import sys
 import unitypack
 from argparse import ArgumentParser
-from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from io import BytesIO, StringIO
 from unitypack.asset import Asset
 from unitypack.export import OBJMesh
 from unitypack.utils import extract_audioclip_samples, json_default
 from unitypack.asset_dependencies import AssetDependencyDatabase
+from unitypack.environment import UnityEnvironment
+from unitypack.metadatacache import MetadataCache
 import json
 
 class UnityAssetStats:
@@ -36,6 +40,7 @@ class UnityAssetStats:
 		return -1
 
 	def __init__(self, args):
+		self.argv = args
 		self.parse_args(args)
 		self.json_data = {}
 		self.dependency_db = None
@@ -57,6 +62,16 @@ class UnityAssetStats:
 		p.add_argument("--sort_objects", action="store_true", help="")
 
 		p.add_argument("--dep_summary", action="store_true", help="")
+		p.add_argument("--decompress_threads", type=int, nargs='?', default=0,
+			help="Decompress all blocks of each bundle up front using this many threads")
+		p.add_argument("--jobs", type=int, nargs='?', default=1,
+			help="Process files in parallel in this many processes")
+
+		p.add_argument("--bundle_info", action="store_true",
+			help="Only read the headers of bundles (file size, compression, block storage offset and nodes)")
+
+		p.add_argument("--metadata_cache", nargs="?", default="",
+			help="Directory caching the parsed metadata of bundles and assets between runs")
 
 		p.add_argument("--art_dump", action="store_true", help="Dump info about art files (Textures, Meshes)")
 
@@ -73,6 +88,10 @@ class UnityAssetStats:
 			if self.args.all or getattr(self.args, a):
 				self.handle_formats.append(classname)
 
+		self.metadata_cache = None
+		if self.args.metadata_cache:
+			self.metadata_cache = MetadataCache(self.args.metadata_cache)
+
 	def run(self):
 		files = self.args.files
 
@@ -81,6 +100,33 @@ class UnityAssetStats:
 		self.populate_files_with_assets(files)
 		self.populate_files_with_asset_bundles(files)
 
+		self.init_summary_state()
+
+		if self.dependency_db is not None and not self.args.art_dump:
+			# bundles and serialized files are told apart by their signature
+			print("Building dependency database from %i files..." % (len(files)), flush=True)
+			self.dependency_db.build_from_files(files, max_workers=self.args.jobs, metadata_cache=self.metadata_cache, show_progress=True)
+		elif self.args.jobs > 1:
+			self.run_jobs(files)
+		else:
+			for file in files:
+				self.process_file(file)
+				self.flush_metadata_cache()
+
+		if self.args.art_dump_summary:
+			print("Writing art dump summary " + "" + "...", end='')
+			self.write_art_dump_summary()
+			print("Done")
+		elif self.args.dep_summary:
+			if self.dependency_db is not None:
+				summary_path = self.get_output_path("dependency_summary" + ".json")
+				print("Writing dependency summary " + "" + "...", flush=True)
+				self.dependency_db.write_to_json_file(summary_path)
+				print("Done")
+
+		return 0
+
+	def init_summary_state(self):
 		# initialize object data for art_dump_summary
 		if self.args.art_dump_summary:
 			self.art_dump_textures_summary = {}
@@ -94,99 +140,134 @@ class UnityAssetStats:
 		elif self.args.dep_summary:
 			self.dependency_db = AssetDependencyDatabase()
 
-		for file in files:
-			if self.args.dep_summary:
-				print("Processing " + file + "...", flush=True)
-			else:
-				print("Processing " + file + "...", end='', flush=True)
-
-			# reset the write_json_data flag during art_dump. It is flipped when there are art assets found
-			if self.args.art_dump:
-				self.write_json_data = False
-
-			if self.args.art_dump_summary:
-				with open(file, "r") as f:
-					self.handle_file_for_art_dump_summary(file, f)
-				print("Done")
-				continue
-
-			# reset the json_data dict working memory on each file
-			self.json_data = {}
-			self.write_json_data = True
-
-			if self.args.as_asset or file.endswith(".assets") or file.find("\\level") >= 0 or self.find_built_in_assets_index(file) >= 0:
-				with open(file, "rb") as f:
-					asset = Asset.from_file(f)
+	def get_summary_state(self):
+		"""
+		Return the summary data gathered since init_summary_state, which
+		--jobs workers send back to be merged by merge_summary_state.
+		"""
+		if self.args.art_dump_summary:
+			return (
+				(self.art_dump_textures_size, self.art_dump_meshes_size, self.art_dump_animation_clips_size, self.art_dump_shaders_size),
+				(self.art_dump_textures_summary, self.art_dump_meshes_summary, self.art_dump_animation_clips_summary, self.art_dump_shaders_summary),
+			)
+		return None
+
+	def merge_summary_state(self, state):
+		"""
+		Merge the summary data of a file processed by a --jobs worker, as if
+		it had been processed here. Files must be merged in order.
+		"""
+		if self.args.art_dump_summary:
+			sizes, summaries = state
+			self.art_dump_textures_size += sizes[0]
+			self.art_dump_meshes_size += sizes[1]
+			self.art_dump_animation_clips_size += sizes[2]
+			self.art_dump_shaders_size += sizes[3]
+			totals = (self.art_dump_textures_summary, self.art_dump_meshes_summary, self.art_dump_animation_clips_summary, self.art_dump_shaders_summary)
+			for total, summary in zip(totals, summaries):
+				for art_obj_name, art_obj_summary in summary.items():
+					if art_obj_name not in total:
+						total[art_obj_name] = art_obj_summary
+						continue
+					total_summary = total[art_obj_name]
+					total_summary['Instances'] += art_obj_summary['Instances']
+					total_summary['InstancesCount'] += art_obj_summary['InstancesCount']
 
-					self.json_data['Path'] = file
+	def flush_metadata_cache(self):
+		# write the metadata of the processed file once it is complete
+		if self.metadata_cache is not None:
+			self.metadata_cache.flush()
 
-					# setup the ArtDump dictionary for handle_asset_for_art_dump
-					if self.args.art_dump:
-						self.json_data['ArtDump'] = {}
-					elif self.args.dep_summary:
-						self.dependency_db.add_asset(file, asset)
-						continue
+	def process_file(self, file):
+		print("Processing " + file + "...", end='', flush=True)
 
-					if self.args.art_dump:
-						self.handle_asset_for_art_dump(file, asset)
-					else:
-						self.handle_asset(file, asset)
+		# reset the write_json_data flag during art_dump. It is flipped when there are art assets found
+		if self.args.art_dump:
+			self.write_json_data = False
 
-					if not self.args.dry_run:
-						json_path = file + ".json"
-						if self.write_json_data:
-							with open(json_path, "w") as json_file:
-								json_file.write(json.dumps(self.json_data, indent=4, default=json_default))
-						else:
-							print("Not writing JSON...", end='')
+		if self.args.art_dump_summary:
+			with open(file, "r") as f:
+				self.handle_file_for_art_dump_summary(file, f)
+			print("Done")
+			return
 
-				print("Done")
-				continue
+		# reset the json_data dict working memory on each file
+		self.json_data = {}
+		self.write_json_data = True
 
+		if self.args.as_asset or file.endswith(".assets") or file.find("\\level") >= 0 or self.find_built_in_assets_index(file) >= 0:
 			with open(file, "rb") as f:
-				bundle = unitypack.load(f)
+				env = UnityEnvironment(base_path=os.path.abspath(os.path.dirname(file)), use_mmap=True, metadata_cache=self.metadata_cache)
+				asset = Asset.from_file(f, environment=env)
 
-				self.json_data['Path'] = bundle.path
-				self.json_data['GeneratorVersion'] = bundle.generator_version
-				self.json_data['CompressionType'] = str(bundle.compression_type).replace(str("CompressionType."), "")
-				self.json_data['FileSize'] = bundle.file_size
-				self.json_data['BlockStorageFileOffset'] = bundle.block_storage_file_offset
+				self.json_data['Path'] = file
 
 				# setup the ArtDump dictionary for handle_asset_for_art_dump
 				if self.args.art_dump:
 					self.json_data['ArtDump'] = {}
-				elif self.args.dep_summary:
-					self.dependency_db.build_from_bundle(file, bundle)
-					continue
 
-				for asset in bundle.assets:
-					if self.args.art_dump:
-						self.handle_asset_for_art_dump(file, asset)
-					else:
-						self.handle_asset(file, asset)
+				if self.args.art_dump:
+					self.handle_asset_for_art_dump(file, asset)
+				else:
+					self.handle_asset(file, asset)
 
 				if not self.args.dry_run:
 					json_path = file + ".json"
 					if self.write_json_data:
 						with open(json_path, "w") as json_file:
-							json_file.write(json.dumps(self.json_data, indent=4))
+							json_file.write(json.dumps(self.json_data, indent=4, default=json_default))
 					else:
 						print("Not writing JSON...", end='')
 
 			print("Done")
+			return
 
-		if self.args.art_dump_summary:
-			print("Writing art dump summary " + "" + "...", end='')
-			self.write_art_dump_summary()
-			print("Done")
-		elif self.args.dep_summary:
-			if self.dependency_db is not None:
-				summary_path = self.get_output_path("dependency_summary" + ".json")
-				print("Writing dependency summary " + "" + "...", flush=True)
-				self.dependency_db.write_to_json_file(summary_path)
-				print("Done")
+		with open(file, "rb") as f:
+			env = UnityEnvironment(metadata_cache=self.metadata_cache)
+			bundle = unitypack.load(f, env, preload_blocks=self.args.decompress_threads > 0, max_workers=self.args.decompress_threads or None,
+				header_only=self.args.bundle_info)
+
+			self.json_data['Path'] = bundle.path
+			self.json_data['GeneratorVersion'] = bundle.generator_version
+			self.json_data['CompressionType'] = str(bundle.compression_type).replace(str("CompressionType."), "")
+			self.json_data['FileSize'] = bundle.file_size
+			self.json_data['BlockStorageFileOffset'] = bundle.block_storage_file_offset
+			if self.args.bundle_info:
+				self.json_data['Nodes'] = [
+					{'Name': name, 'Offset': ofs, 'Size': size, 'Status': status}
+					for ofs, size, status, name in bundle.nodes
+				]
+
+			# setup the ArtDump dictionary for handle_asset_for_art_dump
+			if self.args.art_dump:
+				self.json_data['ArtDump'] = {}
 
-		return 0
+			for asset in bundle.assets:
+				if self.args.art_dump:
+					self.handle_asset_for_art_dump(file, asset)
+				else:
+					self.handle_asset(file, asset)
+
+			if not self.args.dry_run:
+				json_path = file + ".json"
+				if self.write_json_data:
+					with open(json_path, "w") as json_file:
+						json_file.write(json.dumps(self.json_data, indent=4))
+				else:
+					print("Not writing JSON...", end='')
+
+		print("Done")
+
+	def run_jobs(self, files):
+		"""
+		Process files in a pool of --jobs worker processes. The output and
+		summary data of each file are passed back and handled in order.
+		"""
+		with ProcessPoolExecutor(self.args.jobs) as executor:
+			for output, state in executor.map(process_file_in_worker, files, [self.argv] * len(files)):
+				sys.stdout.write(output)
+				sys.stdout.flush()
+				self.merge_summary_state(state)
 
 	def populate_files_with_asset_levels(self, files):
 		if len(self.args.path_to_assets) == 0:
@@ -305,7 +386,7 @@ class UnityAssetStats:
 				continue
 
 			if obj.type == "AssetBundle":
-				d = obj.read()
+				d = obj.read(fields=("m_Name", "m_AssetBundleName", "m_Dependencies", "m_Container"))
 				obj_json = d.to_json_data(obj)
 				asset_json[obj.type] = obj_json
 				continue
@@ -397,7 +478,11 @@ class UnityAssetStats:
 			name = None
 
 			if obj.type == 'Texture2D':
-				d = obj.read()
+				# skip over the image data
+				d = obj.read(fields=(
+					"m_Name", "m_Width", "m_Height", "m_CompleteImageSize",
+					"m_TextureFormat", "m_TextureDimension", "m_IsReadable",
+				))
 				name = d.name
 			else:
 				d = obj.read_name_only()
@@ -583,6 +668,26 @@ class UnityAssetStats:
 
 
 
+# UnityAssetStats of a --jobs worker process
+# (created on the first file, as pool initializers need Python 3.7)
+worker_stats = None
+
+
+def process_file_in_worker(file, args):
+	"""
+	Process a file in a worker, returning its console output and summary data.
+	"""
+	global worker_stats
+	if worker_stats is None:
+		worker_stats = UnityAssetStats(args)
+	worker_stats.init_summary_state()
+	output = StringIO()
+	with redirect_stdout(output):
+		worker_stats.process_file(file)
+		worker_stats.flush_metadata_cache()
+	return output.getvalue(), worker_stats.get_summary_state()
+
+
 def main():
 	app = UnityAssetStats(sys.argv[1:])
 	result = app.run()
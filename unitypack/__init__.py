@@ -1,15 +1,12 @@
-import pkg_resources
+__version__ = "0.7.2"
 
 
-__version__ = pkg_resources.require("unitypack")[0].version
-
-
-def load(file, env=None):
+def load(file, env=None, preload_blocks=False, max_workers=None, header_only=False):
 	from .environment import UnityEnvironment
 
 	if env is None:
 		env = UnityEnvironment()
-	return env.load(file)
+	return env.load(file, preload_blocks, max_workers, header_only)
 
 def load_from_file(file, env=None):
     from .environment import UnityEnvironment
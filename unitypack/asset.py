@@ -2,11 +2,10 @@
 import logging
 import lzma
 from binascii import hexlify
-from io import BytesIO
 from uuid import UUID
-from .object import ObjectInfo
+from .object import ObjectInfo, ObjectTable
 from .type import TypeMetadata
-from .utils import BinaryReader
+from .utils import BinaryReader, LZMAStream, MemoryReader, map_file
 
 
 class Asset:
@@ -32,9 +31,9 @@ class Asset:
 		# FIXME: this offset needs to be explored more
 		ofs = buf.tell()
 		if bundle.compressed:
-			dec = lzma.LZMADecompressor()
-			data = dec.decompress(buf.read())
-			ret._buf = BinaryReader(BytesIO(data[header_size:]), endian=">")
+			# decompressed lazily, as far as reads into the asset require
+			data = LZMAStream(buf.buf, lzma.LZMADecompressor, offset=header_size)
+			ret._buf = BinaryReader(data, endian=">")
 			ret._buf_ofs = 0
 			buf.seek(ofs)
 		else:
@@ -45,15 +44,30 @@ class Asset:
 		return ret
 
 	@classmethod
-	def from_file(cls, file, environment=None):
+	def from_file(cls, file, environment=None, use_mmap=None):
+		"""
+		Open a standalone serialized file (.assets, level files, .resS).
+		With use_mmap, the file is memory-mapped and object payloads and
+		streamed data are returned as memoryview slices instead of copies.
+		It defaults to the setting of the environment.
+		"""
 		ret = cls()
 		ret.name = file.name
 		ret._buf_ofs = file.tell()
-		ret._buf = BinaryReader(file)
 		base_path = os.path.abspath(os.path.dirname(file.name))
 		if environment is None:
 			from .environment import UnityEnvironment
-			ret.environment = UnityEnvironment(base_path=base_path)
+			environment = UnityEnvironment(base_path=base_path, use_mmap=bool(use_mmap))
+		ret.environment = environment
+		if use_mmap is None:
+			use_mmap = environment.use_mmap
+		if use_mmap:
+			ret._buf = MemoryReader(map_file(file))
+		else:
+			ret._buf = BinaryReader(file)
+		cache = getattr(environment, "metadata_cache", None)
+		if cache is not None:
+			ret.metadata_cache_entry = cache.open(file.name)
 		return ret
 
 	def get_asset(self, path):
@@ -63,7 +77,7 @@ class Asset:
 
 	def __init__(self):
 		self._buf_ofs = None
-		self._objects = {}
+		self._objects = ObjectTable(self)
 		self.adds = []
 		self.asset_refs = [self]
 		self.types = {}
@@ -75,6 +89,9 @@ class Asset:
 		self.loaded = False
 		self.block_storage_offset = -1
 		self.block_storage_size = -1
+		# where the metadata of this asset is kept in a MetadataCache
+		self.metadata_cache_entry = None
+		self.metadata_cache_index = 0
 
 	def __repr__(self):
 		return "<%s %s>" % (self.__class__.__name__, self.name)
@@ -100,14 +117,18 @@ class Asset:
 			self.loaded = True
 			return
 
+		entry = self.metadata_cache_entry
+		if entry is not None:
+			metadata = entry.get_asset(self.metadata_cache_index)
+			if metadata is not None:
+				self.set_metadata(metadata)
+				return
+
 		buf = self._buf
 		buf.seek(self._buf_ofs)
 		buf.endian = ">"
 
-		self.metadata_size = buf.read_uint()
-		self.file_size = buf.read_uint()
-		self.format = buf.read_uint()
-		self.data_offset = buf.read_uint()
+		self.metadata_size, self.file_size, self.format, self.data_offset = buf.read_struct("IIII")
 
 		if self.format >= 9:
 			self.endianness = buf.read_uint()
@@ -120,20 +141,16 @@ class Asset:
 			self.long_object_ids = bool(buf.read_uint())
 
 		num_objects = buf.read_uint()
-		for i in range(num_objects):
-			if self.format >= 14:
-				buf.align()
-			obj = ObjectInfo(self)
-			obj.load(buf)
-			self.register_object(obj)
+		self._objects.load(buf, num_objects)
+		for type_id, class_id in dict.fromkeys(zip(self._objects.type_ids, self._objects.class_ids)):
+			self.register_type(type_id, class_id)
 
 		if self.format >= 11:
 			num_adds = buf.read_uint()
 			for i in range(num_adds):
 				if self.format >= 14:
 					buf.align()
-				id = self.read_id(buf)
-				self.adds.append((id, buf.read_int()))
+				self.adds.append(buf.read_struct("qi" if self.format >= 14 else "ii"))
 
 		if self.format >= 6:
 			num_refs = buf.read_uint()
@@ -146,27 +163,77 @@ class Asset:
 		assert not unk_string, repr(unk_string)
 		self.loaded = True
 
+		if entry is not None:
+			entry.set_asset(self.metadata_cache_index, self.get_metadata())
+
+	def get_metadata(self):
+		"""
+		A snapshot of everything load() parses, in plain types, for a
+		MetadataCache.
+		"""
+		return {
+			"header": (self.metadata_size, self.file_size, self.format, self.data_offset),
+			"endianness": getattr(self, "endianness", None),
+			"endian": self._buf.endian,
+			"long_object_ids": self.long_object_ids,
+			"tree": self.tree.get_state(),
+			"objects": self._objects.get_state(),
+			"adds": self.adds,
+			"refs": [(ref.asset_path, ref.guid.bytes, ref.type, ref.file_path) for ref in self.asset_refs[1:]],
+		}
+
+	def set_metadata(self, metadata):
+		"""
+		Load the asset from a snapshot made by get_metadata.
+		"""
+		self.metadata_size, self.file_size, self.format, self.data_offset = metadata["header"]
+		if metadata["endianness"] is not None:
+			self.endianness = metadata["endianness"]
+		self._buf.endian = metadata["endian"]
+		self.long_object_ids = metadata["long_object_ids"]
+		self.tree.set_state(metadata["tree"])
+		self._objects.set_state(metadata["objects"])
+		for type_id, class_id in dict.fromkeys(zip(self._objects.type_ids, self._objects.class_ids)):
+			self.register_type(type_id, class_id)
+		self.adds = list(metadata["adds"])
+		for asset_path, guid, type, file_path in metadata["refs"]:
+			ref = AssetRef(self)
+			ref.asset_path = asset_path
+			ref.guid = UUID(bytes=guid)
+			ref.type = type
+			ref.file_path = file_path
+			ref.asset = None
+			self.asset_refs.append(ref)
+		self.loaded = True
+
 	def read_id(self, buf):
 		if self.format >= 14:
 			return buf.read_int64()
 		else:
 			return buf.read_int()
 
-	def register_object(self, obj):
-		if obj.type_id in self.tree.type_trees:
-			self.types[obj.type_id] = self.tree.type_trees[obj.type_id]
-		elif obj.type_id not in self.types:
+	def register_type(self, type_id, class_id):
+		if type_id in self.tree.type_trees:
+			self.types[type_id] = self.tree.type_trees[type_id]
+		elif type_id not in self.types:
 			trees = TypeMetadata.default(self).type_trees
-			if obj.class_id in trees:
-				self.types[obj.type_id] = trees[obj.class_id]
+			if class_id in trees:
+				self.types[type_id] = trees[class_id]
 			else:
-				#logging.warning("%r absent from structs.dat", obj.class_id)
-				self.types[obj.type_id] = None
-
-		if obj.path_id in self._objects:
-			raise ValueError("Duplicate asset object: %r (path_id=%r)" % (obj, obj.path_id))
-
-		self._objects[obj.path_id] = obj
+				#logging.warning("%r absent from structs.dat", class_id)
+				self.types[type_id] = None
+
+	def iter_names(self):
+		"""
+		Iterate over (ObjectInfo, name) for every object, where name is the
+		leading m_Name string or None. Objects are visited in the order of
+		their data, and only the names are read from it.
+		"""
+		objects = self.objects
+		rows = sorted(range(len(objects)), key=objects.data_offsets.__getitem__)
+		for row in rows:
+			obj = objects.get_row(row)
+			yield obj, obj.peek_name()
 
 	def pretty(self):
 		ret = []
@@ -191,6 +258,8 @@ class Asset:
 
 
 class AssetRef:
+	__slots__ = ("source", "asset_path", "guid", "type", "file_path", "asset")
+
 	def __init__(self, source):
 		self.source = source
 
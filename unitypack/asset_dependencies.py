@@ -1,11 +1,13 @@
-﻿from enum import IntEnum
+﻿from concurrent.futures import ProcessPoolExecutor
+from enum import IntEnum
 from .asset import Asset
-from .assetbundle import AssetBundle
+from .assetbundle import AssetBundle, SIGNATURE_FS, SIGNATURE_RAW, SIGNATURE_WEB
 from .engine.preload_data import PreloadData
 from .engine.asset_bundle import AssetBundle as AssetBundleData, AssetInfo
 from .utils import json_default, printProgressBar
 import json
 import logging
+import os
 
 # forward declarations
 class AssetDependencyDatabase:
@@ -15,6 +17,8 @@ class AssetDependencyTable:
 
 
 class AssetDependencyPPtr:
+	__slots__ = ("file_id", "path_id")
+
 	def __init__(self, obj_ptr):
 		if obj_ptr is None:
 			self.file_id = -1
@@ -28,6 +32,13 @@ class AssetDependencyPPtr:
 			self.file_id, self.path_id
 		)
 
+	# pickled as tuples, to keep the tables sent back by build_from_files workers small
+	def __getstate__(self):
+		return (self.file_id, self.path_id)
+
+	def __setstate__(self, state):
+		self.file_id, self.path_id = state
+
 	@property
 	def is_null(self):
 		return self.file_id == -1 and self.path_id == -1
@@ -44,6 +55,8 @@ class AssetDependencyPPtr:
 		return self.file_id == 0 and self.path_id != -1
 
 class AssetDependencyPreloadData:
+	__slots__ = ("dependencies", "assets")
+
 	def __init__(self):
 		self.dependencies = []
 		self.assets = []
@@ -67,6 +80,8 @@ class AssetDependencyPreloadData:
 			db.add_object_reference(owner_table, asset)
 
 class AssetDependencyAssetInfo:
+	__slots__ = ("source_path", "preload_index", "preload_size", "object_ptr")
+
 	def __init__(self, path, asset_info):
 		self.source_path = path
 		self.preload_index = asset_info.preloadIndex
@@ -77,12 +92,19 @@ class AssetDependencyAssetInfo:
 			self.object_ptr = AssetDependencyPPtr(asset)
 
 class AssetDependencyAssetBundlePreloadInfo:
+	__slots__ = ("preload_index", "preload_size", "object_ptr")
+
 	def __init__(self, info: AssetInfo):
 		self.preload_index = info.preloadIndex
 		self.preload_size = info.preloadSize
 		self.object_ptr = AssetDependencyPPtr(info.asset)
 
 class AssetDependencyAssetBundleData:
+	__slots__ = (
+		"name", "dependencies", "preload_table", "exports",
+		"export_names_by_path_id", "main_asset",
+	)
+
 	def __init__(self):
 		self.name = None
 		self.dependencies = []
@@ -130,6 +152,8 @@ class AssetDependencyAssetBundleData:
 			db.add_object_reference(owner_table, asset)
 
 class AssetDependencyObject:
+	__slots__ = ("path_id", "unity_type", "size", "name", "referenced_by")
+
 	def __init__(self):
 		self.path_id = -1
 		self.unity_type = None
@@ -137,6 +161,12 @@ class AssetDependencyObject:
 		self.name = None
 		self.referenced_by = None
 
+	def __getstate__(self):
+		return (self.path_id, self.unity_type, self.size, self.name, self.referenced_by)
+
+	def __setstate__(self, state):
+		self.path_id, self.unity_type, self.size, self.name, self.referenced_by = state
+
 	def set_name(self, obj, asset_bundle_data: AssetDependencyAssetBundleData):
 		# try to avoid obj.read's, which will cause chunks to get compressed as needed
 		if asset_bundle_data is not None:
@@ -158,6 +188,12 @@ class AssetDependencyObject:
 		self.referenced_by.add(src_table.name)
 
 class AssetDependencyTable:
+	__slots__ = (
+		"table_index", "source_file", "name", "preload_data", "asset_bundle_data",
+		"external_refs", "referenced_by", "objects",
+		"unreferenced_bytes", "unreferenced_objects",
+	)
+
 	def __init__(self):
 		self.table_index = -1
 		self.source_file = None
@@ -168,7 +204,7 @@ class AssetDependencyTable:
 		self.referenced_by = None
 		self.objects = {}
 
-	def setup(self, asset: Asset):
+	def setup(self, asset: Asset, show_progress=True):
 		self.name = asset.name
 
 		# fix standalone .asset or level files where the asset.name returns the file path
@@ -191,17 +227,19 @@ class AssetDependencyTable:
 				self.preload_data = AssetDependencyPreloadData()
 				self.preload_data.setup(d)
 			elif obj.type == "AssetBundle":
-				d = obj.read()
+				d = obj.read(fields=("m_AssetBundleName", "m_Dependencies", "m_PreloadTable", "m_Container", "m_MainAsset"))
 				self.asset_bundle_data = AssetDependencyAssetBundleData()
 				self.asset_bundle_data.setup(d)
 
 		l = len(asset.objects)
 		index = 0
-		printProgressBar(index, l, prefix = 'Progress:', suffix = 'Complete', length = 50)
+		if show_progress:
+			printProgressBar(index, l, prefix = 'Progress:', suffix = 'Complete', length = 50)
 
 		for id, obj in asset.objects.items():
 			index += 1
-			printProgressBar(index, l, prefix = 'Progress:', suffix = 'Complete', length = 50)
+			if show_progress:
+				printProgressBar(index, l, prefix = 'Progress:', suffix = 'Complete', length = 50)
 
 			if obj.type_tree is None:
 				continue
@@ -278,19 +316,50 @@ class AssetDependencyTable:
 
 
 class AssetDependencyDatabase:
+	__slots__ = ("dependency_table", "external_ref_name_to_table_index")
+
 	def __init__(self):
 		self.dependency_table = []
 		self.external_ref_name_to_table_index = {}
 
-	def build_from_bundle(self, source_file: str, bundle: AssetBundle):
+	def build_from_bundle(self, source_file: str, bundle: AssetBundle, show_progress=True):
 		for asset in bundle.assets:
-			self.add_asset(source_file, asset)
-
-	def add_asset(self, source_file: str, asset: Asset):
+			self.add_asset(source_file, asset, show_progress)
+
+	def build_from_files(self, files, max_workers=None, metadata_cache=None, show_progress=False):
+		"""
+		Add the assets of bundles and serialized files, setting up their
+		tables in a pool of max_workers processes (see setup_file_tables),
+		or in this process when max_workers is 1. Tables are added in the
+		order of files. show_progress shows the progress over the files.
+		"""
+		files = list(files)
+		metadata_caches = [metadata_cache] * len(files)
+		if max_workers == 1:
+			self._add_file_tables(map(setup_file_tables, files, metadata_caches), len(files), show_progress)
+			return
+		with ProcessPoolExecutor(max_workers) as executor:
+			self._add_file_tables(executor.map(setup_file_tables, files, metadata_caches), len(files), show_progress)
+
+	def _add_file_tables(self, tables_by_file, num_files, show_progress):
+		if show_progress and num_files:
+			printProgressBar(0, num_files, prefix = 'Progress:', suffix = 'Complete', length = 50)
+		for index, tables in enumerate(tables_by_file, 1):
+			for table in tables:
+				self.add_table(table)
+			if show_progress:
+				printProgressBar(index, num_files, prefix = 'Progress:', suffix = 'Complete', length = 50)
+
+	def add_asset(self, source_file: str, asset: Asset, show_progress=True):
 		table = AssetDependencyTable()
 		table.source_file = source_file
-		table.setup(asset)
+		table.setup(asset, show_progress)
+		self.add_table(table)
 
+	def add_table(self, table: AssetDependencyTable):
+		"""
+		Add a table which was set up elsewhere, such as in another process.
+		"""
 		# NOTE variant bundles all have the same name (CAB-...), so skip everything but the first encountered variant
 		if table.name.lower() in self.external_ref_name_to_table_index:
 			return
@@ -330,7 +399,11 @@ class AssetDependencyDatabase:
 
 		external_ref_table.add_reference(src_table)
 
-	def write_to_json_file(self, json_path: str):
+	def build_report(self):
+		"""
+		Resolve the references between the added tables, then drop the
+		data only needed to do so and the tables nothing references.
+		"""
 		for table in self.dependency_table:
 			table.build_report(self)
 
@@ -343,6 +416,9 @@ class AssetDependencyDatabase:
 		for t in ts:
 			self.dependency_table.remove(t)
 
+	def write_to_json_file(self, json_path: str):
+		self.build_report()
+
 		with open(json_path, "w") as json_file:
 			json_file.write(json.dumps(self, indent=4, default=json_default))
 
@@ -353,3 +429,32 @@ class AssetDependencyDatabase:
 			return ref_path
 
 		return ref_path[last_forward_slash+1:]
+
+
+BUNDLE_SIGNATURES = tuple(sig.encode() + b"\0" for sig in (SIGNATURE_FS, SIGNATURE_RAW, SIGNATURE_WEB))
+
+
+def setup_file_tables(path: str, metadata_cache=None) -> list:
+	"""
+	Set up the dependency tables of the assets of a bundle or serialized
+	file, without progress output. Run by the workers of build_from_files.
+	"""
+	from .environment import UnityEnvironment
+
+	env = UnityEnvironment(base_path=os.path.abspath(os.path.dirname(path)), metadata_cache=metadata_cache)
+	tables = []
+	with open(path, "rb") as f:
+		is_bundle = f.read(9).startswith(BUNDLE_SIGNATURES)
+		f.seek(0)
+		if is_bundle:
+			assets = env.load(f).assets
+		else:
+			assets = [Asset.from_file(f, environment=env, use_mmap=True)]
+		for asset in assets:
+			table = AssetDependencyTable()
+			table.source_file = path
+			table.setup(asset, show_progress=False)
+			tables.append(table)
+	if metadata_cache is not None:
+		metadata_cache.flush()
+	return tables
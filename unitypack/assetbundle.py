@@ -1,5 +1,9 @@
 ﻿import lzma
+import os
 import struct
+from bisect import bisect_right
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 from .asset import Asset
 from .enums import CompressionType
@@ -10,20 +14,47 @@ SIGNATURE_RAW = "UnityRaw"
 SIGNATURE_WEB = "UnityWeb"
 SIGNATURE_FS = "UnityFS"
 
+DEFAULT_BLOCK_CACHE_SIZE = 64 * 1024 * 1024
+# blocks are only preloaded into memory up to this many bytes at once
+DEFAULT_PRELOAD_MAX_SIZE = 256 * 1024 * 1024
+
 
 class AssetBundle:
-	def __init__(self, environment):
+	def __init__(self, environment, block_cache_size=None, preload_max_size=None):
 		self.environment = environment
 		self.assets = []
 		self._all_assets = []
 		self.block_storage_file_offset = -1
 		self.compression_type = CompressionType.NONE
+		if block_cache_size is None:
+			block_cache_size = getattr(environment, "block_cache_size", DEFAULT_BLOCK_CACHE_SIZE)
+		self.block_cache = BlockCache(block_cache_size)
+		if preload_max_size is None:
+			preload_max_size = getattr(environment, "preload_max_size", DEFAULT_PRELOAD_MAX_SIZE)
+		self.preload_max_size = preload_max_size
+		self.metadata_cache_entry = None
+		# (offset, size, status, name) of the files of UnityFS bundles
+		self.nodes = []
+		# lowercased name -> asset, built on the first get_asset() call
+		self._assets_by_name = None
 
 	def __repr__(self):
 		if hasattr(self, "name"):
 			return "<%s %r>" % (self.__class__.__name__, self.name)
 		return "<%s>" % (self.__class__.__name__)
 
+	def get_asset(self, name):
+		"""
+		Return the asset of the bundle with the given name (case
+		insensitive), or None.
+		"""
+		if self._assets_by_name is None:
+			index = {}
+			for asset in self.assets:
+				index.setdefault(asset.name.lower(), asset)
+			self._assets_by_name = index
+		return self._assets_by_name.get(name.lower())
+
 	@property
 	def is_unityfs(self):
 		return self.signature == SIGNATURE_FS
@@ -32,7 +63,13 @@ class AssetBundle:
 	def compressed(self):
 		return self.signature == SIGNATURE_WEB
 
-	def load(self, file):
+	def load(self, file, preload_blocks=False, max_workers=None, header_only=False):
+		"""
+		Load a bundle. For UnityFS bundles, preload_blocks decompresses every
+		data block up front using a pool of max_workers threads.
+		With header_only, only the header, block table and list of nodes
+		are read, and no assets are loaded.
+		"""
 		buf = BinaryReader(file, endian=">")
 		self.path = file.name
 
@@ -42,12 +79,12 @@ class AssetBundle:
 		self.generator_version = buf.read_string()
 
 		if self.is_unityfs:
-			self.load_unityfs(buf)
+			self.load_unityfs(buf, preload_blocks, max_workers, header_only)
 		else:
 			assert self.signature in (SIGNATURE_RAW, SIGNATURE_WEB), self.signature
-			self.load_raw(buf)
+			self.load_raw(buf, header_only)
 
-	def load_raw(self, buf):
+	def load_raw(self, buf, header_only=False):
 		self.file_size = buf.read_uint()
 		self.header_size = buf.read_int()
 
@@ -67,8 +104,11 @@ class AssetBundle:
 		buf.read_int()
 		buf.read_byte()
 		self.name = buf.read_string()
+		if header_only:
+			return
 
 		# Preload assets
+		entry = self.open_metadata_cache_entry()
 		buf.seek(self.header_size)
 		if not self.compressed:
 			num_assets = buf.read_int()
@@ -76,8 +116,16 @@ class AssetBundle:
 			num_assets = 1
 		for i in range(num_assets):
 			asset = Asset.from_bundle(self, buf)
+			asset.metadata_cache_entry = entry
+			asset.metadata_cache_index = i
 			self.assets.append(asset)
 
+	def open_metadata_cache_entry(self, guid=None):
+		cache = getattr(self.environment, "metadata_cache", None)
+		if cache is not None:
+			self.metadata_cache_entry = cache.open(self.path, guid)
+		return self.metadata_cache_entry
+
 	def read_compressed_data(self, buf, compression):
 		data = buf.read(self.ciblock_size)
 		if compression == CompressionType.NONE:
@@ -88,7 +136,14 @@ class AssetBundle:
 
 		raise NotImplementedError("Unimplemented compression method: %r" % (compression))
 
-	def load_unityfs(self, buf):
+	def decompress_blocks(self, first=0, last=None, max_workers=None):
+		"""
+		Decompress the UnityFS data blocks [first, last) concurrently.
+		See ArchiveBlockStorage.decompress_blocks.
+		"""
+		return self.block_storage.decompress_blocks(first, last, max_workers)
+
+	def load_unityfs(self, buf, preload_blocks=False, max_workers=None, header_only=False):
 		self.file_size = buf.read_int64()
 		self.ciblock_size = buf.read_uint()
 		self.uiblock_size = buf.read_uint()
@@ -96,37 +151,41 @@ class AssetBundle:
 		compression = CompressionType(flags & 0x3F)
 		self.compression_type = compression
 		eof_metadata = flags & 0x80
+
 		if eof_metadata:
 			orig_pos = buf.tell()
 			buf.seek(-self.ciblock_size, 2)
 		data = self.read_compressed_data(buf, compression)
 		if eof_metadata:
 			buf.seek(orig_pos)
+		# the block info starts with the GUID of the bundle, part of its cache key
+		entry = self.open_metadata_cache_entry(bytes(data[:16]))
+		if entry is not None and entry.bundle is not None:
+			block_table, nodes = entry.bundle
+			self.guid = bytes(data[:16])
+		else:
+			self.guid, block_table, nodes = self.read_block_info(BinaryReader(BytesIO(data), endian=">"))
+			if entry is not None:
+				entry.set_bundle((block_table, nodes))
+
+		self.blocks = [ArchiveBlockInfo(busize, bcsize, bflags) for busize, bcsize, bflags in block_table]
+		self.nodes = nodes
+		if header_only:
+			self.block_storage_file_offset = buf.tell()
+			self.name = next((name for _, _, _, name in nodes if not name.startswith("GI/")), None)
+			return
 
-		blk = BinaryReader(BytesIO(data), endian=">")
-		self.guid = blk.read(16)
-		num_blocks = blk.read_int()
-		blocks = []
-		for i in range(num_blocks):
-			busize, bcsize = blk.read_uint(), blk.read_uint()
-			bflags = blk.read_int16()
-			blocks.append(ArchiveBlockInfo(busize, bcsize, bflags))
-
-		num_nodes = blk.read_int()
-		nodes = []
-		for i in range(num_nodes):
-			ofs = blk.read_int64()
-			size = blk.read_int64()
-			status = blk.read_int()
-			name = blk.read_string()
-			nodes.append((ofs, size, status, name))
-
-		storage = ArchiveBlockStorage(blocks, buf)
+		storage = ArchiveBlockStorage(self.blocks, buf, self.block_cache, self.preload_max_size)
+		self.block_storage = storage
 		self.block_storage_file_offset = storage.basepos
-		for ofs, size, status, name in nodes:
+		if preload_blocks:
+			storage.decompress_blocks(max_workers=max_workers)
+		for i, (ofs, size, status, name) in enumerate(nodes):
 			storage.seek(ofs)
 			asset = Asset.from_bundle(self, storage)
 			asset.name = name
+			asset.metadata_cache_entry = entry
+			asset.metadata_cache_index = i
 			asset.block_storage_offset = ofs
 			asset.block_storage_size = size
 			self._all_assets.append(asset)
@@ -136,6 +195,73 @@ class AssetBundle:
 		# Hacky
 		self.name = self.assets[0].name
 
+	def read_block_info(self, blk):
+		"""
+		Read the decompressed block info of a UnityFS bundle.
+		Returns (guid, blocks, nodes) where blocks are
+		(uncompressed_size, compressed_size, flags) tuples and nodes are
+		(offset, size, status, name) tuples.
+		"""
+		guid = blk.read(16)
+		num_blocks = blk.read_int()
+		blocks = blk.read_array("IIh", num_blocks)
+
+		num_nodes = blk.read_int()
+		nodes = []
+		for i in range(num_nodes):
+			ofs, size, status = blk.read_struct("qqi")
+			name = blk.read_string()
+			nodes.append((ofs, size, status, name))
+		return guid, blocks, nodes
+
+
+class BlockCache:
+	"""
+	LRU cache of the decompressed data of archive blocks, bounded by the
+	total size of the cached data. Blocks larger than the cache are never
+	kept.
+	"""
+	def __init__(self, max_size=DEFAULT_BLOCK_CACHE_SIZE):
+		self.max_size = max_size
+		self.size = 0
+		self.blocks = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+	def __repr__(self):
+		return "<%s %d/%d bytes (hits=%r, misses=%r, evictions=%r)>" % (
+			self.__class__.__name__, self.size, self.max_size,
+			self.hits, self.misses, self.evictions
+		)
+
+	def __len__(self):
+		return len(self.blocks)
+
+	def get(self, index):
+		data = self.blocks.get(index)
+		if data is None:
+			self.misses += 1
+			return None
+		self.hits += 1
+		self.blocks.move_to_end(index)
+		return data
+
+	def put(self, index, data):
+		size = len(data)
+		if index in self.blocks or size > self.max_size:
+			return
+		while self.size + size > self.max_size:
+			_, evicted = self.blocks.popitem(last=False)
+			self.size -= len(evicted)
+			self.evictions += 1
+		self.blocks[index] = data
+		self.size += size
+
+	def clear(self):
+		self.blocks.clear()
+		self.size = 0
+
 
 class ArchiveBlockInfo:
 	def __init__(self, usize, csize, flags):
@@ -168,15 +294,15 @@ class ArchiveBlockInfo:
 			props = int(props / 9)
 			pb = int(props / 5)
 			lp = props % 5
-			dec = lzma.LZMADecompressor(format=lzma.FORMAT_RAW, filters=[{
+			filters = [{
 				"id": lzma.FILTER_LZMA1,
 				"dict_size": dict_size,
 				"lc": lc,
 				"lp": lp,
 				"pb": pb,
-			}])
-			res = dec.decompress(buf.read())
-			return BytesIO(res)
+			}]
+			dec = lzma.LZMADecompressor(format=lzma.FORMAT_RAW, filters=filters)
+			return BytesIO(dec.decompress(buf.read()))
 		if ty in (CompressionType.LZ4, CompressionType.LZ4HC):
 			res = lz4_decompress(buf.read(self.compressed_size), self.uncompressed_size)
 			return BytesIO(res)
@@ -184,24 +310,60 @@ class ArchiveBlockInfo:
 
 
 class ArchiveBlockStorage:
-	def __init__(self, blocks, stream):
+	def __init__(self, blocks, stream, cache=None, preload_max_size=DEFAULT_PRELOAD_MAX_SIZE):
 		self.blocks = blocks
 		self.stream = stream
+		self.cache = cache
+		self.preload_max_size = preload_max_size
 		self.cursor = 0
 		self.basepos = stream.tell()
-		self.maxpos = sum([b.uncompressed_size for b in blocks])
-		self.sought = False
+		# cumulative offsets of each block, for bisection in seek_to_block
+		self.block_starts = []
+		self.block_ends = []
+		self.compressed_starts = []
+		ofs = 0
+		compressed_ofs = 0
+		for b in blocks:
+			self.block_starts.append(ofs)
+			self.compressed_starts.append(compressed_ofs)
+			ofs += b.uncompressed_size
+			compressed_ofs += b.compressed_size
+			self.block_ends.append(ofs)
+		self.maxpos = ofs
+		# whether the cursor moved since the current stream was positioned;
+		# blocks are only decompressed when they are read
+		self.sought = True
 		self.current_block = None
 		self.current_block_start = 0
 		self.current_block_index = -1
 		self.current_stream = None
-		self._seek(0)
+		# uncompressed data of the blocks filled in by decompress_blocks
+		self.preloaded = None
+		self.preloaded_start = 0
+		self.preloaded_end = 0
 
 	def read(self, size=-1):
 		buf = bytearray()
 		while size != 0 and self.cursor < self.maxpos:
+			if self.preloaded_start <= self.cursor < self.preloaded_end:
+				# served from the preloaded buffer, across block boundaries
+				start = self.cursor - self.preloaded_start
+				end = self.preloaded_end - self.preloaded_start
+				if size > 0:
+					end = min(end, start + size)
+					size -= end - start
+				self.cursor += end - start
+				self.sought = True
+				if not buf and size == 0:
+					return self.preloaded[start:end].tobytes()
+				buf += self.preloaded[start:end]
+				continue
 			if not self.in_current_block(self.cursor):
 				self.seek_to_block(self.cursor)
+				self.sought = True
+			if self.sought:
+				self.current_stream.seek(self.cursor - self.current_block_start)
+				self.sought = False
 			part = self.current_stream.read(size)
 			if size > 0:
 				if len(part) == 0:
@@ -220,17 +382,12 @@ class ArchiveBlockStorage:
 		else:
 			new_cursor = offset
 		if self.cursor != new_cursor:
-			self._seek(new_cursor)
+			self.cursor = new_cursor
+			self.sought = True
 
 	def tell(self):
 		return self.cursor
 
-	def _seek(self, new_cursor):
-		self.cursor = new_cursor
-		if not self.in_current_block(new_cursor):
-			self.seek_to_block(new_cursor)
-		self.current_stream.seek(new_cursor - self.current_block_start)
-
 	def in_current_block(self, pos):
 		if self.current_block is None:
 			return False
@@ -238,34 +395,80 @@ class ArchiveBlockStorage:
 		return self.current_block_start <= pos and pos < end
 
 	def seek_to_block(self, pos):
-		baseofs = 0
-		ofs = 0
-		desired_block = None
-		desired_block_index = 0
-		for b in self.blocks:
-			if ofs + b.uncompressed_size > pos:
-				desired_block = b
-				break
-			baseofs += b.compressed_size
-			ofs += b.uncompressed_size
-			desired_block_index += 1
-		else:
+		# first block which ends after pos
+		desired_block_index = bisect_right(self.block_ends, pos)
+		if desired_block_index >= len(self.blocks):
 			self.current_block = None
 			self.current_stream = BytesIO(b"")
 			return
 
-		if self.current_block is None:
-			self.current_block = desired_block
-			self.current_block_index = desired_block_index
 		# don't re-decompress if we're in the same block
-		elif self.current_block_index == desired_block_index:
+		if self.current_block is not None and self.current_block_index == desired_block_index:
 			self.current_stream.seek(0)
 			return
-		else:
-			self.current_block = desired_block
-			self.current_block_index = desired_block_index
 
-		self.current_block_start = ofs
+		self.current_block = self.blocks[desired_block_index]
+		self.current_block_index = desired_block_index
+		self.current_block_start = self.block_starts[desired_block_index]
+		self.current_stream = self.read_block(desired_block_index, self.compressed_starts[desired_block_index])
+
+	def read_block(self, index, baseofs):
+		"""
+		Return a stream over the decompressed data of a block, going through
+		the block cache for compressed blocks.
+		"""
+		block = self.blocks[index]
+		use_cache = self.cache is not None and block.compressed
+		if use_cache:
+			data = self.cache.get(index)
+			if data is not None:
+				return BytesIO(data)
+
 		self.stream.seek(self.basepos + baseofs)
-		buf = BytesIO(self.stream.read(self.current_block.compressed_size))
-		self.current_stream = self.current_block.decompress(buf)
+		ret = block.decompress(BytesIO(self.stream.read(block.compressed_size)))
+		if use_cache:
+			self.cache.put(index, ret.getvalue())
+		return ret
+
+	def decompress_blocks(self, first=0, last=None, max_workers=None):
+		"""
+		Decompress the blocks [first, last) concurrently into one shared
+		buffer, which then serves all reads in that range. LZ4 and LZMA
+		release the GIL, so this scales with max_workers threads.
+		Compressed data is still read from the stream serially.
+		Ranges larger than preload_max_size are not preloaded, their blocks
+		are decompressed when read and go through the block cache instead.
+		Returns whether the range was preloaded.
+		"""
+		if last is None:
+			last = len(self.blocks)
+		if first >= last:
+			return False
+
+		start = self.block_starts[first]
+		end = self.block_ends[last - 1]
+		if self.preload_max_size is not None and end - start > self.preload_max_size:
+			return False
+		buffer = bytearray(end - start)
+
+		def decompress(index, data):
+			block = self.blocks[index]
+			ret = block.decompress(BytesIO(data)).getvalue()
+			if len(ret) != block.uncompressed_size:
+				raise ValueError("Block %i decompressed to %i bytes, expected %i" % (index, len(ret), block.uncompressed_size))
+			ofs = self.block_starts[index] - start
+			buffer[ofs:ofs + len(ret)] = ret
+
+		with ThreadPoolExecutor(max_workers or os.cpu_count() or 1) as executor:
+			futures = []
+			for index in range(first, last):
+				self.stream.seek(self.basepos + self.compressed_starts[index])
+				data = self.stream.read(self.blocks[index].compressed_size)
+				futures.append(executor.submit(decompress, index, data))
+			for future in futures:
+				future.result()
+
+		self.preloaded = memoryview(buffer)
+		self.preloaded_start = start
+		self.preloaded_end = end
+		return True
@@ -81,4 +81,4 @@ class StreamedResource(Object):
 			logging.warning("No data available for StreamedResource")
 			return b""
 		self.asset._buf.seek(self.asset._buf_ofs + self.offset)
-		return self.asset._buf.read(self.size)
+		return self.asset._buf.read_view(self.size)
@@ -19,6 +19,8 @@ class Mesh(Object):
 	submeshes = field("m_SubMeshes")
 	keep_vertices = field("m_KeepVertices")
 	index_buffer = field("m_IndexBuffer")
+	index_format = field("m_IndexFormat", default=0)
+	use_16bit_indices = field("m_Use16BitIndices", default=True)
 	vertex_data = field("m_VertexData")
 
 
@@ -35,6 +37,7 @@ class VertexData(Object):
 	channels = field("m_Channels")
 	current_channels = field("m_CurrentChannels")
 	data = field("m_DataSize")
+	streams = field("m_Streams", default=None)
 	vertex_count = field("m_VertexCount")
 
 
@@ -1,4 +1,5 @@
-﻿from enum import IntEnum
+﻿import logging
+from enum import IntEnum
 from .object import Object, field
 
 
@@ -249,4 +250,4 @@ class StreamingInfo(Object):
 			logging.warning("No data available for StreamingInfo")
 			return b""
 		self.asset._buf.seek(self.asset._buf_ofs + self.offset)
-		return self.asset._buf.read(self.size)
+		return self.asset._buf.read_view(self.size)
@@ -1,54 +1,104 @@
 import os
 from urllib.parse import urlparse
 from .asset import Asset
-from .assetbundle import AssetBundle
+from .assetbundle import AssetBundle, DEFAULT_BLOCK_CACHE_SIZE, DEFAULT_PRELOAD_MAX_SIZE
+from .utils import DEFAULT_MAX_OPEN_FILES, FilePool
 
 
 class UnityEnvironment:
-	def __init__(self, base_path=""):
+	def __init__(self, base_path="", use_mmap=False, block_cache_size=DEFAULT_BLOCK_CACHE_SIZE, metadata_cache=None,
+		max_open_files=DEFAULT_MAX_OPEN_FILES, preload_max_size=DEFAULT_PRELOAD_MAX_SIZE):
 		self.bundles = {}
 		self.assets = {}
 		self.base_path = base_path
-		self.files = []
+		self.use_mmap = use_mmap
+		self.block_cache_size = block_cache_size
+		# largest range of blocks decompressed up front with preload_blocks
+		self.preload_max_size = preload_max_size
+		# optional MetadataCache, to skip parsing the metadata of unchanged files
+		self.metadata_cache = metadata_cache
+		# files the environment opens itself (discovered bundles and assets)
+		# are read through a pool that keeps at most max_open_files open
+		self.file_pool = FilePool(max_open_files)
+		# absolute path -> loaded bundle
+		self._bundles_by_path = {}
+		# directory -> {"cab-" + lowercased file name without extension: [paths]}
+		# for the directories of the loaded bundles, listed on first use
+		self._directory_index = {}
+		# names discover() didn't find -> number of bundles loaded at the time
+		self._discover_misses = {}
 
 	def __del__(self):
-		for f in self.files:
-			f.close()
+		self.file_pool.close()
 
 	def __repr__(self):
 		return "%s(base_path=%r)" % (self.__class__.__name__, self.base_path)
 
-	def load(self, file):
-		for bundle in self.bundles.values():
-			if os.path.abspath(file.name) == os.path.abspath(bundle.path):
-				return bundle
+	def load(self, file, preload_blocks=False, max_workers=None, header_only=False):
+		path = os.path.abspath(file.name)
+		if path in self._bundles_by_path:
+			return self._bundles_by_path[path]
 		ret = AssetBundle(self)
-		ret.load(file)
+		ret.load(file, preload_blocks, max_workers, header_only)
+		if header_only:
+			# without assets, the bundle can't resolve references
+			return ret
+		self._bundles_by_path[path] = ret
+		self._directory_index.setdefault(os.path.dirname(path), None)
 		self.bundles[ret.name.lower()] = ret
 		for asset in ret.assets:
 			self.assets[asset.name.lower()] = asset
 		return ret
 
+	def open(self, path):
+		"""
+		Open a file through the file pool of the environment, which closes
+		and reopens it as needed. The result can be passed to load().
+		"""
+		return self.file_pool.open(path)
+
+	def get_directory_index(self, dirname):
+		"""
+		Return {"cab-" + lowercased file name without extension: [paths]}
+		for the files of a directory. Each directory is only listed once.
+		"""
+		index = self._directory_index.get(dirname)
+		if index is None:
+			index = {}
+			for name in os.listdir(dirname):
+				path = os.path.join(dirname, name)
+				# .manifest files sit next to the bundles they describe
+				if name.endswith(".manifest") or not os.path.isfile(path):
+					continue
+				basename = os.path.splitext(name)[0]
+				index.setdefault("cab-" + basename.lower(), []).append(path)
+			self._directory_index[dirname] = index
+		return index
+
 	def discover(self, name):
-		for bundle in list(self.bundles.values()):
-			dirname = os.path.dirname(os.path.abspath(bundle.path))
-			for filename in os.listdir(dirname):
-				basename = os.path.splitext(os.path.basename(filename))[0]
-				if name.lower() == "cab-" + basename.lower():
-					f = open(os.path.join(dirname, filename), "rb")
-					self.files.append(f)
-					self.load(f)
+		"""
+		Load the bundles named after a CAB name ("CAB-<file name>") from
+		the directories of the loaded bundles. Names that aren't found
+		aren't looked up again until another bundle is loaded.
+		"""
+		name = name.lower()
+		if self._discover_misses.get(name) == len(self._bundles_by_path):
+			return
+		for dirname in list(self._directory_index):
+			for path in self.get_directory_index(dirname).get(name, ()):
+				if os.path.abspath(path) in self._bundles_by_path:
+					continue
+				self.load(self.open(path))
+		self._discover_misses[name] = len(self._bundles_by_path)
 
 	def get_asset_by_filename(self, name):
 		if name not in self.assets:
 			path = os.path.join(self.base_path, name)
 			if os.path.exists(path):
-				f = open(path, "rb")
-				self.files.append(f)
-				self.assets[name] = Asset.from_file(f)
+				self.assets[name] = Asset.from_file(self.open(path), environment=self)
 			else:
+				# loaded bundles register their assets
 				self.discover(name)
-				self.populate_assets()
 				if name not in self.assets:
 					raise KeyError("No such asset: %r" % (name))
 		return self.assets[name]
@@ -75,11 +125,9 @@ class UnityEnvironment:
 
 			# Still didn't find it? Give up...
 			if archive not in self.bundles:
-				raise NotImplementedError("Cannot find %r in %r" % (archive, self.bundles))
-
-		bundle = self.bundles[archive]
+				raise NotImplementedError("Cannot find %r in %i loaded bundles" % (archive, len(self.bundles)))
 
-		for asset in bundle.assets:
-			if asset.name.lower() == name:
-				return asset
-		raise KeyError("No such asset: %r" % (name))
+		asset = self.bundles[archive].get_asset(name)
+		if asset is None:
+			raise KeyError("No such asset: %r" % (name))
+		return asset
@@ -1,196 +1,293 @@
-from io import BytesIO
-from .utils import BinaryReader
+from io import StringIO
 
 
-class OBJVector2:
-	def __init__(self, x=0, y=0):
-		self.x = x
-		self.y = y
+def _import_numpy():
+	try:
+		import numpy
+	except ImportError:
+		raise RuntimeError("numpy is required to export meshes")
+	return numpy
 
-	def read(self, buf):
-		self.x = buf.read_float()
-		self.y = buf.read_float()
-		return self
 
-	def __str__(self):
-		return "%s %s" % (self.x, 1 - self.y)
+# The vertex attribute of each channel, by number of channels
+# (6 before Unity 5, 8 in Unity 5 and 2017, 14 since Unity 2018)
+VERTEX_CHANNELS = {
+	6: ("vertices", "normals", "colors", "uv1", "uv2", "tangents"),
+	8: ("vertices", "normals", "colors", "uv1", "uv2", "uv3", "uv4", "tangents"),
+	14: (
+		"vertices", "normals", "tangents", "colors", "uv1", "uv2", "uv3", "uv4",
+		None, None, None, None, None, None,
+	),
+}
 
+# dtype of the channel formats whose meaning doesn't depend on the Unity version
+VERTEX_FORMATS = {
+	0: "<f4",  # float
+	1: "<f2",  # half float
+	2: "u1",  # color / unorm8
+}
 
-class OBJVector3(OBJVector2):
-	def __init__(self, x=0, y=0, z=0):
-		super().__init__(x, y)
-		self.z = z
+# dtype of the other channel formats, by the first Unity version using them:
+# VertexChannelFormat before 2017, then VertexFormat, which dropped color
+# (format 2) in 2019 so that the later formats shifted down by one
+VERSION_VERTEX_FORMATS = (
+	(2019, {
+		3: "i1", 4: "<u2", 5: "<i2",  # snorm8, unorm16, snorm16
+		6: "u1", 7: "i1", 8: "<u2", 9: "<i2", 10: "<u4", 11: "<i4",  # uint8 to sint32
+	}),
+	(2017, {
+		3: "u1", 4: "i1", 5: "<u2", 6: "<i2",  # unorm8, snorm8, unorm16, snorm16
+		7: "u1", 8: "i1", 9: "<u2", 10: "<i2", 11: "<u4", 12: "<i4",  # uint8 to sint32
+	}),
+	(0, {
+		3: "u1", 4: "<u4",  # byte, uint32
+	}),
+)
 
-	def read(self, buf):
-		super().read(buf)
-		self.z = buf.read_float()
-		return self
 
-	def __str__(self):
-		return "%s %s %s" % (-self.x, self.y, self.z)
+def get_vertex_formats(unity_version):
+	"""
+	Return the dtype of each channel format for a Unity version such as
+	"2019.4.1f1". Without a known version, only VERTEX_FORMATS are known.
+	"""
+	try:
+		major = int(unity_version.split(".")[0])
+	except (AttributeError, ValueError):
+		return VERTEX_FORMATS
+	for first_version, formats in VERSION_VERTEX_FORMATS:
+		if major >= first_version:
+			ret = VERTEX_FORMATS.copy()
+			ret.update(formats)
+			return ret
 
 
-class OBJVector4(OBJVector3):
-	def __init__(self, x=0, y=0, z=0, w=0):
-		super().__init__(x, y, z)
-		self.w = w
-
-	def read(self, buf):
-		super().read(buf)
-		self.w = buf.read_float()
-		return self
-
-	def read_color(self, buf):
-		self.x = buf.read_ubyte()
-		self.y = buf.read_ubyte()
-		self.z = buf.read_ubyte()
-		self.w = buf.read_ubyte()
-		return self
-
-	def __str__(self):
-		return "%s %s %s %s" % (self.x, self.y, self.z, self.w)
+def _get(obj, name):
+	# engine objects, dicts and records of structured arrays alike
+	return getattr(obj, "_obj", obj)[name]
 
 
 class MeshData:
-	def __init__(self, mesh):
+	"""
+	The indices and vertex attributes of a mesh, as NumPy arrays viewing
+	its index and vertex buffers. Vertex attributes are (vertex count,
+	dimension) arrays, which are empty when the mesh doesn't have them.
+	The meaning of most channel formats depends on unity_version, the
+	generator_version of the asset of the mesh.
+	"""
+	def __init__(self, mesh, unity_version=None):
+		np = _import_numpy()
 		self.mesh = mesh
+		self.vertex_formats = get_vertex_formats(unity_version)
 		self.indices = []
 		self.triangles = []
-		self.vertices = []
-		self.normals = []
-		self.colors = []
-		self.uv1 = []
-		self.uv2 = []
-		self.uv3 = []
-		self.uv4 = []
-		self.tangents = []
+		self.vertices = np.empty((0, 3), np.float32)
+		self.normals = np.empty((0, 3), np.float32)
+		self.colors = np.empty((0, 4), np.uint8)
+		self.uv1 = np.empty((0, 2), np.float32)
+		self.uv2 = np.empty((0, 2), np.float32)
+		self.uv3 = np.empty((0, 2), np.float32)
+		self.uv4 = np.empty((0, 2), np.float32)
+		self.tangents = np.empty((0, 4), np.float32)
 		self.extract_indices()
 		self.extract_vertices()
 
+	def get_index_dtype(self):
+		mesh = self.mesh
+		if mesh.index_format == 1 or not mesh.use_16bit_indices:
+			return "<u4"
+		return "<u2"
+
 	def extract_indices(self):
+		np = _import_numpy()
+		dtype = np.dtype(self.get_index_dtype())
+		index_buffer = self.mesh.index_buffer
 		for sub in self.mesh.submeshes:
-			sub_indices = []
-			sub_triangles = []
-			buf = BinaryReader(BytesIO(self.mesh.index_buffer))
-			buf.seek(sub.first_byte)
-			for i in range(0, sub.index_count):
-				sub_indices.append(buf.read_uint16())
-			if not sub.topology:
-				sub_triangles.extend(sub_indices)
-			else:
+			if _get(sub, "topology"):
 				raise NotImplementedError("(%s) topologies are not supported" % (self.mesh.name))
-
+			first_byte = int(_get(sub, "firstByte"))
+			index_count = int(_get(sub, "indexCount"))
+			if first_byte + index_count * dtype.itemsize > len(index_buffer):
+				raise ValueError("(%s) submesh indices are out of the index buffer" % (self.mesh.name))
+			sub_indices = np.frombuffer(index_buffer, dtype, index_count, first_byte)
 			self.indices.append(sub_indices)
-			self.triangles.append(sub_triangles)
+			self.triangles.append(sub_indices)
 
-	def extract_vertices(self):
-		# unity 5+ has 8 channels (6 otherwise)
-		v5_channel_count = 8
-		buf = BinaryReader(BytesIO(self.mesh.vertex_data.data))
+	def get_channels(self):
+		"""
+		Return the (stream, offset, format, dimension) of each vertex channel.
+		"""
 		channels = self.mesh.vertex_data.channels
-		# actual streams attribute 'm_Streams' may only exist in unity 4,
-		# use of channel data alone seems to be sufficient
-		stream_count = self.get_num_streams(channels)
-		channel_count = len(channels)
-
-		for s in range(0, stream_count):
-			for i in range(0, self.mesh.vertex_data.vertex_count):
-				for j in range(0, channel_count):
-					ch = None
-					if channel_count > 0:
-						ch = channels[j]
-						# format == 1, use half-floats (16 bit)
-						if ch["format"] == 1:
-							raise NotImplementedError("(%r) 16 bit floats are not supported" % (self.mesh))
-					# read the appropriate vertex value into the correct list
-					if ch and ch["dimension"] > 0 and ch["stream"] == s:
-						if j == 0:
-							self.vertices.append(OBJVector3().read(buf))
-						elif j == 1:
-							self.normals.append(OBJVector3().read(buf))
-						elif j == 2:
-							self.colors.append(OBJVector4().read_color(buf))
-						elif j == 3:
-							self.uv1.append(OBJVector2().read(buf))
-						elif j == 4:
-							self.uv2.append(OBJVector2().read(buf))
-						elif j == 5:
-							if channel_count == v5_channel_count:
-								self.uv3.append(OBJVector2().read(buf))
-							else:
-								self.tangents.append(OBJVector4().read(buf))
-						elif j == 6:  # for unity 5+
-							self.uv4.append(OBJVector2().read(buf))
-						elif j == 7:  # for unity 5+
-							self.tangents.append(OBJVector4().read(buf))
-			# TODO investigate possible alignment here, after each stream
-
-	def get_num_streams(self, channels):
-		streams = []
-		# scan the channel's stream value for distinct entries
-		for c in channels:
-			if c["stream"] not in streams:
-				streams.append(c["stream"])
-
-		return len(streams)
+		if channels is None:
+			return []
+		return [
+			(int(_get(ch, "stream")), int(_get(ch, "offset")), int(_get(ch, "format")), int(_get(ch, "dimension")) & 0xF)
+			for ch in channels
+		]
+
+	def get_streams(self, channels):
+		"""
+		Return the (offset, stride) of each vertex stream in the vertex data.
+		The stride is None when a channel of the stream has an unknown format.
+		"""
+		np = _import_numpy()
+		vertex_data = self.mesh.vertex_data
+		if vertex_data.streams is not None and len(vertex_data.streams):
+			# before Unity 5, streams are serialized
+			return [(int(_get(s, "offset")), int(_get(s, "stride"))) for s in vertex_data.streams]
+
+		strides = {}
+		for stream, offset, format, dimension in channels:
+			stride = strides.setdefault(stream, 0)
+			if not dimension or stride is None:
+				continue
+			if format not in self.vertex_formats:
+				strides[stream] = None
+				continue
+			size = dimension * np.dtype(self.vertex_formats[format]).itemsize
+			strides[stream] = max(stride, offset + size)
+
+		ret = []
+		offset = 0
+		for stream in range(max(strides, default=-1) + 1):
+			stride = strides.get(stream, 0)
+			ret.append((offset, stride))
+			if offset is not None:
+				if stride is None:
+					offset = None
+				else:
+					# streams are aligned to 16 bytes
+					offset = (offset + int(vertex_data.vertex_count) * stride + 15) & -16
+		return ret
+
+	def extract_vertices(self):
+		np = _import_numpy()
+		vertex_data = self.mesh.vertex_data
+		data = vertex_data.data
+		vertex_count = int(vertex_data.vertex_count)
+		channels = self.get_channels()
+		if not channels:
+			return
+		if len(channels) not in VERTEX_CHANNELS:
+			raise NotImplementedError("(%s) %i vertex channels are not supported" % (self.mesh.name, len(channels)))
+		streams = self.get_streams(channels)
+
+		for attr, (stream, offset, format, dimension) in zip(VERTEX_CHANNELS[len(channels)], channels):
+			if attr is None or not dimension:
+				continue
+			if format not in self.vertex_formats:
+				raise NotImplementedError("(%s) vertex format %i is not supported" % (self.mesh.name, format))
+			stream_offset, stride = streams[stream]
+			if stream_offset is None or stride is None:
+				raise NotImplementedError("(%s) vertex stream %i has an unsupported layout" % (self.mesh.name, stream))
+			dtype = np.dtype(self.vertex_formats[format])
+			offset += stream_offset
+			if not vertex_count:
+				setattr(self, attr, np.empty((0, dimension), dtype))
+				continue
+			if offset + (vertex_count - 1) * stride + dimension * dtype.itemsize > len(data):
+				raise ValueError("(%s) vertex channel %r is out of the vertex data" % (self.mesh.name, attr))
+			# a strided view of the channel in its stream
+			values = np.ndarray(
+				(vertex_count, dimension), dtype, buffer=data, offset=offset,
+				strides=(stride, dtype.itemsize)
+			)
+			setattr(self, attr, values)
 
 
 class OBJMesh:
-	def __init__(self, mesh):
+	def __init__(self, mesh, unity_version=None):
 		if mesh.mesh_compression:
 			# TODO handle compressed meshes
 			raise NotImplementedError("(%s) compressed meshes are not supported" % (mesh.name))
-		self.mesh_data = MeshData(mesh)
+		self.mesh_data = MeshData(mesh, unity_version)
 		self.mesh = mesh
 
 	@staticmethod
-	def face_str(indices, coords, normals):
-		ret = ["f "]
-		for i in indices[::-1]:
-			ret.append(str(i + 1))
-			if coords or normals:
-				ret.append("/")
-				if coords:
-					ret.append(str(i + 1))
-				if normals:
-					ret.append("/")
-					ret.append(str(i + 1))
-			ret.append(" ")
-		ret.append("\n")
-		return "".join(ret)
+	def face_format(coords, normals):
+		"""
+		The format of a face line, and how many times each index is repeated in it.
+		"""
+		if coords and normals:
+			vertex, repeat = "%d/%d/%d ", 3
+		elif coords:
+			vertex, repeat = "%d/%d ", 2
+		elif normals:
+			vertex, repeat = "%d//%d ", 2
+		else:
+			vertex, repeat = "%d ", 1
+		return "f " + vertex * 3 + "\n", repeat
 
-	def export(self):
-		ret = []
+	@staticmethod
+	def write_rows(f, line_format, rows, chunk_size, transform=None):
+		"""
+		Write a line for each row of a 2D array, formatting chunk_size rows at once.
+		"""
+		written = 0
+		for start in range(0, len(rows), chunk_size):
+			chunk = rows[start:start + chunk_size]
+			if transform is not None:
+				chunk = transform(chunk)
+			written += f.write((line_format * len(chunk)) % tuple(chunk.ravel().tolist()))
+		return written
+
+	def write(self, f, chunk_size=16384):
+		"""
+		Write the mesh in OBJ format to the text file object f, chunk_size
+		lines at a time. Returns the number of characters written.
+		"""
+		np = _import_numpy()
 		verts_per_face = 3
 		normals = self.mesh_data.normals
 		tex_coords = self.mesh_data.uv1
-		if not tex_coords:
+		if not len(tex_coords):
 			tex_coords = self.mesh_data.uv2
 
-		for v in self.mesh_data.vertices:
-			ret.append("v %s\n" % (v))
-		for v in normals:
-			ret.append("vn %s\n" % (v))
-		for v in tex_coords:
-			ret.append("vt %s\n" % (v))
-		ret.append("\n")
+		# OBJ is right handed, and has its V coordinate going down
+		def flip_x(values):
+			values = values.astype(np.float32)
+			values[:, 0] = -values[:, 0]
+			return values
+
+		def flip_v(values):
+			values = values.astype(np.float32)
+			values[:, 1] = 1 - values[:, 1]
+			return values
+
+		# 9 significant digits are enough for a 32-bit float to read back the same
+		written = self.write_rows(f, "v %.9g %.9g %.9g\n", self.mesh_data.vertices[:, :3], chunk_size, flip_x)
+		written += self.write_rows(f, "vn %.9g %.9g %.9g\n", normals[:, :3], chunk_size, flip_x)
+		written += self.write_rows(f, "vt %.9g %.9g\n", tex_coords[:, :2], chunk_size, flip_v)
+		written += f.write("\n")
 
 		# write group name and set smoothing to 1
-		ret.append("g %s\n" % (self.mesh.name))
-		ret.append("s 1\n")
+		written += f.write("g %s\n" % (self.mesh.name))
+		written += f.write("s 1\n")
+
+		face_format, repeat = self.face_format(len(tex_coords), len(normals))
+
+		def face_indices(faces):
+			# reversed winding, 1-based
+			faces = faces[:, ::-1].astype(np.int64) + 1
+			return np.repeat(faces, repeat, axis=1)
 
 		sub_count = len(self.mesh.submeshes)
 		for i in range(0, sub_count):
 			if sub_count == 1:
-				ret.append("usemtl %s\n" % (self.mesh.name))
+				written += f.write("usemtl %s\n" % (self.mesh.name))
 			else:
-				ret.append("usemtl %s_%d\n" % (self.mesh.name, i))
-			face_tri = []
-			for t in self.mesh_data.triangles[i]:
-				face_tri.append(t)
-				if len(face_tri) == verts_per_face:
-					ret.append(self.face_str(face_tri, tex_coords, normals))
-					face_tri = []
-			ret.append("\n")
-
-		return "".join(ret)
+				written += f.write("usemtl %s_%d\n" % (self.mesh.name, i))
+			triangles = self.mesh_data.triangles[i]
+			triangles = triangles[:len(triangles) // verts_per_face * verts_per_face]
+			faces = triangles.reshape(-1, verts_per_face)
+			written += self.write_rows(f, face_format, faces, chunk_size, face_indices)
+			written += f.write("\n")
+
+		return written
+
+	def export(self):
+		"""
+		Return the mesh in OBJ format. See write, to write it to a file.
+		"""
+		ret = StringIO()
+		self.write(ret)
+		return ret.getvalue()
@@ -0,0 +1,150 @@
+import hashlib
+import marshal
+import os
+import struct
+
+
+class MetadataCache:
+	"""
+	On-disk cache of parsed bundle and asset metadata: the UnityFS block
+	table and node list, and for each asset its header, type trees, object
+	table, adds and external refs.
+	Entries are keyed by the absolute path, size and mtime of the file and,
+	for UnityFS bundles, the GUID of the bundle, so a file that changed on
+	disk is parsed again.
+	Changes to entries are kept in memory until flush(), which is called
+	when the cache is used as a context manager exits.
+
+	Entries only hold plain types, stored with marshal after a header
+	checked on load. marshal is not hardened against malicious data, so
+	the directory must only be writable by those trusted to run the code.
+	"""
+	MAGIC = b"UPMETA"
+	VERSION = 2
+
+	def __init__(self, directory):
+		self.directory = directory
+		self.hits = 0
+		self.misses = 0
+		# entries changed since the last flush()
+		self.pending = []
+		os.makedirs(directory, exist_ok=True)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.flush()
+
+	def __repr__(self):
+		return "<%s %r (hits=%r, misses=%r)>" % (
+			self.__class__.__name__, self.directory, self.hits, self.misses
+		)
+
+	def get_key(self, path, guid=None):
+		try:
+			st = os.stat(path)
+		except (OSError, TypeError, ValueError):
+			return None
+		return (os.path.abspath(path), st.st_size, st.st_mtime_ns, guid)
+
+	def get_entry_path(self, key):
+		name = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+		return os.path.join(self.directory, name + ".meta")
+
+	def open(self, path, guid=None):
+		"""
+		Return the CacheEntry for a file, or None if the file can't be
+		cached (it has no path on disk). guid is the GUID of a UnityFS
+		bundle, as bytes.
+		"""
+		key = self.get_key(path, guid)
+		if key is None:
+			return None
+		data = self.read(key)
+		if data is None:
+			self.misses += 1
+			data = {"key": key, "bundle": None, "assets": {}}
+		else:
+			self.hits += 1
+		return CacheEntry(self, key, data)
+
+	def get_header(self):
+		# marshal formats differ between Python versions
+		return self.MAGIC + struct.pack("<II", self.VERSION, marshal.version)
+
+	def read(self, key):
+		header = self.get_header()
+		try:
+			with open(self.get_entry_path(key), "rb") as f:
+				raw = f.read()
+			if not raw.startswith(header):
+				return None
+			# marshal.load() reads files in small pieces
+			data = marshal.loads(memoryview(raw)[len(header):])
+		except (OSError, EOFError, ValueError, TypeError):
+			return None
+		if not isinstance(data, dict) or data.get("key") != key:
+			return None
+		return data
+
+	def write(self, key, data):
+		path = self.get_entry_path(key)
+		tmp_path = "%s.%d.tmp" % (path, os.getpid())
+		with open(tmp_path, "wb") as f:
+			f.write(self.get_header())
+			f.write(marshal.dumps(data))
+		# atomic, so concurrent runs never see a partial entry
+		os.replace(tmp_path, path)
+
+	def flush(self):
+		"""
+		Write the entries changed since the last flush, once each.
+		"""
+		pending, self.pending = self.pending, []
+		for entry in pending:
+			entry.save()
+
+
+class CacheEntry:
+	"""
+	The cached metadata of one file: a bundle, or a standalone asset.
+	Assets are stored by their index in the file. Changes are written by
+	save(), on leaving a with block, or by MetadataCache.flush().
+	"""
+	def __init__(self, cache, key, data):
+		self.cache = cache
+		self.key = key
+		self.data = data
+		self.dirty = False
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.save()
+
+	@property
+	def bundle(self):
+		return self.data["bundle"]
+
+	def set_bundle(self, metadata):
+		self.data["bundle"] = metadata
+		self.mark_dirty()
+
+	def get_asset(self, index):
+		return self.data["assets"].get(index)
+
+	def set_asset(self, index, metadata):
+		self.data["assets"][index] = metadata
+		self.mark_dirty()
+
+	def mark_dirty(self):
+		if not self.dirty:
+			self.dirty = True
+			self.cache.pending.append(self)
+
+	def save(self):
+		if self.dirty:
+			self.cache.write(self.key, self.data)
+			self.dirty = False
@@ -1,15 +1,18 @@
-﻿import logging
-from collections import OrderedDict
-from io import BytesIO
-from . import engine as UnityEngine
+﻿import struct
+from array import array
+from bisect import bisect_left
+from collections.abc import ItemsView, Mapping, ValuesView
 from .resources import UnityClass
-from .type import TypeMetadata, TypeTree, TypeTreeHint
-from .utils import BinaryReader
-from binascii import hexlify
-from uuid import UUID
+from .type import TypeMetadata
+from .typereader import get_reader, read_object
+
+
+_uint32 = struct.Struct("<I")
 
 
 def load_object(type, obj):
+	from . import engine as UnityEngine
+
 	clsname = type.type
 	if hasattr(UnityEngine, clsname):
 		obj = getattr(UnityEngine, clsname)(obj)
@@ -18,6 +21,11 @@ def load_object(type, obj):
 
 
 class ObjectInfo:
+	__slots__ = (
+		"asset", "path_id", "data_offset", "size", "type_id", "class_id",
+		"is_destroyed", "unk0", "unk1",
+	)
+
 	def __init__(self, asset):
 		self.asset = asset
 
@@ -61,25 +69,48 @@ class ObjectInfo:
 			return type_trees_alias[self.class_id]
 		return self.asset.types[self.type_id]
 
-	def load(self, buf):
-		self.path_id = self.read_id(buf)
-		self.data_offset = buf.read_uint() + self.asset.data_offset
-		self.size = buf.read_uint()
+	@staticmethod
+	def get_header_format(asset):
+		"""
+		Return the struct format of an object table entry for the asset's
+		serialization format, so that entries are read in one call.
+		"""
+		if asset.long_object_ids or asset.format >= 14:
+			fmt = "qIIi"
+		else:
+			fmt = "iIIi"
+		if asset.format < 17:
+			fmt += "h"
+		if asset.format <= 10:
+			fmt += "h"
+		if asset.format >= 11 and asset.format <= 16:
+			fmt += "h"
+		if asset.format >= 15 and asset.format <= 16:
+			fmt += "b"
+		return fmt
+
+	def load(self, buf, header_format=None):
+		if header_format is None:
+			header_format = self.get_header_format(self.asset)
+		values = buf.read_struct(header_format)
+		self.path_id, data_offset, self.size, type_id = values[:4]
+		self.data_offset = data_offset + self.asset.data_offset
 		if self.asset.format < 17:
-			self.type_id = buf.read_int()
-			self.class_id = buf.read_int16()
+			self.type_id = type_id
+			self.class_id = values[4]
+			extra = 5
 		else:
-			type_id = buf.read_int()
 			class_id = self.asset.tree.class_ids[type_id]
 			self.type_id = class_id
 			self.class_id = class_id
+			extra = 4
 		if self.asset.format <= 10:
-			self.is_destroyed = bool(buf.read_int16())
+			self.is_destroyed = bool(values[extra])
 		if self.asset.format >= 11 and self.asset.format <= 16:
-			self.unk0 = buf.read_int16()
+			self.unk0 = values[extra]
 
 		if self.asset.format >= 15 and self.asset.format <= 16:
-			self.unk1 = buf.read_byte()
+			self.unk1 = values[extra + 1]
 
 	def read_id(self, buf):
 		if self.asset.long_object_ids:
@@ -87,130 +118,67 @@ class ObjectInfo:
 		else:
 			return self.asset.read_id(buf)
 
-	def read(self):
+	def read(self, fields=None, numpy_arrays=False):
+		"""
+		Deserialize the object. With fields, only those top-level fields
+		(eg. ["m_Name", "m_Width"]) are decoded; the other fields are skipped
+		over without being decoded and are absent from the result.
+		With numpy_arrays, arrays of numbers and of fixed-size structs
+		(eg. Vector3f, Matrix4x4f) are read as read-only NumPy arrays over
+		the payload, with a structured dtype for structs. numpy is required.
+		"""
+		type_tree = self.type_tree
+		if type_tree is None:
+			return None
 		buf = self.asset._buf
-		#try:
 		buf.seek(self.asset._buf_ofs + self.data_offset)
-		object_buf = buf.read(self.size)
-		result = self.read_value(self.type_tree, BinaryReader(BytesIO(object_buf)))
-		#except ValueError:
-		#	return self.read_name_only()
-		return result
+		object_buf = buf.read_view(self.size)
+		return read_object(self, type_tree, object_buf, fields, numpy_arrays)
 
 	def read_name_only(self):
+		"""
+		Return {field name: name} for objects that start with a string
+		field (m_Name), or None. See peek_name.
+		"""
+		type = self.type_tree
+		name = self.peek_name(type)
+		if name is None:
+			return None
+		return {type.children[0].name: name}
+
+	def peek_name(self, type=None):
+		"""
+		Return the leading string field of the object (m_Name), or None if
+		the object doesn't start with one. Only the length and the string
+		bytes are read, not the rest of the payload.
+		"""
+		if type is None:
+			type = self.type_tree
+		if type is None or not type.children or type.children[0].type != "string":
+			return None
 		buf = self.asset._buf
 		buf.seek(self.asset._buf_ofs + self.data_offset)
-		object_buf = buf.read(self.size)
-		return self.read_name(self.type_tree, BinaryReader(BytesIO(object_buf)))
-
-	def read_name(self, type, buf):
-		first_child = type.children[0] if type.children else TypeTree(self.asset.format)
-		t = first_child.type
-		if t == "string":
-			size = buf.read_uint()
-			result = buf.read_string(size)
-			align = type.children[0].post_align
-			dict = ({
-				first_child.name: result
-			})
-			return dict
-		else:
-			#print("%r: first_child isn't a string (%r) and so we can't try to read the m_Name" % (self, t))
+		size = _uint32.unpack(buf.read(4))[0]
+		if size > self.size - 4:
 			return None
+		return buf.read_string(size)
 
 	def read_value(self, type, buf):
+		"""
+		Read a value of the given type at the position of buf, within the
+		payload of the object, and move buf past it.
+		"""
 		if type is None:
 			return None
-		align = False
-		expected_size = type.size
-		pos_before = buf.tell()
-		t = type.type
-		th = type.type_hint
-		first_child = type.children[0] if type.children else TypeTree(self.asset.format)
-		if th == TypeTreeHint.Bool:
-			result = buf.read_boolean()
-		elif th == TypeTreeHint.SInt8:
-			result = buf.read_byte()
-		elif th == TypeTreeHint.UInt8:
-			result = buf.read_ubyte()
-		elif th == TypeTreeHint.SInt16:
-			result = buf.read_int16()
-		elif th == TypeTreeHint.UInt16:
-			result = buf.read_uint16()
-		elif th == TypeTreeHint.SInt64:
-			result = buf.read_int64()
-		elif th == TypeTreeHint.UInt64:
-			result = buf.read_uint64()
-		elif th == TypeTreeHint.UInt32:
-			result = buf.read_uint()
-		elif th == TypeTreeHint.SInt32:
-			result = buf.read_int()
-		elif th == TypeTreeHint.Float:
-			buf.align()
-			result = buf.read_float()
-		elif th == TypeTreeHint.String:
-			size = buf.read_uint()
-			#if size > buf.buf.getbuffer().nbytes:
-			#	raise ValueError("string size {0} is larger than buffer size {1}".format(size, buf.buf.getbuffer().nbytes))
-			#if size == 2910172598:
-			#	size = size
-			result = buf.read_string(size)
-			align = type.children[0].post_align
-		elif th == TypeTreeHint.TypePtr:
-			result = buf.read_uint()
-		elif th == TypeTreeHint.GUID:
-			result = str( UUID(hexlify(buf.read(16)).decode("utf-8")) )
-		else:
-			if type.is_array:
-				first_child = type
-
-			if t.startswith("PPtr<"):
-				result = ObjectPointer(type, self.asset)
-				result.load(buf)
-				if not result:
-					result = None
-
-			elif first_child and first_child.is_array:
-				align = first_child.post_align
-				size = buf.read_int()
-				array_type = first_child.children[1]
-				if array_type.type_hint == TypeTreeHint.Char or array_type.type_hint == TypeTreeHint.UInt8:
-					result = buf.read(size)
-				else:
-					result = []
-					for i in range(size):
-						result.append(self.read_value(array_type, buf))
-			elif t == "pair":
-				assert len(type.children) == 2
-				first = self.read_value(type.children[0], buf)
-				second = self.read_value(type.children[1], buf)
-				result = (first, second)
-			else:
-				result = OrderedDict()
-
-				for child in type.children:
-					try:
-						result[child.name] = self.read_value(child, buf)
-					except (IOError, ValueError) as e:
-						logging.warn("\n{0}\n{1}\n{2}\n{3}".format(child.name, e, self.type_tree.pretty(), result))
-						raise
-
-				result = load_object(type, result)
-				if t == "StreamedResource":
-					result.asset = self.resolve_streaming_asset(result.source)
-				elif t == "StreamingInfo":
-					result.asset = self.resolve_streaming_asset(result.path)
-
-		# Check to make sure we read at least as many bytes the tree says.
-		# We allow reading more for the case of alignment.
-		pos_after = buf.tell()
-		actual_size = pos_after - pos_before
-		if expected_size > 0 and actual_size < expected_size:
-			raise ValueError("Expected read_value(%r in %r) to read %r bytes, but only read %r bytes" % (type, self, expected_size, actual_size))
-
-		if align or type.post_align:
-			buf.align()
-
+		pos = buf.tell()
+		end = self.asset._buf_ofs + self.data_offset + self.size
+		# start on a 4-byte boundary of the stream, so that values are
+		# aligned relative to the stream, as buf.align() does
+		start = pos & -4
+		buf.seek(start)
+		data = buf.read_view(max(end - start, 0))
+		result, end = get_reader(type)(self, data, pos - start)
+		buf.seek(start + end)
 		return result
 
 	def resolve_streaming_asset(self, path):
@@ -218,7 +186,197 @@ class ObjectInfo:
 			return self.asset.get_asset(path)
 
 
+class ObjectTable(Mapping):
+	"""
+	The object table of an asset: a read-only mapping of path_id to
+	ObjectInfo, stored as parallel arrays. ObjectInfo instances are
+	only created when an entry is accessed.
+	"""
+	COLUMNS = (
+		"path_ids", "data_offsets", "sizes", "type_ids", "class_ids",
+		"is_destroyed", "unk0", "unk1",
+	)
+
+	def __init__(self, asset):
+		self.asset = asset
+		self.path_ids = array("q")
+		self.data_offsets = array("Q")
+		self.sizes = array("I")
+		self.type_ids = array("i")
+		self.class_ids = array("i")
+		# format-specific fields, only filled in for formats that have them
+		self.is_destroyed = array("b")
+		self.unk0 = array("h")
+		self.unk1 = array("b")
+		# path_id -> row, only needed when path_ids aren't in ascending order
+		self._index = None
+		# class_id -> rows, built on the first of_class() call
+		self._class_index = None
+
+	def __repr__(self):
+		return "<%s %s (%i objects)>" % (self.__class__.__name__, self.asset, len(self))
+
+	def __len__(self):
+		return len(self.path_ids)
+
+	def __iter__(self):
+		return iter(self.path_ids)
+
+	def __contains__(self, path_id):
+		return self._row(path_id) >= 0
+
+	def __getitem__(self, path_id):
+		row = self._row(path_id)
+		if row < 0:
+			raise KeyError(path_id)
+		return self.get_row(row)
+
+	def _row(self, path_id):
+		if self._index is not None:
+			return self._index.get(path_id, -1)
+		path_ids = self.path_ids
+		row = bisect_left(path_ids, path_id)
+		if row < len(path_ids) and path_ids[row] == path_id:
+			return row
+		return -1
+
+	def get_row(self, row):
+		asset = self.asset
+		ret = ObjectInfo(asset)
+		ret.path_id = self.path_ids[row]
+		ret.data_offset = self.data_offsets[row]
+		ret.size = self.sizes[row]
+		ret.type_id = self.type_ids[row]
+		ret.class_id = self.class_ids[row]
+		if asset.format <= 10:
+			ret.is_destroyed = bool(self.is_destroyed[row])
+		if asset.format >= 11 and asset.format <= 16:
+			ret.unk0 = self.unk0[row]
+		if asset.format >= 15 and asset.format <= 16:
+			ret.unk1 = self.unk1[row]
+		return ret
+
+	def values(self):
+		return ObjectTableValues(self)
+
+	def items(self):
+		return ObjectTableItems(self)
+
+	def _has_object(self, obj):
+		return isinstance(obj, ObjectInfo) and obj.asset is self.asset and obj.path_id in self
+
+	def of_class(self, class_id):
+		"""
+		Iterate over the objects of a given class_id, without creating
+		an ObjectInfo for every other object in the table.
+		"""
+		if self._class_index is None:
+			index = {}
+			for row, cid in enumerate(self.class_ids):
+				if cid not in index:
+					index[cid] = array("I")
+				index[cid].append(row)
+			self._class_index = index
+		for row in self._class_index.get(class_id, ()):
+			yield self.get_row(row)
+
+	def load(self, buf, count):
+		asset = self.asset
+		header_format = ObjectInfo.get_header_format(asset)
+		class_ids = asset.tree.class_ids
+		first_extra = 5 if asset.format < 17 else 4
+		for i in range(count):
+			if asset.format >= 14:
+				buf.align()
+			values = buf.read_struct(header_format)
+			if asset.format < 17:
+				type_id, class_id = values[3], values[4]
+			else:
+				type_id = class_id = class_ids[values[3]]
+			self.append(values[0], values[1] + asset.data_offset, values[2], type_id, class_id, values[first_extra:])
+
+	def append(self, path_id, data_offset, size, type_id, class_id, extra=()):
+		"""
+		Add an entry. extra holds the format-specific fields, in the order
+		they are serialized: is_destroyed, or unk0 followed by unk1.
+		"""
+		path_ids = self.path_ids
+		row = len(path_ids)
+		if self._index is None and row and path_id <= path_ids[-1]:
+			# out of order: switch to a dict index
+			self._index = {pid: i for i, pid in enumerate(path_ids)}
+		if self._index is not None:
+			if path_id in self._index:
+				raise ValueError("Duplicate asset object: %r (path_id=%r)" % (self[path_id], path_id))
+			self._index[path_id] = row
+
+		path_ids.append(path_id)
+		self.data_offsets.append(data_offset)
+		self.sizes.append(size)
+		self.type_ids.append(type_id)
+		self.class_ids.append(class_id)
+		for column, value in zip(self.extra_columns(), extra):
+			column.append(value)
+		self._class_index = None
+
+	def get_state(self):
+		"""
+		A snapshot of the table columns as bytes, restored with set_state.
+		"""
+		return tuple(getattr(self, name).tobytes() for name in self.COLUMNS)
+
+	def set_state(self, state):
+		for name, data in zip(self.COLUMNS, state):
+			setattr(self, name, array(getattr(self, name).typecode, data))
+		path_ids = self.path_ids
+		if any(a >= b for a, b in zip(path_ids, path_ids[1:])):
+			self._index = {pid: i for i, pid in enumerate(path_ids)}
+		else:
+			self._index = None
+		self._class_index = None
+
+	def extra_columns(self):
+		format = self.asset.format
+		if format <= 10:
+			return (self.is_destroyed, )
+		elif format <= 14:
+			return (self.unk0, )
+		elif format <= 16:
+			return (self.unk0, self.unk1)
+		return ()
+
+
+class ObjectTableValues(ValuesView):
+	"""
+	The values() view of an ObjectTable. ObjectInfo instances are created
+	on access, so membership compares their asset and path_id.
+	"""
+	def __contains__(self, obj):
+		return self._mapping._has_object(obj)
+
+	def __iter__(self):
+		table = self._mapping
+		for row in range(len(table)):
+			yield table.get_row(row)
+
+
+class ObjectTableItems(ItemsView):
+	"""
+	The items() view of an ObjectTable.
+	"""
+	def __contains__(self, item):
+		path_id, obj = item
+		return self._mapping._has_object(obj) and obj.path_id == path_id
+
+	def __iter__(self):
+		table = self._mapping
+		for row, path_id in enumerate(table.path_ids):
+			yield path_id, table.get_row(row)
+
+
 class ObjectPointer:
+	__slots__ = ("type", "source_asset", "file_id", "path_id")
+
 	def __init__(self, type, asset):
 		self.type = type
 		self.source_asset = asset
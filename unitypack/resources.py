@@ -1,18 +1,39 @@
 import os
 import json
+import sys
+from functools import lru_cache
+from types import ModuleType
 
 
 def get_resource(name):
 	return os.path.join(os.path.dirname(__file__), name)
 
 
-with open(get_resource("strings.dat"), "rb") as f:
-	STRINGS_DAT = f.read()
+@lru_cache(maxsize=None)
+def get_strings_dat():
+	with open(get_resource("strings.dat"), "rb") as f:
+		return f.read()
 
 
-with open(get_resource("classes.json"), "r") as f:
-	UNITY_CLASSES = json.load(f)
+@lru_cache(maxsize=None)
+def get_unity_classes():
+	with open(get_resource("classes.json"), "r") as f:
+		return json.load(f)
 
 
 def UnityClass(i):
-	return UNITY_CLASSES.get(str(i), "<Unknown #%i>" % (i))
+	return get_unity_classes().get(str(i), "<Unknown #%i>" % (i))
+
+
+class _ResourcesModule(ModuleType):
+	# STRINGS_DAT and UNITY_CLASSES are only read when first used
+	@property
+	def STRINGS_DAT(self):
+		return get_strings_dat()
+
+	@property
+	def UNITY_CLASSES(self):
+		return get_unity_classes()
+
+
+sys.modules[__name__].__class__ = _ResourcesModule
@@ -1,8 +1,11 @@
-﻿from enum import IntEnum, IntFlag
-from io import BytesIO
+﻿import struct
+from collections import OrderedDict
+from collections.abc import Mapping
+from enum import IntEnum, IntFlag
+from weakref import WeakValueDictionary
 from .enums import BuildTargetPlatform
-from .resources import get_resource, STRINGS_DAT
-from .utils import BinaryReader
+from .resources import get_resource, get_strings_dat
+from .utils import MemoryReader
 
 class TypeTreeHint(IntEnum):
 	NULL = 0
@@ -41,8 +44,41 @@ class TypeTreeFlags(IntFlag):
 	DontValidateUTF8 = 1<<26
 
 
+# struct format characters of the primitive types in object data
+PRIMITIVE_FORMATS = {
+	TypeTreeHint.Bool: "?",
+	TypeTreeHint.SInt8: "b",
+	TypeTreeHint.UInt8: "B",
+	TypeTreeHint.SInt16: "h",
+	TypeTreeHint.UInt16: "H",
+	TypeTreeHint.SInt32: "i",
+	TypeTreeHint.UInt32: "I",
+	TypeTreeHint.SInt64: "q",
+	TypeTreeHint.UInt64: "Q",
+	TypeTreeHint.Float: "f",
+	TypeTreeHint.TypePtr: "I",
+}
+
+
+def _pad(fmt, offset):
+	padding = -offset & 3
+	if padding:
+		fmt.append("%ix" % (padding))
+	return offset + padding
+
+
+def _data_size(fmt):
+	# the size of a layout without its pad bytes, as counted by TypeTree.size
+	return struct.calcsize("<" + "".join(f for f in fmt if not f.endswith("x")))
+
 
 class TypeTree:
+	__slots__ = (
+		"children", "version", "is_array", "size", "index", "flags", "type",
+		"type_hint", "name", "format", "hash", "buffer_bytes", "data", "_reader",
+		"_numpy_reader", "_skipper", "_layout", "__weakref__",
+	)
+
 	NULL = "(null)"
 	kCommonStringBit = 0x80000000
 	kStringOffsetMask = ~kCommonStringBit
@@ -58,6 +94,7 @@ class TypeTree:
 		self.type_hint = TypeTreeHint.NULL
 		self.name = self.NULL
 		self.format = format
+		self.hash = None
 
 	def __repr__(self):
 		return "<%s %s (size=%r, index=%r, is_array=%r, flags=%r)>" % (
@@ -77,12 +114,89 @@ class TypeTree:
 	def post_align(self):
 		return bool(self.flags & 0x4000)
 
+	@property
+	def layout(self):
+		"""
+		The layout of the node when it has a fixed size: a tuple with the
+		(struct format, size) of the node read from a position of 0, 1, 2
+		or 3 modulo 4, as alignment is absolute. Alignment within the node
+		shows up as pad bytes; the trailing alignment of the node itself is
+		not included. None when the size varies: strings, arrays, and PPtrs,
+		whose width depends on the format of the asset holding them.
+		"""
+		try:
+			return self._layout
+		except AttributeError:
+			pass
+		layout = []
+		for start in range(4):
+			fmt = []
+			end = self._build_layout(fmt, start)
+			if end is None:
+				layout = None
+				break
+			layout.append(("<" + "".join(fmt), end - start))
+		if layout is not None:
+			layout = tuple(layout)
+		self._layout = layout
+		return layout
+
+	@property
+	def fixed_size(self):
+		"""
+		The size of the node read from an aligned position, or None if
+		its size varies. See layout.
+		"""
+		layout = self.layout
+		if layout is None:
+			return None
+		return layout[0][1]
+
+	def _build_layout(self, fmt, offset):
+		# This follows the dispatch of the compiled readers
+		th = self.type_hint
+		if th in PRIMITIVE_FORMATS:
+			if th == TypeTreeHint.Float:
+				# floats are aligned before they are read
+				offset = _pad(fmt, offset)
+			fmt.append(PRIMITIVE_FORMATS[th])
+			return offset + struct.calcsize("<" + PRIMITIVE_FORMATS[th])
+		elif th == TypeTreeHint.GUID:
+			fmt.append("16s")
+			return offset + 16
+		elif th == TypeTreeHint.String or self.is_array or self.type.startswith("PPtr<"):
+			return None
+		elif self.children and self.children[0].is_array:
+			return None
+
+		first = len(fmt)
+		for child in self.children:
+			offset = child._build_layout(fmt, offset)
+			if offset is None:
+				return None
+			if child.post_align:
+				offset = _pad(fmt, offset)
+		if self.size >= 0 and _data_size(fmt[first:]) != self.size:
+			# the fields do not add up to the node, as with leaves of types
+			# that are not primitives (double, a lone char): the readers
+			# then raise ValueError on the size check
+			return None
+		return offset
+
 	def load(self, buf):
 		if self.format == 10 or self.format >= 12:
 			self.load_blob(buf)
 		else:
 			self.load_old(buf)
 
+	@staticmethod
+	def skip_blob(buf):
+		"""
+		Skip over a blob-format type tree without parsing it.
+		"""
+		num_nodes, buffer_bytes = buf.read_struct("II")
+		buf.seek(24 * num_nodes + buffer_bytes, 1)
+
 	def load_old(self, buf):
 		self.type = buf.read_string()
 		self.name = buf.read_string()
@@ -101,17 +215,24 @@ class TypeTree:
 	def load_blob(self, buf):
 		num_nodes = buf.read_uint()
 		self.buffer_bytes = buf.read_uint()
-		node_data = BytesIO(buf.read(24 * num_nodes))
+		node_data = MemoryReader(buf.read(24 * num_nodes))
 		self.data = buf.read(self.buffer_bytes)
 
-		parents = [self]
-
-		buf = BinaryReader(node_data)
+		get_string = self.get_string
+		self.load_nodes(
+			(version, depth, is_array, get_string(type_offset), get_string(name_offset), size, index, flags)
+			for version, depth, is_array, type_offset, name_offset, size, index, flags
+			in node_data.read_array("hBbIIiIi", num_nodes)
+		)
 
-		for i in range(num_nodes):
-			version = buf.read_int16()
-			depth = buf.read_ubyte()
+	def load_nodes(self, nodes):
+		"""
+		Build the tree from a flat list of nodes in depth-first order:
+		(version, depth, is_array, type, name, size, index, flags)
+		"""
+		parents = [self]
 
+		for version, depth, is_array, type, name, size, index, flags in nodes:
 			if depth == 0:
 				curr = self
 			else:
@@ -122,24 +243,35 @@ class TypeTree:
 				parents.append(curr)
 
 			curr.version = version
-			curr.is_array = buf.read_byte()
-			curr.type = self.get_string(buf.read_uint())
-			curr.name = self.get_string(buf.read_uint())
-			curr.size = buf.read_int()
-			curr.index = buf.read_uint()
-			curr.flags = buf.read_int()
-			curr.type_hint = self.get_type_hint_index(curr.type)
+			curr.is_array = is_array
+			curr.type = type
+			curr.name = name
+			curr.size = size
+			curr.index = index
+			curr.flags = flags
+			curr.type_hint = self.get_type_hint_index(type)
+
+	def get_nodes(self, depth=0):
+		"""
+		The inverse of load_nodes.
+		"""
+		ret = [(self.version, depth, self.is_array, self.type, self.name, self.size, self.index, self.flags)]
+		for child in self.children:
+			ret += child.get_nodes(depth + 1)
+		return ret
 
 	def get_string(self, offset):
 		is_common_string = offset & TypeTree.kCommonStringBit
 		data_offset = offset & TypeTree.kStringOffsetMask
 		if is_common_string > 0:
-			data = STRINGS_DAT
+			data = get_strings_dat()
 		else:
 			data = self.data
 
-		result = data[data_offset:].partition(b"\0")[0].decode("utf-8")
-		return result
+		end = data.find(b"\0", data_offset)
+		if end < 0:
+			end = len(data)
+		return data[data_offset:end].decode("utf-8")
 
 	def get_type_hint_index(self, t: str) -> TypeTreeHint:
 		if t == "bool":
@@ -176,15 +308,110 @@ class TypeTree:
 			return TypeTreeHint.Other
 
 
+DEFAULT_REGISTRY_SIZE = 4096
+
+
+class TypeTreeRegistry:
+	"""
+	Process-wide registry of the type trees embedded in assets, keyed by
+	(format, class_id, hash). Assets from the same build embed identical
+	trees; they are parsed once and the same TypeTree is shared.
+	Up to max_size trees are kept, dropping the least recently used ones
+	(None for no limit). With weak=True, trees are dropped once no loaded
+	asset uses them instead.
+	"""
+	def __init__(self, weak=False, max_size=DEFAULT_REGISTRY_SIZE):
+		self.weak = weak
+		self.max_size = max_size
+		self.trees = WeakValueDictionary() if weak else OrderedDict()
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+	def __repr__(self):
+		return "<%s %d trees (hits=%r, misses=%r, evictions=%r)>" % (
+			self.__class__.__name__, len(self), self.hits, self.misses, self.evictions
+		)
+
+	def __len__(self):
+		return len(self.trees)
+
+	def get(self, key):
+		tree = self.trees.get(key)
+		if tree is None:
+			self.misses += 1
+		else:
+			self.hits += 1
+			if not self.weak:
+				self.trees.move_to_end(key)
+		return tree
+
+	def add(self, key, tree):
+		self.trees[key] = tree
+		if self.weak or self.max_size is None:
+			return
+		while len(self.trees) > self.max_size:
+			self.trees.popitem(last=False)
+			self.evictions += 1
+
+	def clear(self):
+		self.trees.clear()
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+
+def _is_null_hash(hash):
+	return not hash.strip(b"\0")
+
+
+class LazyTypeTreeTable(Mapping):
+	"""
+	A class_id -> TypeTree mapping over the type trees of a serialized
+	TypeMetadata, which only parses the trees that are looked up.
+	"""
+	def __init__(self, metadata, buf, format):
+		self.metadata = metadata
+		self.buf = buf
+		self.format = format
+		self.offsets = {}
+		self.trees = {}
+
+	def __len__(self):
+		return len(self.offsets)
+
+	def __iter__(self):
+		return iter(self.offsets)
+
+	def __contains__(self, class_id):
+		return class_id in self.offsets
+
+	def __getitem__(self, class_id):
+		tree = self.trees.get(class_id)
+		if tree is None:
+			offset = self.offsets[class_id]
+			self.buf.seek(offset)
+			tree = self.metadata.load_type_tree(self.buf, self.format, class_id, self.metadata.hashes[class_id])
+			self.trees[class_id] = tree
+		return tree
+
+	def add(self, class_id, offset):
+		self.offsets[class_id] = offset
+
+
 class TypeMetadata:
 	default_instance = None
+	# Shared by all assets; set to None to parse every tree separately
+	registry = TypeTreeRegistry()
 
 	@classmethod
 	def default(cls, asset):
 		if not cls.default_instance:
 			cls.default_instance = cls(asset)
 			with open(get_resource("structs.dat"), "rb") as f:
-				cls.default_instance.load(BinaryReader(f), format=15)
+				data = f.read()
+			# only the trees of the classes actually used get parsed
+			cls.default_instance.load(MemoryReader(data), format=15, lazy=True)
 		return cls.default_instance
 
 	def __init__(self, asset):
@@ -195,7 +422,11 @@ class TypeMetadata:
 		self.generator_version = ""
 		self.target_platform = None
 
-	def load(self, buf, format=None):
+	def load(self, buf, format=None, lazy=False):
+		"""
+		Load the metadata from buf. With lazy, the type trees are parsed
+		on first access instead; buf must then be kept readable.
+		"""
 		if format is None:
 			format = self.asset.format
 		self.generator_version = buf.read_string()
@@ -204,12 +435,12 @@ class TypeMetadata:
 		if format >= 13:
 			has_type_trees = buf.read_boolean()
 			num_types = buf.read_int()
+			if lazy:
+				self.type_trees = LazyTypeTreeTable(self, buf, format)
 
 			for i in range(num_types):
-				class_id = buf.read_int()
 				if format >= 17:
-					unk0 = buf.read_byte()
-					script_id = buf.read_int16()
+					class_id, unk0, script_id = buf.read_struct("ibh")
 					if class_id == 114:
 						if script_id >= 0:
 							# make up a fake negative class_id to work like the
@@ -219,6 +450,8 @@ class TypeMetadata:
 							class_id = -2 - script_id
 						else:
 							class_id = -1
+				else:
+					class_id = buf.read_int()
 				self.class_ids.append(class_id)
 				if class_id < 0:
 					hash = buf.read(0x20)
@@ -228,9 +461,11 @@ class TypeMetadata:
 				self.hashes[class_id] = hash
 
 				if has_type_trees:
-					tree = TypeTree(format)
-					tree.load(buf)
-					self.type_trees[class_id] = tree
+					if lazy:
+						self.type_trees.add(class_id, buf.tell())
+						TypeTree.skip_blob(buf)
+					else:
+						self.type_trees[class_id] = self.load_type_tree(buf, format, class_id, hash)
 
 		else:
 			num_fields = buf.read_int()
@@ -239,3 +474,54 @@ class TypeMetadata:
 				tree = TypeTree(format)
 				tree.load(buf)
 				self.type_trees[class_id] = tree
+
+	def load_type_tree(self, buf, format, class_id, hash):
+		tree = self.get_shared_tree(format, class_id, hash)
+		if tree is not None:
+			TypeTree.skip_blob(buf)
+			return tree
+
+		tree = TypeTree(format)
+		tree.load(buf)
+		return self.share_tree(tree, class_id, hash)
+
+	def get_shared_tree(self, format, class_id, hash):
+		# Some builds leave the hashes zeroed; those can't be told apart
+		if self.registry is None or _is_null_hash(hash):
+			return None
+		return self.registry.get((format, class_id, hash))
+
+	def share_tree(self, tree, class_id, hash):
+		tree.hash = hash
+		if self.registry is not None and not _is_null_hash(hash):
+			self.registry.add((tree.format, class_id, hash), tree)
+		return tree
+
+	def get_state(self):
+		"""
+		A snapshot of the metadata in plain types, restored with set_state.
+		"""
+		return {
+			"generator_version": self.generator_version,
+			"target_platform": int(self.target_platform),
+			"class_ids": self.class_ids,
+			"hashes": self.hashes,
+			"type_trees": {class_id: (tree.format, tree.get_nodes()) for class_id, tree in self.type_trees.items()},
+		}
+
+	def set_state(self, state):
+		self.generator_version = state["generator_version"]
+		self.target_platform = BuildTargetPlatform(state["target_platform"])
+		self.class_ids = state["class_ids"]
+		self.hashes = state["hashes"]
+		for class_id, (format, nodes) in state["type_trees"].items():
+			hash = self.hashes.get(class_id)
+			tree = None
+			if hash is not None:
+				tree = self.get_shared_tree(format, class_id, hash)
+			if tree is None:
+				tree = TypeTree(format)
+				tree.load_nodes(nodes)
+				if hash is not None:
+					self.share_tree(tree, class_id, hash)
+			self.type_trees[class_id] = tree
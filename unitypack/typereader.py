@@ -0,0 +1,704 @@
+import logging
+import struct
+from collections import OrderedDict
+from uuid import UUID
+from weakref import WeakKeyDictionary
+from .type import PRIMITIVE_FORMATS, TypeTreeHint
+
+
+# Cache of compiled readers that only read some fields, by tree then fields
+_projected_readers = WeakKeyDictionary()
+
+PRIMITIVE_STRUCTS = {th: struct.Struct("<" + fmt) for th, fmt in PRIMITIVE_FORMATS.items()}
+
+_int32 = struct.Struct("<i")
+_uint32 = struct.Struct("<I")
+_int64 = struct.Struct("<q")
+
+
+def _short_read(size, data, pos):
+	return IOError("Requested {0} bytes at offset {1} but buffer only has {2}".format(size, pos, max(len(data) - pos, 0)))
+
+
+def _size_error(tree, obj, read_size):
+	return ValueError("Expected read_value(%r in %r) to read %r bytes, but only read %r bytes" % (tree, obj, tree.size, read_size))
+
+
+def _read_bytes(data, pos, size):
+	end = pos + size
+	if size < 0 or end > len(data):
+		raise _short_read(size, data, pos)
+	return data[pos:end], end
+
+
+def _import_numpy():
+	try:
+		import numpy
+	except ImportError:
+		raise RuntimeError("numpy is required to read arrays as NumPy arrays")
+	return numpy
+
+
+def get_reader(tree, numpy_arrays=False):
+	"""
+	Return the compiled reader for a type tree, compiling it on first use.
+	A reader is called as reader(obj, data, pos) and returns (value, pos).
+	With numpy_arrays, arrays of fixed-size elements are read as NumPy arrays.
+	Readers are kept on the tree, and shared with the assets sharing it
+	through the TypeTreeRegistry.
+	"""
+	if numpy_arrays and tree.layout is not None:
+		# no arrays in there, the regular reader does the same
+		numpy_arrays = False
+	attr = "_numpy_reader" if numpy_arrays else "_reader"
+	reader = getattr(tree, attr, None)
+	if reader is None:
+		reader = compile_type_tree(tree, numpy_arrays)
+		setattr(tree, attr, reader)
+	return reader
+
+
+def get_skipper(tree):
+	"""
+	Return the compiled skipper for a type tree, compiling it on first use.
+	A skipper is called as skip(obj, data, pos) and returns the position
+	after the node, without decoding it.
+	"""
+	skip = getattr(tree, "_skipper", None)
+	if skip is None:
+		skip = compile_skipper(tree)
+		tree._skipper = skip
+	return skip
+
+
+def get_projected_reader(tree, fields, numpy_arrays=False):
+	"""
+	Return a reader for a struct type tree that only decodes the given
+	top-level fields, and skips over the others.
+	"""
+	key = (frozenset(fields), numpy_arrays)
+	readers = _projected_readers.setdefault(tree, {})
+	reader = readers.get(key)
+	if reader is None:
+		reader = _finish(tree, _compile_struct(tree, key[0], numpy_arrays), False)
+		readers[key] = reader
+	return reader
+
+
+def read_object(obj, tree, data, fields=None, numpy_arrays=False):
+	"""
+	Deserialize the payload of an object using the compiled reader
+	for its type tree. With fields, only those top-level fields are
+	decoded and the result only contains them. With numpy_arrays,
+	arrays of fixed-size elements are read as NumPy arrays.
+	"""
+	if tree is None:
+		return None
+	if fields is None:
+		return get_reader(tree, numpy_arrays)(obj, data, 0)[0]
+	value, pos = get_projected_reader(tree, fields, numpy_arrays)(obj, data, 0)
+	if pos > len(data):
+		raise _short_read(pos, data, 0)
+	return value
+
+
+def compile_type_tree(tree, numpy_arrays=False):
+	body, align = _compile_body(tree, numpy_arrays)
+	return _finish(tree, body, align)
+
+
+def _finish(tree, body, align):
+	"""
+	Wrap a node body with the size check and trailing alignment of the node.
+	The size check is dropped when the body always reads enough bytes.
+	"""
+	expected_size = tree.size
+	align = align or tree.post_align
+
+	if expected_size <= 0 or getattr(body, "min_size", -1) >= expected_size:
+		if not align:
+			return body
+
+		def read_aligned(obj, data, pos):
+			value, pos = body(obj, data, pos)
+			return value, (pos + 3) & -4
+		return read_aligned
+
+	def read_checked(obj, data, pos):
+		value, end = body(obj, data, pos)
+		if end - pos < expected_size:
+			raise _size_error(tree, obj, end - pos)
+		if align:
+			end = (end + 3) & -4
+		return value, end
+	return read_checked
+
+
+def _compile_body(tree, numpy_arrays=False):
+	"""
+	Compile the body of a node, without its size check or trailing alignment.
+	Returns (reader, align) where align is an extra alignment request
+	coming from the node's children (strings and arrays).
+	"""
+	th = tree.type_hint
+
+	if th in PRIMITIVE_STRUCTS:
+		return _compile_primitive(th, PRIMITIVE_STRUCTS[th]), False
+	elif th == TypeTreeHint.String:
+		return _compile_string(), tree.children[0].post_align
+	elif th == TypeTreeHint.GUID:
+		return _compile_guid(), False
+
+	if tree.is_array:
+		first_child = tree
+	elif tree.children:
+		first_child = tree.children[0]
+	else:
+		first_child = None
+
+	if tree.type.startswith("PPtr<"):
+		return _compile_pptr(tree), False
+	elif first_child is not None and first_child.is_array:
+		return _compile_array(first_child.children[1], numpy_arrays), first_child.post_align
+	elif tree.children and tree.layout is not None:
+		return _compile_fixed(tree), False
+	elif tree.type == "pair":
+		assert len(tree.children) == 2
+		return _compile_pair(tree, numpy_arrays), False
+	return _compile_struct(tree, numpy_arrays=numpy_arrays), False
+
+
+def _compile_primitive(th, st):
+	unpack_from = st.unpack_from
+	size = st.size
+
+	if th == TypeTreeHint.Float:
+		def read_float(obj, data, pos):
+			pos = (pos + 3) & -4
+			try:
+				return unpack_from(data, pos)[0], pos + 4
+			except struct.error:
+				raise _short_read(4, data, pos)
+		read_float.min_size = 4
+		return read_float
+
+	def read_primitive(obj, data, pos):
+		try:
+			return unpack_from(data, pos)[0], pos + size
+		except struct.error:
+			raise _short_read(size, data, pos)
+	read_primitive.min_size = size
+	return read_primitive
+
+
+def _compile_string():
+	unpack_size = _uint32.unpack_from
+
+	def read_string(obj, data, pos):
+		try:
+			size = unpack_size(data, pos)[0]
+		except struct.error:
+			raise _short_read(4, data, pos)
+		ret, pos = _read_bytes(data, pos + 4, size)
+		try:
+			return str(ret, "utf-8"), pos
+		except UnicodeDecodeError:
+			return bytes(ret), pos
+	return read_string
+
+
+def _compile_guid():
+	def read_guid(obj, data, pos):
+		ret, pos = _read_bytes(data, pos, 16)
+		return str(UUID(bytes=bytes(ret))), pos
+	read_guid.min_size = 16
+	return read_guid
+
+
+def _compile_pptr(tree):
+	from .object import ObjectPointer
+
+	unpack_file_id = _int32.unpack_from
+
+	def read_pptr(obj, data, pos):
+		asset = obj.asset
+		ret = ObjectPointer(tree, asset)
+		try:
+			ret.file_id = unpack_file_id(data, pos)[0]
+			if asset.format >= 14:
+				ret.path_id = _int64.unpack_from(data, pos + 4)[0]
+				pos += 12
+			else:
+				ret.path_id = _int32.unpack_from(data, pos + 4)[0]
+				pos += 8
+		except struct.error:
+			raise _short_read(8, data, pos)
+		if not ret:
+			ret = None
+		return ret, pos
+	return read_pptr
+
+
+def _aligned_layout(tree):
+	"""
+	The layout of a fixed-size node including its trailing alignment,
+	as consumed by its reader or skipper. None if its size varies.
+	"""
+	layout = tree.layout
+	if layout is None or not tree.post_align:
+		return layout
+	ret = []
+	for start, (fmt, size) in enumerate(layout):
+		padding = -(start + size) & 3
+		if padding:
+			fmt += "%ix" % (padding)
+		ret.append((fmt, size + padding))
+	return tuple(ret)
+
+
+def _build_value(values, i):
+	return values[i]
+
+
+def _build_guid(values, i):
+	return str(UUID(bytes=values[i]))
+
+
+def _compile_builder(tree):
+	"""
+	Compile a builder for a fixed-size node, which makes the value of the
+	node out of the values unpacked with its layout.
+	Returns (count, build): build(values, i) uses the count values from i.
+	"""
+	from . import engine as UnityEngine
+
+	th = tree.type_hint
+	if th in PRIMITIVE_STRUCTS:
+		return 1, _build_value
+	elif th == TypeTreeHint.GUID:
+		return 1, _build_guid
+
+	children = [_compile_builder(child) for child in tree.children]
+	count = sum(n for n, build in children)
+
+	if tree.type == "pair":
+		assert len(children) == 2
+		(first_count, build_first), (second_count, build_second) = children
+
+		def build_pair(values, i):
+			return (build_first(values, i), build_second(values, i + first_count))
+		return count, build_pair
+
+	names = [child.name for child in tree.children]
+	cls = getattr(UnityEngine, tree.type, None)
+
+	if all(build is _build_value for n, build in children):
+		def build_flat_struct(values, i):
+			result = OrderedDict(zip(names, values[i:i + count] if i else values))
+			if cls is not None:
+				result = cls(result)
+			return result
+		return count, build_flat_struct
+
+	fields = [(name, n, build) for name, (n, build) in zip(names, children)]
+
+	def build_struct(values, i):
+		result = OrderedDict()
+		for name, n, build in fields:
+			result[name] = build(values, i)
+			i += n
+		if cls is not None:
+			result = cls(result)
+		return result
+	return count, build_struct
+
+
+def _compile_fixed(tree):
+	"""
+	Read a fixed-size struct with a single unpack.
+	"""
+	unpackers = [(struct.Struct(fmt).unpack_from, size) for fmt, size in tree.layout]
+	count, build = _compile_builder(tree)
+
+	def read_fixed(obj, data, pos):
+		unpack_from, size = unpackers[pos & 3]
+		try:
+			values = unpack_from(data, pos)
+		except struct.error:
+			raise _short_read(size, data, pos)
+		return build(values, 0), pos + size
+	read_fixed.min_size = min(size for fmt, size in tree.layout)
+	return read_fixed
+
+
+def _stable_residues(layout):
+	"""
+	For each start position modulo 4, whether elements with this layout
+	starting there are all laid out the same way, and so evenly spaced.
+	"""
+	ret = []
+	for start, (fmt, size) in enumerate(layout):
+		pos = (start + size) & 3
+		while pos != start and layout[pos][0] == fmt:
+			pos = (pos + size) & 3
+		ret.append(pos == start)
+	return ret
+
+
+def _compile_fixed_array(array_type, layout):
+	"""
+	Read an array of fixed-size elements. Once elements start at a
+	position from which they are evenly spaced, the rest of the array
+	is unpacked in bulk.
+	"""
+	unpack_size = _int32.unpack_from
+	structs = [struct.Struct(fmt) for fmt, size in layout]
+	stable = _stable_residues(layout)
+	count, build = _compile_builder(array_type)
+	if build is _build_value:
+		build = None
+	# elements must cover their size, as read_checked does for each one
+	min_size = min(size for fmt, size in layout)
+	short = min_size < array_type.size
+
+	def read_fixed_array(obj, data, pos):
+		try:
+			size = unpack_size(data, pos)[0]
+		except struct.error:
+			raise _short_read(4, data, pos)
+		if short and size > 0:
+			raise _size_error(array_type, obj, min_size)
+		pos += 4
+		ret = []
+		while size > 0:
+			st = structs[pos & 3]
+			if stable[pos & 3]:
+				end = pos + st.size * size
+				if end > len(data):
+					raise _short_read(end - pos, data, pos)
+				if build is None:
+					ret += [values[0] for values in st.iter_unpack(data[pos:end])]
+				else:
+					ret += [build(values, 0) for values in st.iter_unpack(data[pos:end])]
+				return ret, end
+			try:
+				values = st.unpack_from(data, pos)
+			except struct.error:
+				raise _short_read(st.size, data, pos)
+			ret.append(values[0] if build is None else build(values, 0))
+			pos += st.size
+			size -= 1
+		return ret, pos
+	return read_fixed_array
+
+
+def _numpy_dtype(np, tree, offset, itemsize=None):
+	"""
+	The NumPy dtype of a fixed-size node read from offset, following
+	its layout: structs get a structured dtype with their alignment
+	as padding. Returns (dtype, start of the value, end), or None if
+	the node has no dtype.
+	"""
+	th = tree.type_hint
+	if th in PRIMITIVE_FORMATS:
+		if th == TypeTreeHint.Float:
+			offset = (offset + 3) & -4
+		dtype = np.dtype("<" + PRIMITIVE_FORMATS[th])
+		if itemsize is not None and itemsize != dtype.itemsize:
+			return None
+		return dtype, offset, offset + dtype.itemsize
+	elif th == TypeTreeHint.GUID or not tree.children:
+		return None
+
+	start = offset
+	names, formats, offsets = [], [], []
+	for child in tree.children:
+		ret = _numpy_dtype(np, child, offset)
+		if ret is None:
+			return None
+		dtype, value_start, offset = ret
+		names.append(child.name)
+		formats.append(dtype)
+		offsets.append(value_start - start)
+		if child.post_align:
+			offset = (offset + 3) & -4
+	try:
+		dtype = np.dtype({
+			"names": names, "formats": formats, "offsets": offsets,
+			"itemsize": itemsize or offset - start,
+		})
+	except ValueError:
+		# eg. duplicate field names
+		return None
+	return dtype, start, offset
+
+
+def _compile_numpy_array(array_type, layout, read_list):
+	"""
+	Read an array of fixed-size elements as a NumPy array, with a
+	structured dtype for structs. The array is a read-only view of the
+	payload. Arrays whose elements aren't evenly spaced from where they
+	start, or have no dtype (GUIDs), are read with read_list instead.
+	"""
+	np = _import_numpy()
+	unpack_size = _int32.unpack_from
+	dtypes = []
+	for start, stable in enumerate(_stable_residues(layout)):
+		dtype = None
+		if stable:
+			ret = _numpy_dtype(np, array_type, start, layout[start][1])
+			if ret is not None and ret[1] == start:
+				dtype = ret[0]
+		dtypes.append(dtype)
+	if not any(dtype is not None for dtype in dtypes):
+		return read_list
+
+	def read_numpy_array(obj, data, pos):
+		dtype = dtypes[pos & 3]
+		if dtype is None:
+			return read_list(obj, data, pos)
+		try:
+			size = unpack_size(data, pos)[0]
+		except struct.error:
+			raise _short_read(4, data, pos)
+		pos += 4
+		size = max(size, 0)
+		end = pos + dtype.itemsize * size
+		if end > len(data):
+			raise _short_read(end - pos, data, pos)
+		return np.frombuffer(data, dtype, size, pos), end
+	return read_numpy_array
+
+
+def _compile_array(array_type, numpy_arrays=False):
+	unpack_size = _int32.unpack_from
+
+	if array_type.type_hint in (TypeTreeHint.Char, TypeTreeHint.UInt8):
+		def read_byte_array(obj, data, pos):
+			try:
+				size = unpack_size(data, pos)[0]
+			except struct.error:
+				raise _short_read(4, data, pos)
+			# a slice of the payload: bytes, or a memoryview for mapped files
+			return _read_bytes(data, pos + 4, size)
+		return read_byte_array
+
+	layout = _aligned_layout(array_type)
+	if layout is not None and all(size > 0 for fmt, size in layout):
+		read_array = _compile_fixed_array(array_type, layout)
+		if numpy_arrays:
+			read_array = _compile_numpy_array(array_type, layout, read_array)
+		return read_array
+
+	read_element = get_reader(array_type, numpy_arrays)
+
+	def read_array(obj, data, pos):
+		try:
+			size = unpack_size(data, pos)[0]
+		except struct.error:
+			raise _short_read(4, data, pos)
+		pos += 4
+		ret = []
+		append = ret.append
+		for i in range(size):
+			value, pos = read_element(obj, data, pos)
+			append(value)
+		return ret, pos
+	return read_array
+
+
+def _compile_pair(tree, numpy_arrays=False):
+	read_first = get_reader(tree.children[0], numpy_arrays)
+	read_second = get_reader(tree.children[1], numpy_arrays)
+
+	def read_pair(obj, data, pos):
+		first, pos = read_first(obj, data, pos)
+		second, pos = read_second(obj, data, pos)
+		return (first, second), pos
+	return read_pair
+
+
+def _compile_struct(tree, projection=None, numpy_arrays=False):
+	# imported here so that importing unitypack doesn't load every engine class
+	from . import engine as UnityEngine
+
+	if projection is None:
+		fields = [(child.name, get_reader(child, numpy_arrays)) for child in tree.children]
+	else:
+		fields = [
+			(child.name, get_reader(child, numpy_arrays)) if child.name in projection
+			else (None, get_skipper(child))
+			for child in tree.children
+		]
+	cls = getattr(UnityEngine, tree.type, None)
+
+	if tree.type == "StreamedResource":
+		streaming_path = "source"
+	elif tree.type == "StreamingInfo":
+		streaming_path = "path"
+	else:
+		streaming_path = None
+
+	def read_struct(obj, data, pos):
+		result = OrderedDict()
+		for name, read_field in fields:
+			try:
+				if name is None:
+					pos = read_field(obj, data, pos)
+				else:
+					result[name], pos = read_field(obj, data, pos)
+			except (IOError, ValueError) as e:
+				logging.warning("\n{0}\n{1}\n{2}\n{3}".format(name, e, obj.type_tree.pretty(), result))
+				raise
+
+		if cls is not None:
+			result = cls(result)
+		if streaming_path is not None:
+			result.asset = obj.resolve_streaming_asset(getattr(result, streaming_path))
+		return result, pos
+	return read_struct
+
+
+def compile_skipper(tree):
+	"""
+	Compile a skipper for a node. It moves over the same bytes as the
+	reader of the node, including alignment, without decoding them.
+	"""
+	th = tree.type_hint
+	align = tree.post_align
+
+	if th in PRIMITIVE_STRUCTS:
+		skip = _compile_skip_fixed(PRIMITIVE_STRUCTS[th].size, th == TypeTreeHint.Float)
+	elif tree.layout is not None:
+		skip = _compile_skip_layout(_aligned_layout(tree))
+		align = False
+	elif th == TypeTreeHint.String:
+		skip = _compile_skip_bytes(1)
+		align = align or tree.children[0].post_align
+	elif th == TypeTreeHint.GUID:
+		skip = _compile_skip_fixed(16, False)
+	else:
+		if tree.is_array:
+			first_child = tree
+		elif tree.children:
+			first_child = tree.children[0]
+		else:
+			first_child = None
+
+		if tree.type.startswith("PPtr<"):
+			skip = _compile_skip_pptr()
+		elif first_child is not None and first_child.is_array:
+			array_type = first_child.children[1]
+			align = align or first_child.post_align
+			if array_type.type_hint in (TypeTreeHint.Char, TypeTreeHint.UInt8):
+				skip = _compile_skip_bytes(1)
+			elif _aligned_layout(array_type) is not None:
+				skip = _compile_skip_fixed_array(array_type, _aligned_layout(array_type))
+			else:
+				skip = _compile_skip_array(get_skipper(array_type))
+		else:
+			skip = _compile_skip_children(tree, [get_skipper(child) for child in tree.children])
+
+	if not align:
+		return skip
+
+	def skip_aligned(obj, data, pos):
+		return (skip(obj, data, pos) + 3) & -4
+	return skip_aligned
+
+
+def _compile_skip_fixed(size, align_before):
+	if align_before:
+		# floats are aligned before they are read
+		def skip_aligned_fixed(obj, data, pos):
+			return ((pos + 3) & -4) + size
+		return skip_aligned_fixed
+
+	def skip_fixed(obj, data, pos):
+		return pos + size
+	return skip_fixed
+
+
+def _compile_skip_bytes(element_size):
+	unpack_size = _int32.unpack_from
+
+	def skip_bytes(obj, data, pos):
+		try:
+			size = unpack_size(data, pos)[0]
+		except struct.error:
+			raise _short_read(4, data, pos)
+		end = pos + 4 + size * element_size
+		if size < 0 or end > len(data):
+			raise _short_read(size * element_size, data, pos + 4)
+		return end
+	return skip_bytes
+
+
+def _compile_skip_layout(layout):
+	sizes = [size for fmt, size in layout]
+
+	def skip_layout(obj, data, pos):
+		return pos + sizes[pos & 3]
+	return skip_layout
+
+
+def _compile_skip_fixed_array(array_type, layout):
+	unpack_size = _int32.unpack_from
+	sizes = [size for fmt, size in layout]
+	stable = _stable_residues(layout)
+	short = min(sizes) < array_type.size
+
+	def skip_fixed_array(obj, data, pos):
+		try:
+			size = unpack_size(data, pos)[0]
+		except struct.error:
+			raise _short_read(4, data, pos)
+		if short and size > 0:
+			raise _size_error(array_type, obj, min(sizes))
+		pos += 4
+		while size > 0:
+			if stable[pos & 3]:
+				pos += sizes[pos & 3] * size
+				break
+			pos += sizes[pos & 3]
+			size -= 1
+		if pos > len(data):
+			raise _short_read(pos, data, 0)
+		return pos
+	return skip_fixed_array
+
+
+def _compile_skip_pptr():
+	def skip_pptr(obj, data, pos):
+		return pos + (12 if obj.asset.format >= 14 else 8)
+	return skip_pptr
+
+
+def _compile_skip_array(skip_element):
+	unpack_size = _int32.unpack_from
+
+	def skip_array(obj, data, pos):
+		try:
+			size = unpack_size(data, pos)[0]
+		except struct.error:
+			raise _short_read(4, data, pos)
+		pos += 4
+		for i in range(size):
+			pos = skip_element(obj, data, pos)
+			if pos > len(data):
+				raise _short_read(pos, data, 0)
+		return pos
+	return skip_array
+
+
+def _compile_skip_children(tree, skippers):
+	expected_size = tree.size
+
+	def skip_children(obj, data, pos):
+		start = pos
+		for skip in skippers:
+			pos = skip(obj, data, pos)
+		if pos - start < expected_size:
+			raise _size_error(tree, obj, pos - start)
+		return pos
+	return skip_children
@@ -1,7 +1,10 @@
-﻿import struct
+﻿import mmap
+import os
+import struct
 import sys
+import threading
+from collections import OrderedDict
 from os import SEEK_CUR
-import ctypes
 import datetime
 import enum
 
@@ -18,7 +21,21 @@ def lz4_decompress(data, size):
 def json_default(o):
     if isinstance(o, set):
         return list(o)
-    return o.__dict__
+    if hasattr(o, "__dict__"):
+        return o.__dict__
+    return slots_dict(o)
+
+def slots_dict(o):
+    """
+    Return the set attributes of an object using __slots__, in the order
+    they are declared.
+    """
+    ret = {}
+    for cls in reversed(type(o).__mro__):
+        for name in getattr(cls, "__slots__", ()):
+            if hasattr(o, name):
+                ret[name] = getattr(o, name)
+    return ret
 
 def to_serializable(val):
     if isinstance(val, datetime.datetime):
@@ -90,11 +107,39 @@ def extract_audioclip_samples(d) -> dict:
 	return ret
 
 
+class StructCache(dict):
+	"""
+	Precompiled struct.Struct objects for a given byte order,
+	created on first use of each format string.
+	"""
+	def __init__(self, endian):
+		super().__init__()
+		self.endian = endian
+
+	def __missing__(self, fmt):
+		ret = self[fmt] = struct.Struct(self.endian + fmt)
+		return ret
+
+
+CSTRING_CHUNK_SIZE = 64
+
+STRUCT_CACHES = {endian: StructCache(endian) for endian in ("<", ">")}
+
+
 class BinaryReader:
 	def __init__(self, buf, endian="<"):
 		self.buf = buf
 		self.endian = endian
 
+	@property
+	def endian(self):
+		return self._endian
+
+	@endian.setter
+	def endian(self, value):
+		self._endian = value
+		self._structs = STRUCT_CACHES[value]
+
 	def align(self):
 		old = self.tell()
 		new = (old + 3) & -4
@@ -104,7 +149,7 @@ class BinaryReader:
 	def read(self, *args):
 		buffer = self.buf.read(*args)
 		size = args[0]
-		if size != len(buffer):
+		if size >= 0 and size != len(buffer):
 			raise IOError("Requested {0} bytes but {1} buffer only gave {2}".format(size, self.buf.__class__, len(buffer)))
 		return buffer
 
@@ -114,52 +159,414 @@ class BinaryReader:
 	def tell(self):
 		return self.buf.tell()
 
+	def read_view(self, size):
+		"""
+		Read a raw payload. Readers backed by memory return a slice of the
+		underlying buffer instead of a copy.
+		"""
+		return self.read(size)
+
+	def read_struct(self, fmt) -> tuple:
+		"""
+		Read a fixed-layout record described by a struct format string
+		(without byte order prefix) in a single unpack call.
+		"""
+		st = self._structs[fmt]
+		return st.unpack(self.read(st.size))
+
+	def read_array(self, fmt, count) -> list:
+		"""
+		Read count consecutive records described by a struct format string
+		and return them as a list of tuples.
+		"""
+		st = self._structs[fmt]
+		return list(st.iter_unpack(self.read(st.size * count)))
+
 	def read_string(self, size=None, encoding="utf-8"):
 		if size is None:
 			ret = self.read_cstring()
 		else:
-			ret = struct.unpack(self.endian + "%is" % (size), self.read(size))[0]
+			ret = self.read(size)
 		try:
 			return ret.decode(encoding)
 		except UnicodeDecodeError:
 			return ret
 
 	def read_cstring(self) -> bytes:
+		# Read ahead in chunks and seek back past the terminator
 		ret = []
-		c = b""
-		while c != b"\0":
-			ret.append(c)
-			c = self.read(1)
-			if not c:
-				raise ValueError("Unterminated string: %r" % (ret))
-		return b"".join(ret)
+		while True:
+			chunk = self.buf.read(CSTRING_CHUNK_SIZE)
+			if not chunk:
+				raise ValueError("Unterminated string: %r" % (b"".join(ret)))
+			end = chunk.find(b"\0")
+			if end >= 0:
+				ret.append(chunk[:end])
+				self.buf.seek(end + 1 - len(chunk), SEEK_CUR)
+				return b"".join(ret)
+			ret.append(chunk)
+
+	def _read_primitive(self, fmt):
+		st = self._structs[fmt]
+		return st.unpack(self.read(st.size))[0]
 
 	def read_boolean(self) -> bool:
-		return bool(struct.unpack(self.endian + "b", self.read(1))[0])
+		return bool(self._read_primitive("b"))
 
 	def read_byte(self) -> int:
-		return ctypes.c_byte( struct.unpack(self.endian + "b", self.read(1))[0] ).value
+		return self._read_primitive("b")
 
 	def read_ubyte(self) -> int:
-		return ctypes.c_ubyte( struct.unpack(self.endian + "B", self.read(1))[0] ).value
+		return self._read_primitive("B")
 
 	def read_int16(self) -> int:
-		return ctypes.c_int16( struct.unpack(self.endian + "h", self.read(2))[0] ).value
+		return self._read_primitive("h")
 
 	def read_uint16(self) -> int:
-		return ctypes.c_uint16( struct.unpack(self.endian + "H", self.read(2))[0] ).value
+		return self._read_primitive("H")
 
 	def read_int(self) -> int:
-		return ctypes.c_int( struct.unpack(self.endian + "i", self.read(4))[0] ).value
+		return self._read_primitive("i")
 
 	def read_uint(self) -> int:
-		return ctypes.c_uint( struct.unpack(self.endian + "I", self.read(4))[0] ).value
+		return self._read_primitive("I")
 
 	def read_float(self) -> float:
-		return struct.unpack(self.endian + "f", self.read(4))[0]
+		return self._read_primitive("f")
 
 	def read_int64(self) -> int:
-		return ctypes.c_int64( struct.unpack(self.endian + "q", self.read(8))[0] ).value
+		return self._read_primitive("q")
 
 	def read_uint64(self) -> int:
-		return ctypes.c_uint64( struct.unpack(self.endian + "Q", self.read(8))[0] ).value
+		return self._read_primitive("Q")
+
+
+DEFAULT_MAX_OPEN_FILES = 64
+
+
+class FilePool:
+	"""
+	A bounded pool of open files, shared by PooledFile objects.
+	When more than max_files files are open, the least recently used one
+	is closed, and reopened by the next read of that path.
+	"""
+	def __init__(self, max_files=DEFAULT_MAX_OPEN_FILES):
+		if max_files < 1:
+			raise ValueError("max_files must be at least 1")
+		self.max_files = max_files
+		# path -> open file, in least recently used order
+		self._files = OrderedDict()
+		self._lock = threading.Lock()
+
+	def __len__(self):
+		return len(self._files)
+
+	def __repr__(self):
+		return "<%s %i/%i open>" % (self.__class__.__name__, len(self._files), self.max_files)
+
+	def open(self, path):
+		"""
+		Return a PooledFile reading path. The file is opened right away,
+		so that missing files fail here rather than on the first read.
+		"""
+		with self._lock:
+			self._get_handle(path)
+		return PooledFile(self, path)
+
+	def _get_handle(self, path):
+		f = self._files.get(path)
+		if f is not None:
+			self._files.move_to_end(path)
+			return f
+		while len(self._files) >= self.max_files:
+			self._files.popitem(last=False)[1].close()
+		f = self._files[path] = open(path, "rb")
+		return f
+
+	def get_handle(self, path):
+		with self._lock:
+			return self._get_handle(path)
+
+	def read(self, path, offset, size=-1):
+		with self._lock:
+			f = self._get_handle(path)
+			f.seek(offset)
+			return f.read(size)
+
+	def release(self, path):
+		with self._lock:
+			f = self._files.pop(path, None)
+		if f is not None:
+			f.close()
+
+	def close(self):
+		with self._lock:
+			files = list(self._files.values())
+			self._files.clear()
+		for f in files:
+			f.close()
+
+
+class PooledFile:
+	"""
+	A read-only file object that only stores its path and position, and
+	reads through the open files of a FilePool.
+	"""
+	def __init__(self, pool, path):
+		self.pool = pool
+		self.name = path
+		self._pos = 0
+		self.closed = False
+
+	def __repr__(self):
+		return "<%s %r>" % (self.__class__.__name__, self.name)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	def read(self, size=-1):
+		if self.closed:
+			raise ValueError("I/O operation on closed file.")
+		if size is None:
+			size = -1
+		ret = self.pool.read(self.name, self._pos, size)
+		self._pos += len(ret)
+		return ret
+
+	def seek(self, offset, whence=0):
+		if whence == 0:
+			pos = offset
+		elif whence == 1:
+			pos = self._pos + offset
+		elif whence == 2:
+			pos = os.path.getsize(self.name) + offset
+		else:
+			raise ValueError("invalid whence (%r)" % (whence))
+		if pos < 0:
+			raise ValueError("negative seek position %r" % (pos))
+		self._pos = pos
+		return pos
+
+	def tell(self):
+		return self._pos
+
+	def readable(self):
+		return True
+
+	def seekable(self):
+		return True
+
+	def fileno(self):
+		return self.pool.get_handle(self.name).fileno()
+
+	def close(self):
+		# the pool owns the open file, which other PooledFiles may share
+		self.closed = True
+
+
+def map_file(file):
+	"""
+	Memory-map an open file for reading. Empty files can't be mapped and
+	are returned as an empty bytes object instead.
+	"""
+	file.seek(0, 2)
+	if not file.tell():
+		return b""
+	return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class MemoryReader(BinaryReader):
+	"""
+	A BinaryReader over an in-memory buffer (bytes, bytearray, memoryview
+	or mmap) with an integer cursor. read_view() returns memoryview slices
+	so that object payloads are never copied.
+	"""
+	def __init__(self, data, endian="<"):
+		self.buf = data
+		self.view = memoryview(data)
+		self.pos = 0
+		self.endian = endian
+
+	def read(self, size=-1):
+		return self.read_view(size).tobytes()
+
+	def read_view(self, size=-1):
+		pos = self.pos
+		if size < 0:
+			end = len(self.view)
+		else:
+			end = pos + size
+			if end > len(self.view):
+				raise IOError("Requested {0} bytes but {1} buffer only gave {2}".format(size, self.buf.__class__, max(len(self.view) - pos, 0)))
+		self.pos = end
+		return self.view[pos:end]
+
+	def seek(self, offset, whence=0):
+		if whence == 1:
+			self.pos += offset
+		elif whence == 2:
+			self.pos = len(self.view) + offset
+		else:
+			self.pos = offset
+		return self.pos
+
+	def tell(self):
+		return self.pos
+
+	def read_cstring(self) -> bytes:
+		pos = self.pos
+		find = getattr(self.buf, "find", None)
+		if find is not None:
+			end = find(b"\0", pos)
+		else:
+			# memoryview has no find(), scan it in chunks
+			end = -1
+			start = pos
+			while start < len(self.view):
+				i = self.view[start:start + CSTRING_CHUNK_SIZE].tobytes().find(b"\0")
+				if i >= 0:
+					end = start + i
+					break
+				start += CSTRING_CHUNK_SIZE
+		if end < 0:
+			raise ValueError("Unterminated string: %r" % (self.view[pos:pos + CSTRING_CHUNK_SIZE].tobytes()))
+		self.pos = end + 1
+		return self.view[pos:end].tobytes()
+
+	def _read_primitive(self, fmt):
+		st = self._structs[fmt]
+		pos = self.pos
+		try:
+			ret = st.unpack_from(self.view, pos)[0]
+		except struct.error:
+			raise IOError("Requested {0} bytes but {1} buffer only gave {2}".format(st.size, self.buf.__class__, max(len(self.view) - pos, 0)))
+		self.pos = pos + st.size
+		return ret
+
+	def read_struct(self, fmt) -> tuple:
+		st = self._structs[fmt]
+		return st.unpack(self.read_view(st.size))
+
+	def read_array(self, fmt, count) -> list:
+		st = self._structs[fmt]
+		return list(st.iter_unpack(self.read_view(st.size * count)))
+
+
+LZMA_CHUNK_SIZE = 1024 * 1024
+
+
+class LZMAStream:
+	"""
+	A seekable, read-only file-like object over LZMA-compressed data,
+	decompressed incrementally as far as reads require. Compressed input
+	is consumed in chunks and each decompression step produces at most
+	chunk_size bytes, so the compressed data is never held all at once.
+	The first offset bytes of output are skipped.
+
+	Output is kept once decompressed, so seeking back is free. Data read
+	front to back can pass seek_back to keep only a window of the output
+	instead: data more than seek_back bytes before the read position is
+	then discarded, and seeking back further than that restarts
+	decompression with a new decompressor from make_decompressor.
+	"""
+	def __init__(self, source, make_decompressor, offset=0, chunk_size=LZMA_CHUNK_SIZE, seek_back=None):
+		self.source = source
+		self.start_pos = source.tell()
+		self.make_decompressor = make_decompressor
+		self.offset = offset
+		self.chunk_size = chunk_size
+		self.seek_back = seek_back
+		self.pos = 0
+		self.size = None
+		self._restart()
+
+	def _restart(self):
+		self.decompressor = self.make_decompressor()
+		self.source_pos = self.start_pos
+		# data holds the output from position base (negative in the prefix)
+		self.data = bytearray()
+		self.base = -self.offset
+		self.eof = False
+
+	def _discard(self, keep):
+		# deleting from the front of a bytearray does not move the rest
+		if self.seek_back is None:
+			# only the skipped prefix is dropped
+			keep = 0
+		if keep > self.base:
+			count = min(keep - self.base, len(self.data))
+			del self.data[:count]
+			self.base += count
+
+	def _fill(self, end, keep):
+		"""
+		Decompress until the window reaches end (or the end of the data if
+		end is None), discarding output before keep. If keep is None, only
+		seek_back bytes before the end of the window are kept.
+		"""
+		dec = self.decompressor
+		while not self.eof and (end is None or self.base + len(self.data) < end):
+			if dec.needs_input:
+				self.source.seek(self.source_pos)
+				chunk = self.source.read(self.chunk_size)
+				self.source_pos += len(chunk)
+				if not chunk:
+					self.eof = True
+					break
+			else:
+				chunk = b""
+			self.data += dec.decompress(chunk, max_length=self.chunk_size)
+			if dec.eof:
+				self.eof = True
+			if keep is None:
+				self._discard(self.base + len(self.data) - (self.seek_back or 0))
+			else:
+				self._discard(keep)
+		if self.eof:
+			self.size = self.base + len(self.data)
+
+	def __len__(self):
+		if self.size is None:
+			if self.pos < self.base:
+				self._restart()
+			self._fill(None, None)
+		return self.size
+
+	def read(self, size=-1):
+		pos = self.pos
+		if pos < self.base:
+			self._restart()
+		end = None if size < 0 else pos + size
+		keep = pos - (self.seek_back or 0)
+		self._fill(end, keep)
+		self._discard(keep)
+		start = pos - self.base
+		stop = len(self.data) if end is None else min(end - self.base, len(self.data))
+		if start >= stop:
+			return b""
+		with memoryview(self.data) as view:
+			ret = bytes(view[start:stop])
+		self.pos += len(ret)
+		return ret
+
+	def seek(self, offset, whence=0):
+		if whence == 1:
+			self.pos += offset
+		elif whence == 2:
+			self.pos = len(self) + offset
+		else:
+			self.pos = offset
+		return self.pos
+
+	def tell(self):
+		return self.pos
+
+	def getvalue(self):
+		pos = self.pos
+		self.pos = 0
+		ret = self.read()
+		self.pos = pos
+		return ret